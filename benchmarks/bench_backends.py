@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""Benchmark the pure-Python and NumPy aggregation backends.
+
+Run with ``python benchmarks/bench_backends.py``. Each row aggregates every
+FUNCTIONS entry over `series` series of 10s datapoints spanning 7 days.
+"""
+
+from __future__ import print_function
+
+import sys
+import random
+import timeit
+
+sys.path.append('.')
+from nagios_graphite import vectorized  # NOQA
+from nagios_graphite.main import aggregate_series, parse_functions  # NOQA
+
+POINTS_PER_SERIES = 7 * 24 * 360
+SERIES_COUNTS = [1, 10, 50]
+NULL_RATIO = 0.05
+
+
+def make_series(count, points=POINTS_PER_SERIES):
+    rnd = random.Random(count)
+    return [
+        {"target": "host{0}".format(i),
+         "datapoints": [
+             [None if rnd.random() < NULL_RATIO else rnd.random(), j]
+             for j in range(points)]}
+        for i in range(count)
+    ]
+
+
+def main():
+    if not vectorized.available():
+        print("numpy is not installed, nothing to compare")
+        return
+
+    names = parse_functions("all")
+    print("{0:>8} {1:>12} {2:>12} {3:>9}".format(
+        "series", "python (ms)", "numpy (ms)", "speedup"))
+    for count in SERIES_COUNTS:
+        series = make_series(count)
+        timings = []
+        for backend in ("python", "numpy"):
+            timings.append(min(timeit.repeat(
+                lambda: aggregate_series(series, names, backend),
+                number=1, repeat=3)))
+        print("{0:>8} {1:>12.1f} {2:>12.1f} {3:>8.1f}x".format(
+            count, timings[0] * 1e3, timings[1] * 1e3,
+            timings[0] / timings[1]))
+
+
+if __name__ == '__main__':
+    main()
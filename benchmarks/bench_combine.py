@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""Benchmark `combine` as the number of series in a query result grows.
+
+Run with ``python benchmarks/bench_combine.py``. The time per datapoint
+should stay flat as the series count increases.
+"""
+
+from __future__ import print_function
+
+import sys
+import timeit
+
+sys.path.append('.')
+from nagios_graphite.main import FUNCTIONS, combine  # NOQA
+
+POINTS_PER_SERIES = 60
+SERIES_COUNTS = [10, 100, 1000, 2000, 5000]
+
+
+def make_series(count, points=POINTS_PER_SERIES):
+    return [
+        {"target": "host{0}".format(i),
+         "datapoints": [[float(j), j] for j in range(points)]}
+        for i in range(count)
+    ]
+
+
+def main():
+    aggfn = FUNCTIONS["avg"]
+    print("{0:>8} {1:>12} {2:>14}".format(
+        "series", "total (ms)", "ns / point"))
+    for count in SERIES_COUNTS:
+        series = make_series(count)
+        runs = 5
+        elapsed = min(timeit.repeat(
+            lambda: combine(series, aggfn), number=1, repeat=runs))
+        points = count * POINTS_PER_SERIES
+        print("{0:>8} {1:>12.2f} {2:>14.1f}".format(
+            count, elapsed * 1e3, elapsed * 1e9 / points))
+
+
+if __name__ == '__main__':
+    main()
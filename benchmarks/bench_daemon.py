@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""Compare checks/sec of cold invocations against the check daemon.
+
+Run with ``python benchmarks/bench_daemon.py [N]``. A stub Graphite server
+is started on localhost, then N checks are run as fresh `nagios_graphite`
+processes and N more through `nagios_graphite_client` and the daemon.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import tempfile
+import threading
+import subprocess
+import BaseHTTPServer
+
+CHECKS = 50
+BODY = json.dumps([
+    {"target": "host{0}".format(i),
+     "datapoints": [[float(j), j] for j in range(60)]}
+    for i in range(10)])
+
+
+class RenderHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stub():
+    server = BaseHTTPServer.HTTPServer(("127.0.0.1", 0), RenderHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def wait_for(path, timeout=10):
+    deadline = time.time() + timeout
+    while not os.path.exists(path):
+        if time.time() > deadline:
+            raise RuntimeError("daemon did not start")
+        time.sleep(0.05)
+
+
+def run_checks(module, args, n, env):
+    start = time.time()
+    for _ in range(n):
+        subprocess.call([sys.executable, "-m", module] + args, env=env,
+                        stdout=open(os.devnull, "w"))
+    return n / (time.time() - start)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else CHECKS
+    stub = start_stub()
+    url = "http://127.0.0.1:{0}/render".format(stub.server_address[1])
+    args = ["-H", url, "-M", "host.*.cpu", "-w", "100", "-c", "200"]
+
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [os.getcwd(), env.get("PYTHONPATH", "")])
+    env["NAGIOS_GRAPHITE_SOCKET"] = os.path.join(
+        tempfile.mkdtemp(), "nagios_graphite.sock")
+
+    cold = run_checks("nagios_graphite.main", args, n, env)
+
+    daemon = subprocess.Popen(
+        [sys.executable, "-c",
+         "import sys; from nagios_graphite import daemon; "
+         "daemon.main(sys.argv)", "--daemon"], env=env)
+    try:
+        wait_for(env["NAGIOS_GRAPHITE_SOCKET"])
+        warm = run_checks("nagios_graphite.client", args, n, env)
+    finally:
+        daemon.terminate()
+        daemon.wait()
+
+    print("cold invocation: {0:8.1f} checks/sec".format(cold))
+    print("daemon + client: {0:8.1f} checks/sec ({1:.1f}x)".format(
+        warm, warm / cold))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""Compare decode time and response size of the render formats.
+
+Run with ``python benchmarks/bench_formats.py``. Responses are encoded the
+way graphite-web encodes them for `series` series of one day at 60s.
+"""
+
+from __future__ import print_function
+
+import sys
+import json
+import random
+import timeit
+import cPickle
+
+sys.path.append('.')
+from nagios_graphite import formats  # NOQA
+
+POINTS_PER_SERIES = 1440
+SERIES_COUNTS = [10, 100]
+STEP = 60
+
+
+def make_infos(count, points=POINTS_PER_SERIES):
+    rnd = random.Random(count)
+    return [
+        {"name": "host{0}.cpu".format(i), "pathExpression": "host*.cpu",
+         "start": 0, "end": points * STEP, "step": STEP,
+         "values": [None if rnd.random() < 0.05 else rnd.random() * 100
+                    for _ in range(points)]}
+        for i in range(count)
+    ]
+
+
+def encode(fmt, infos):
+    if fmt == "json":
+        return json.dumps([formats.series_from_info(i) for i in infos])
+    if fmt == "raw":
+        return "".join(
+            "{0},{1},{2},{3}|{4}\n".format(
+                i["name"], i["start"], i["end"], i["step"],
+                ",".join(repr(v) if v is not None else "None"
+                         for v in i["values"]))
+            for i in infos)
+    if fmt == "msgpack":
+        return formats.msgpack.packb(infos, use_bin_type=True)
+    return cPickle.dumps(infos, cPickle.HIGHEST_PROTOCOL)
+
+
+def main():
+    names = [f for f in formats.FORMATS
+             if f != "msgpack" or formats.msgpack is not None]
+    print("{0:>7} {1:>8} {2:>12} {3:>12}".format(
+        "series", "format", "bytes", "decode (ms)"))
+    for count in SERIES_COUNTS:
+        infos = make_infos(count)
+        for fmt in names:
+            content = encode(fmt, infos)
+            decoder = formats.DECODERS[fmt]
+            elapsed = min(timeit.repeat(
+                lambda: decoder(content), number=1, repeat=5))
+            print("{0:>7} {1:>8} {2:>12} {3:>12.1f}".format(
+                count, fmt, len(content), elapsed * 1e3))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""Load test nagios_graphite against the local Graphite stand-in.
+
+Run with ``python benchmarks/bench_load.py [options] [-- CHECK ARGS]``. A
+`graphite_stub` server is started in-process, then ``--checks`` checks are
+run as fresh `nagios_graphite` processes, ``--concurrency`` at a time.
+Arguments after ``--`` are passed to every check (for example
+``-- --stream --transport urllib``); checks ask for every ``--points``
+point of the stub unless another ``-F`` is given there. Reports checks/sec,
+p50/p99 latency, the exit status counts and the peak RSS of a check
+process.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+import Queue
+import optparse
+import resource
+import threading
+import subprocess
+import collections
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import graphite_stub  # NOQA
+
+
+def quantile(sorted_xs, q):
+    return sorted_xs[min(int(q * len(sorted_xs)), len(sorted_xs) - 1)]
+
+
+def run_load(cmd, checks, concurrency, env):
+    """Run `cmd` `checks` times, returns (latencies, exit codes, seconds)"""
+
+    jobs = Queue.Queue()
+    for _ in range(checks):
+        jobs.put(None)
+    latencies = []
+    codes = collections.Counter()
+    lock = threading.Lock()
+
+    def worker():
+        with open(os.devnull, "w") as devnull:
+            while True:
+                try:
+                    jobs.get_nowait()
+                except Queue.Empty:
+                    return
+                start = time.time()
+                code = subprocess.call(cmd, env=env, stdout=devnull,
+                                       stderr=devnull)
+                elapsed = time.time() - start
+                with lock:
+                    latencies.append(elapsed)
+                    codes[code] += 1
+
+    start = time.time()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sorted(latencies), codes, time.time() - start
+
+
+def main():
+    parser = optparse.OptionParser(
+        usage="%prog [options] [-- CHECK ARGS]")
+    parser.add_option("--checks", type=int, default=100,
+                      help="Checks to run in total")
+    parser.add_option("--concurrency", type=int, default=8,
+                      help="Checks running at the same time")
+    parser.add_option("--target", default="servers.*.cpu",
+                      help="Graphite target of every check")
+    graphite_stub.add_config_options(parser)
+    opts, check_args = parser.parse_args()
+
+    stub = graphite_stub.start(graphite_stub.config_from(opts))
+    cmd = [sys.executable, "-m", "nagios_graphite.main",
+           "-H", stub.url, "-M", opts.target,
+           "-F", "{0}s".format(opts.points * opts.step)] + check_args
+
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [os.getcwd(), env.get("PYTHONPATH", "")])
+
+    latencies, codes, elapsed = run_load(
+        cmd, opts.checks, opts.concurrency, env)
+    stub.shutdown()
+
+    rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    print("{0} checks, {1} at a time, {2} series x {3} points".format(
+        opts.checks, opts.concurrency, opts.series, opts.points))
+    print("throughput:   {0:8.1f} checks/sec".format(opts.checks / elapsed))
+    print("latency p50:  {0:8.1f} ms".format(
+        quantile(latencies, 0.5) * 1000))
+    print("latency p99:  {0:8.1f} ms".format(
+        quantile(latencies, 0.99) * 1000))
+    print("peak RSS:     {0:8.1f} MiB".format(rss / 1024.0))
+    print("exit codes:   {0}".format(", ".join(
+        "{0}: {1}".format(code, n) for code, n in sorted(codes.items()))))
+    print("requests served: {0}".format(stub.requests))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""Compare the memory per datapoint of series dicts and CompactSeries.
+
+Run with ``python benchmarks/bench_memory.py [SERIES] [POINTS]``. Reports
+the size of the objects (deep ``sys.getsizeof``) and the peak RSS growth of a
+fresh process holding the render data in each representation.
+"""
+
+from __future__ import print_function
+
+import sys
+import json
+import resource
+import subprocess
+
+sys.path.append('.')
+from nagios_graphite.series import CompactSeries  # NOQA
+
+SERIES = 100
+POINTS = 10000
+
+
+def value(j):
+    return None if j % 10 == 0 else float(j)
+
+
+def make_dicts(series, points):
+    return [
+        {"target": "host{0}".format(i),
+         "datapoints": [[value(j), 1420070400 + j] for j in range(points)]}
+        for i in range(series)]
+
+
+def make_compact(series, points):
+    """Built from the values, as the raw/msgpack/pickle decoders do"""
+
+    return [CompactSeries("host{0}".format(i), 1420070400, 1,
+                          (value(j) for j in range(points)))
+            for i in range(series)]
+
+
+def deep_size(obj, seen=None):
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(k, seen) + deep_size(v, seen)
+                    for k, v in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(deep_size(x, seen) for x in obj)
+    elif isinstance(obj, CompactSeries):
+        size += sum(deep_size(getattr(obj, name), seen)
+                    for name in CompactSeries.__slots__)
+    return size
+
+
+def peak_rss_kb():
+    # ru_maxrss survives exec, so a child would inherit our peak; prefer
+    # the per-process high water mark where Linux provides it
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+CHILD = """
+import sys, json
+sys.path.append('.')
+sys.path.append('benchmarks')
+import bench_memory
+series, points, kind = json.loads(sys.argv[1])
+before = bench_memory.peak_rss_kb()
+make = getattr(bench_memory, "make_" + kind)
+data = make(series, points)
+print(bench_memory.peak_rss_kb() - before)
+"""
+
+
+def rss_growth(series, points, kind):
+    out = subprocess.check_output(
+        [sys.executable, "-c", CHILD, json.dumps([series, points, kind])])
+    return int(out) * 1024
+
+
+def main():
+    series = int(sys.argv[1]) if len(sys.argv) > 1 else SERIES
+    points = int(sys.argv[2]) if len(sys.argv) > 2 else POINTS
+    total = series * points
+    sample = max(1, min(series, 10))
+
+    print("{0} series x {1} points".format(series, points))
+    print("{0:>10} {1:>16} {2:>16}".format(
+        "", "bytes / point", "RSS / point"))
+    for kind, make in [("dicts", make_dicts), ("compact", make_compact)]:
+        size = deep_size(make(sample, points)) / float(sample * points)
+        rss = rss_growth(series, points, kind) / float(total)
+        print("{0:>10} {1:>16.1f} {2:>16.1f}".format(kind, size, rss))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""Measure the start-up cost of the nagios_graphite command.
+
+Run with ``python benchmarks/bench_startup.py [N]``. Reports the best of N
+runs for importing the entry point, printing ``--help``, and a full check
+against a local stub Graphite server with each HTTP transport.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+import subprocess
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from bench_daemon import start_stub  # NOQA
+
+RUNS = 10
+
+
+def best_of(cmd, runs, env):
+    best = None
+    with open(os.devnull, "w") as devnull:
+        for _ in range(runs):
+            start = time.time()
+            subprocess.call(cmd, env=env, stdout=devnull, stderr=devnull)
+            elapsed = time.time() - start
+            best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else RUNS
+    stub = start_stub()
+    url = "http://127.0.0.1:{0}/render".format(stub.server_address[1])
+    check = [sys.executable, "-m", "nagios_graphite.main",
+             "-H", url, "-M", "host.*.cpu", "-w", "100"]
+
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [os.getcwd(), env.get("PYTHONPATH", "")])
+
+    cases = [
+        ("interpreter", [sys.executable, "-c", "pass"]),
+        ("import main", [sys.executable, "-c", "import nagios_graphite.main"]),
+        ("import requests", [sys.executable, "-c", "import requests"]),
+        ("--help", [sys.executable, "-m", "nagios_graphite.main", "--help"]),
+        ("check (requests)", check + ["--transport", "requests"]),
+        ("check (urllib)", check + ["--transport", "urllib"]),
+    ]
+    for name, cmd in cases:
+        elapsed = best_of(cmd, runs, env)
+        print("{0:<18} {1:8.1f} ms".format(name, elapsed * 1e3))
+
+
+if __name__ == '__main__':
+    main()
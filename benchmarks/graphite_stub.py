@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""Local stand-in for graphite-web serving synthetic series.
+
+Run with ``python benchmarks/graphite_stub.py --port 8080 [options]`` or
+call `start()` from another script. Serves:
+
+- ``/render``: every ``target`` expands to ``--series`` series (a ``*`` in
+  the target is replaced by ``host0``, ``host1``, ...), each keeping
+  ``--points`` points one ``--step`` apart ending now. ``from`` and
+  ``until`` (relative offsets, epoch seconds or ``now``) select the points
+  returned, ``maxDataPoints`` averages them into fewer points and
+  ``alias(target, "name")`` renames the series of `target`.
+  ``format=json`` and ``format=raw`` are supported.
+- ``/metrics/find``: the series names matching ``query``.
+
+A ``--null-ratio`` fraction of the values is null, every request waits
+``--latency`` seconds (plus up to ``--jitter``) and an ``--error-rate``
+fraction of the requests fail with HTTP 500. Values are seeded by target so
+repeated runs see the same data.
+"""
+
+from __future__ import print_function
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import urlparse
+import optparse
+import threading
+import SocketServer
+import BaseHTTPServer
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from nagios_graphite.window import parse_offset  # NOQA
+
+_ALIAS = re.compile(r"""^alias\((.+),\s*(["'])(.*)\2\)$""")
+
+
+class StubConfig(object):
+    def __init__(self, series=10, points=60, step=60, null_ratio=0.0,
+                 latency=0.0, jitter=0.0, error_rate=0.0):
+        self.series = series
+        self.points = points
+        self.step = step
+        self.null_ratio = null_ratio
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+
+
+def series_names(target, count):
+    if "*" not in target:
+        return [target]
+    return [target.replace("*", "host{0}".format(i), 1)
+            for i in range(count)]
+
+
+def parse_alias(target):
+    """Split ``alias(inner, "name")`` into (inner, name), else (target, None)
+    """
+
+    m = _ALIAS.match(target.strip())
+    if m is None:
+        return target, None
+    return m.group(1).strip(), m.group(3)
+
+
+def parse_time(value, now):
+    """Epoch seconds of a from/until parameter, None if not understood"""
+
+    value = value.strip()
+    if value in ("", "-", "now"):
+        return now
+    if value.isdigit():
+        return int(value)
+    offset = parse_offset(value)
+    return None if offset is None else now - offset
+
+
+def consolidate(values, factor):
+    """Average every `factor` consecutive values, ignoring nulls"""
+
+    averaged = []
+    for i in range(0, len(values), factor):
+        present = [v for v in values[i:i + factor] if v is not None]
+        averaged.append(sum(present) / len(present) if present else None)
+    return averaged
+
+
+def synthetic_values(name, config):
+    rng = random.Random(name)
+    return [None if rng.random() < config.null_ratio
+            else round(rng.uniform(0, 100), 3)
+            for _ in range(config.points)]
+
+
+def render_json(series, start, step):
+    return json.dumps([
+        {"target": name,
+         "datapoints": [[v, start + i * step] for i, v in enumerate(values)]}
+        for name, values in series])
+
+
+def render_raw(series, start, step):
+    end = start + step * max(len(values) for _, values in series)
+    return "".join(
+        "{0},{1},{2},{3}|{4}\n".format(
+            name, start, end, step,
+            ",".join("None" if v is None else repr(v) for v in values))
+        for name, values in series)
+
+
+RENDERERS = {
+    "json": (render_json, "application/json"),
+    "raw": (render_raw, "text/plain"),
+}
+
+
+class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        config = self.server.config
+        url = urlparse.urlparse(self.path)
+        qs = urlparse.parse_qs(url.query)
+
+        time.sleep(config.latency + random.uniform(0, config.jitter))
+        self.server.count_request()
+        if random.random() < config.error_rate:
+            return self.reply(500, "text/plain", "injected error\n")
+
+        if url.path.rstrip("/").endswith("/render"):
+            self.render(qs, config)
+        elif url.path.rstrip("/").endswith("/metrics/find"):
+            self.find(qs, config)
+        else:
+            self.reply(404, "text/plain", "not found\n")
+
+    def render(self, qs, config):
+        format_ = qs.get("format", ["json"])[0]
+        if format_ not in RENDERERS:
+            return self.reply(400, "text/plain", "unsupported format\n")
+        renderer, content_type = RENDERERS[format_]
+
+        now = int(time.time()) // config.step * config.step
+        start = now - config.points * config.step
+        from_ = parse_time(qs.get("from", ["-1d"])[0], now)
+        until = parse_time(qs.get("until", ["now"])[0], now)
+        if from_ is None or until is None:
+            return self.reply(400, "text/plain", "unsupported from/until\n")
+        # Graphite returns the points after `from` up to `until`
+        first = max(0, (from_ - start) // config.step + 1)
+        last = max(first, min(config.points,
+                              (until - start) // config.step + 1))
+
+        series = []
+        for target in qs.get("target", []):
+            pattern, alias = parse_alias(target)
+            for name in series_names(pattern, config.series):
+                values = synthetic_values(name, config)[first:last]
+                series.append((alias or name, values))
+        if not series:
+            return self.reply(
+                200, content_type, "[]" if format_ == "json" else "")
+
+        step = config.step
+        max_points = qs.get("maxDataPoints")
+        factor = -(-(last - first) // int(max_points[0])) if max_points else 1
+        if factor > 1:
+            series = [(name, consolidate(points, factor))
+                      for name, points in series]
+            step *= factor
+        self.reply(200, content_type,
+                   renderer(series, start + first * config.step, step))
+
+    def find(self, qs, config):
+        query = qs.get("query", [""])[0]
+        self.reply(200, "application/json", json.dumps([
+            {"text": name.rsplit(".", 1)[-1], "id": name, "leaf": 1,
+             "expandable": 0, "allowChildren": 0}
+            for name in series_names(query, config.series)]))
+
+    def reply(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, config):
+        BaseHTTPServer.HTTPServer.__init__(self, address, StubHandler)
+        self.config = config
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    @property
+    def url(self):
+        return "http://{0}:{1}/render".format(*self.server_address)
+
+
+def start(config=None, host="127.0.0.1", port=0):
+    """Serve `config` from a background thread, returns the StubServer"""
+
+    server = StubServer((host, port), config or StubConfig())
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,))
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def add_config_options(parser):
+    defaults = StubConfig()
+    parser.add_option("--series", type=int, default=defaults.series,
+                      help="Series per wildcard target")
+    parser.add_option("--points", type=int, default=defaults.points,
+                      help="Points per series")
+    parser.add_option("--step", type=int, default=defaults.step,
+                      help="Seconds between points")
+    parser.add_option("--null-ratio", type=float,
+                      default=defaults.null_ratio,
+                      help="Fraction of null values")
+    parser.add_option("--latency", type=float, default=defaults.latency,
+                      help="Seconds to wait before answering")
+    parser.add_option("--jitter", type=float, default=defaults.jitter,
+                      help="Extra random latency, up to this many seconds")
+    parser.add_option("--error-rate", type=float,
+                      default=defaults.error_rate,
+                      help="Fraction of requests answered with HTTP 500")
+
+
+def config_from(opts):
+    return StubConfig(opts.series, opts.points, opts.step, opts.null_ratio,
+                      opts.latency, opts.jitter, opts.error_rate)
+
+
+def main():
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option("--host", default="127.0.0.1")
+    parser.add_option("--port", type=int, default=8080)
+    add_config_options(parser)
+    opts, _ = parser.parse_args()
+
+    server = StubServer((opts.host, opts.port), config_from(opts))
+    print("serving {0}".format(server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""pytest-benchmark suite for aggregation, combine and render parsing.
+
+Run with ``paver bench_baseline`` to store a baseline and ``paver bench`` to
+compare against it, or directly with ``py.test benchmarks``. Every case runs
+over a matrix of series count, points per series and null density; shapes
+with more than MAX_POINTS datapoints in total are left out (raise it with
+``$NAGIOS_GRAPHITE_BENCH_MAX_POINTS``).
+"""
+
+import os
+import json
+import random
+import shlex
+
+import pytest
+parametrize = pytest.mark.parametrize
+
+from nagios_graphite import main, vectorized  # NOQA
+
+SERIES_COUNTS = [1, 100, 10000]
+POINTS_PER_SERIES = [60, 1440, 100000]
+NULL_DENSITIES = [0.0, 0.5]
+MAX_POINTS = int(os.environ.get("NAGIOS_GRAPHITE_BENCH_MAX_POINTS", 10 ** 6))
+
+SHAPES = [(series, points, nulls)
+          for series in SERIES_COUNTS
+          for points in POINTS_PER_SERIES
+          for nulls in NULL_DENSITIES
+          if series * points <= MAX_POINTS]
+
+shapes = parametrize(
+    "shape", SHAPES, ids=["{0}x{1}-{2}nulls".format(*s) for s in SHAPES])
+
+_series_cache = {}
+
+
+def make_series(series, points, nulls):
+    """Render data of the given shape, built once per session"""
+
+    key = (series, points, nulls)
+    if key not in _series_cache:
+        rng = random.Random(0)
+        _series_cache[key] = [
+            {"target": "host{0}".format(i),
+             "datapoints": [[None if rng.random() < nulls
+                             else rng.uniform(0, 100), 1420070400 + j * 60]
+                            for j in range(points)]}
+            for i in range(series)]
+    return _series_cache[key]
+
+
+class FakeResponse(object):
+    ok = True
+
+    def __init__(self, body):
+        self.content = body
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class FakeSession(object):
+    """Serves the same render body for every request"""
+
+    def __init__(self, body):
+        self.body = body
+
+    def get(self, url, **kwargs):
+        return FakeResponse(self.body)
+
+
+def plugin_for(s, body):
+    plugin = main.GraphiteNagios(shlex.split(
+        "nagios_graphite -H http://example.com -M 'host.*' " + s))
+    plugin.session = FakeSession(body)
+    return plugin
+
+
+@shapes
+@parametrize("name", sorted(main.FUNCTIONS))
+def test_aggregator(benchmark, name, shape):
+    series = make_series(*shape)
+    values = list(main.iter_values(series))
+    benchmark(main.FUNCTIONS[name], values)
+
+
+@shapes
+def test_combine(benchmark, shape):
+    series = make_series(*shape)
+    benchmark(main.combine, series, main.FUNCTIONS["avg"])
+
+
+@shapes
+def test_graphite_fetch(benchmark, shape):
+    body = json.dumps(make_series(*shape))
+    opts = plugin_for("", body).options
+    benchmark(main.graphite_fetch, opts, FakeSession(body))
+
+
+@shapes
+@parametrize("backend", ["python", "numpy"])
+def test_check(benchmark, backend, shape):
+    if backend == "numpy" and not vectorized.available():
+        pytest.skip("numpy is not installed")
+    body = json.dumps(make_series(*shape))
+    plugin = plugin_for(
+        "-A avg,99th,nullpct --backend {0}".format(backend), body)
+    benchmark(plugin.check)
@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""Batch entry point: evaluate many checks in one process
+
+Each non-blank line of the checks file holds the options of one
+`nagios_graphite` invocation, for example::
+
+    # cpu load across the web tier
+    -H http://graphite/render -M 'web.*.cpu.load' -N web_load -w 4 -c 8
+
+Every check runs over one shared ``requests.Session`` so connections to
+Graphite are pooled and reused, and the results are written in bulk. The
+render requests of compatible checks are merged into multi-target requests
+(see `nagios_graphite.coalesce`).
+"""
+
+from __future__ import print_function
+
+import sys
+import json
+import shlex
+import optparse
+import itertools
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from pynagios import Response, UNKNOWN
+
+from nagios_graphite.main import GraphiteNagios, client_error
+from nagios_graphite.coalesce import (
+    prefetch, DEFAULT_MAX_TARGETS, DEFAULT_MAX_URL_LENGTH)
+from nagios_graphite.engine import (
+    FetchEngine, DEFAULT_WORKERS, DEFAULT_PER_HOST)
+
+FORMATS = ("tsv", "json")
+
+
+class InvalidCheck(Exception):
+    pass
+
+
+def parse_checks(lines):
+    """Yield (line number, argument list) for every check in `lines`
+
+    The argument list of a line that cannot be split (an unbalanced quote)
+    is None, so it is reported like any other invalid check.
+    """
+
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if line and not line.startswith("#"):
+            try:
+                yield number, shlex.split(line)
+            except ValueError:
+                yield number, None
+
+
+def batch_session(pool_size):
+    """Session whose connection pool holds `pool_size` connections per host"""
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def load_check(args):
+    """Parse a check definition into a GraphiteNagios plugin
+
+    The arguments are left out of the InvalidCheck message, they may hold
+    a password.
+    """
+
+    if args is None:
+        raise InvalidCheck("Invalid check definition")
+    try:
+        return GraphiteNagios(["nagios_graphite"] + args)
+    except SystemExit:
+        raise InvalidCheck("Invalid check definition")
+
+
+def evaluate(plugin):
+    """Run a loaded check and return (name, Response) without exiting"""
+
+    try:
+        return plugin.options.name, plugin.check()
+    except Exception as e:
+        return plugin.options.name, client_error(e)
+
+
+def run_check(args, session=None):
+    """Run one check and return (name, Response) without exiting"""
+
+    try:
+        plugin = load_check(args)
+    except InvalidCheck as e:
+        return None, Response(UNKNOWN, str(e))
+
+    plugin.session = session
+    return evaluate(plugin)
+
+
+def prefetchable(plugin):
+    """Whether the render data of `plugin` can be fetched in a group
+
+    Checks that keep their own stored data (--delta-dir, --cache-dir,
+    --sketch-dir) fetch it themselves. So do --per-series checks, which
+    name series by their target (coalesced series are renamed with
+    alias()), --pushdown checks, which aggregate on the Graphite side,
+    and --max-datapoints checks, which enforce their budget while
+    downloading instead of after buffering. Checks with several --hostname
+    endpoints hedge their own requests.
+    """
+
+    opts = plugin.options
+    return not (opts.delta_dir or opts.cache_dir or opts.sketch_dir or
+                opts.per_series or opts.pushdown or opts.max_datapoints or
+                len(opts.hostnames) > 1)
+
+
+def run_checks(checks, session=None, coalesce=False,
+               max_targets=DEFAULT_MAX_TARGETS,
+               max_url_length=DEFAULT_MAX_URL_LENGTH, engine=None,
+               lines=None):
+    """Run every check, yielding (name, Response) pairs in order
+
+    With `coalesce`, the render requests of compatible checks are merged
+    into as few HTTP requests as the limits allow before any check runs.
+    With an `engine` (a FetchEngine), those requests run concurrently.
+    Invalid checks are named after their number in `lines` (the line
+    numbers of the checks file), else their position.
+    """
+
+    plugins = []
+    for number, args in zip(lines or itertools.count(1), checks):
+        try:
+            plugins.append(load_check(args))
+        except InvalidCheck as e:
+            name = "line {0}".format(number)
+            plugins.append((name, Response(UNKNOWN, "{0} on {1}".format(
+                e, name))))
+
+    loaded = [p for p in plugins
+              if isinstance(p, GraphiteNagios) and prefetchable(p)]
+    if coalesce or engine is not None:
+        data = prefetch([p.options for p in loaded], session,
+                        max_targets if coalesce else 1, max_url_length,
+                        engine)
+        for plugin, raw_data in zip(loaded, data):
+            plugin.raw_data = raw_data
+
+    for plugin in plugins:
+        if isinstance(plugin, tuple):
+            yield plugin
+        elif isinstance(plugin.raw_data, Exception):
+            yield plugin.options.name, client_error(plugin.raw_data)
+        else:
+            plugin.session = session
+            yield evaluate(plugin)
+
+
+def format_tsv(results):
+    for name, response in results:
+        yield "{0}\t{1}\t{2}".format(
+            name, response.status.exit_code, response)
+
+
+def format_json(results):
+    yield json.dumps([
+        {"name": name,
+         "status": response.status.name,
+         "exit_code": response.status.exit_code,
+         "output": str(response)}
+        for name, response in results])
+
+
+FORMATTERS = {
+    "tsv": format_tsv,
+    "json": format_json,
+}
+
+
+def option_parser():
+    parser = optparse.OptionParser(
+        usage="%prog [options] CHECKS_FILE",
+        description=("Run every check defined in CHECKS_FILE (one set of "
+                     "nagios_graphite options per line, - for stdin)"))
+    parser.add_option(
+        "--format", "-f", choices=FORMATS, default="tsv",
+        help="Output format, options: {0} (default: tsv)".format(
+            ", ".join(FORMATS)))
+    parser.add_option(
+        "--pool-size", type=int, default=10,
+        help="HTTP connections kept per Graphite host (default: 10)")
+    parser.add_option(
+        "--no-coalesce", dest="coalesce", action="store_false", default=True,
+        help="Send one render request per check instead of merging them")
+    parser.add_option(
+        "--max-targets", type=int, default=DEFAULT_MAX_TARGETS,
+        help="Most targets merged into one render request (default: "
+             "{0})".format(DEFAULT_MAX_TARGETS))
+    parser.add_option(
+        "--max-url-length", type=int, default=DEFAULT_MAX_URL_LENGTH,
+        help="Longest merged render URL (default: {0})".format(
+            DEFAULT_MAX_URL_LENGTH))
+    parser.add_option(
+        "--workers", type=int, default=DEFAULT_WORKERS,
+        help="Render requests in flight at once, 1 fetches sequentially "
+             "(default: {0})".format(DEFAULT_WORKERS))
+    parser.add_option(
+        "--max-per-host", type=int, default=DEFAULT_PER_HOST,
+        help="Render requests in flight per Graphite host (default: "
+             "{0})".format(DEFAULT_PER_HOST))
+    return parser
+
+
+def main(args):
+    parser = option_parser()
+    opts, paths = parser.parse_args(args[1:])
+    if len(paths) != 1:
+        parser.error("expected exactly one CHECKS_FILE")
+
+    if paths[0] == "-":
+        parsed = list(parse_checks(sys.stdin))
+    else:
+        with open(paths[0]) as f:
+            parsed = list(parse_checks(f))
+    lines = [number for number, _ in parsed]
+    checks = [check for _, check in parsed]
+
+    session = batch_session(max(opts.pool_size, opts.max_per_host))
+    engine = None
+    if opts.workers > 1:
+        engine = FetchEngine(opts.workers, opts.max_per_host)
+    results = run_checks(checks, session, opts.coalesce,
+                         opts.max_targets, opts.max_url_length, engine, lines)
+    for line in FORMATTERS[opts.format](results):
+        print(line)
+
+
+def entry_point():
+    return main(sys.argv)
+
+
+if __name__ == '__main__':
+    entry_point()
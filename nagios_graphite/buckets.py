@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""Stored per-bucket sketches for long-horizon percentiles
+
+A check of the 99th percentile over ``-F 7days`` that runs every five
+minutes downloads and sorts a week of datapoints each time. With
+``--sketch-dir`` the window is split into buckets of ``--sketch-bucket``
+seconds aligned to the epoch, and a DDSketch of every (series, bucket) is
+kept on disk once the bucket is complete. Each run then only fetches the
+buckets not stored yet plus the incomplete edges of the window, and answers
+the approximate percentiles (``99th~`` etc.) by merging the sketches, which
+costs one step per bucket instead of a sort of every datapoint. Buckets that
+slide out of the window are evicted.
+
+A bucket is stored once it ended more than `SETTLE` seconds ago; points
+arriving later than that, and series that start matching the target, are
+only seen for buckets fetched afterwards. Absolute windows fall back to a
+normal fetch.
+"""
+
+import os
+import copy
+import json
+import time
+import hashlib
+
+from nagios_graphite.main import (
+    SKETCHES, Aggregates, EmptyQueryResult, graphite_fetch, verbose)
+from nagios_graphite.cache import atomic_write, locked
+from nagios_graphite.series import as_dicts
+from nagios_graphite.sketch import DDSketch
+from nagios_graphite.window import parse_offset
+
+DEFAULT_BUCKET = 3600
+
+# Seconds after its end before a bucket is considered complete
+SETTLE = 120
+
+
+def bucket_starts(start, end, size):
+    """Starts of the `size` second buckets lying entirely within [start, end)
+    """
+
+    first = -(-start // size) * size
+    return range(first, end // size * size, size)
+
+
+def can_use(opts, names):
+    """True if the store can answer every aggregate in `names`"""
+
+    return (all(name in SKETCHES for name in names) and
+            parse_offset(opts.from_) is not None and
+            opts.until in ("", "now"))
+
+
+class SketchStore(object):
+    """Directory of per-bucket sketches, one file per query"""
+
+    def __init__(self, directory, bucket=DEFAULT_BUCKET, settle=SETTLE):
+        self.directory = directory
+        self.bucket = bucket
+        self.settle = settle
+        self.stored = 0
+        self.fetched = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def path(self, opts):
+        # Keyed by the window too: a shorter one would evict the buckets
+        # a longer one still needs
+        identity = json.dumps([opts.hostname, opts.target, opts.from_,
+                               opts.username, opts.password,
+                               opts.sketch_accuracy, self.bucket])
+        name = hashlib.sha1(identity.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, name + ".json")
+
+    def load(self, path):
+        """Bucket start to {target: DDSketch} stored at `path`"""
+
+        try:
+            with open(path) as f:
+                state = json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+        return dict(
+            (int(start), dict((target, DDSketch.from_dict(sketch))
+                              for target, sketch in sketches.iteritems()))
+            for start, sketches in state["buckets"].iteritems())
+
+    def save(self, path, buckets):
+        atomic_write(path, json.dumps({"buckets": dict(
+            (str(start), dict((target, sketch.to_dict())
+                              for target, sketch in sketches.iteritems()))
+            for start, sketches in buckets.iteritems())}))
+
+    def fetch_range(self, opts, start, end, session=None):
+        """Series of `opts` with the points in [start, end)"""
+
+        range_opts = copy.copy(opts)
+        # Graphite returns the points after `from`, so ask from a second
+        # earlier to include the point at `start`
+        range_opts.from_ = str(start - 1)
+        range_opts.until = str(end)
+        series = as_dicts(graphite_fetch(range_opts, session))
+        verbose(opts, "fetched {0} to {1}: {2} points".format(
+            start, end, sum(len(e["datapoints"]) for e in series)))
+        return series
+
+    def sketches(self, opts, session=None, now=None):
+        """Every (target, sketch) covering the window of `opts`
+
+        Complete buckets come from the store and the rest is fetched.
+        Returns None if Graphite returned no series.
+        """
+
+        now = int(time.time() if now is None else now)
+        start = now - parse_offset(opts.from_)
+        starts = bucket_starts(start, now - self.settle, self.bucket)
+        path = self.path(opts)
+
+        with locked(path + ".lock"):
+            stored = self.load(path)
+            # Buckets that slid out of the window are dropped here
+            buckets = dict((b, stored[b]) for b in starts if b in stored)
+            evicted = len(buckets) < len(stored)
+            missing = [b for b in starts if b not in buckets]
+
+            # The head of the window before the first whole bucket, then
+            # everything from the first missing bucket on
+            edge = starts[0] if starts else now
+            if missing:
+                resume = missing[0]
+            else:
+                resume = starts[-1] + self.bucket if starts else now
+            if resume == edge:
+                fetches = [(start, now + 1)]
+            else:
+                fetches = [(start, edge), (resume, now + 1)]
+
+            fresh = dict((b, {}) for b in missing)
+            edges = {}
+            seen = False
+            for begin, end in fetches:
+                if begin >= end:
+                    continue
+                for e in self.fetch_range(opts, begin, end, session):
+                    seen = True
+                    self._add(e, begin, end, buckets, fresh, edges,
+                              opts.sketch_accuracy)
+
+            self.stored = len(buckets)
+            self.fetched = len(fresh)
+            # A failed fetch looks like no series, don't store it as empty
+            if seen:
+                buckets.update(fresh)
+            if seen or evicted:
+                self.save(path, buckets)
+
+        if not seen:
+            return None
+        result = [item for sketches in buckets.itervalues()
+                  for item in sketches.iteritems()]
+        return result + edges.items()
+
+    def _add(self, series, begin, end, stored, fresh, edges, accuracy):
+        """Count the points of `series` in [begin, end) into their sketch
+
+        Points of `stored` buckets are skipped, those of `fresh` buckets go
+        to the bucket's sketch and the rest (the edges of the window) to
+        `edges`.
+        """
+
+        target = series["target"]
+        for value, ts in series["datapoints"]:
+            if value is None or not begin <= ts < end:
+                continue
+            start = ts - ts % self.bucket
+            if start in stored:
+                continue
+            bucket = fresh.get(start, edges)
+            if target not in bucket:
+                bucket[target] = DDSketch(accuracy)
+            bucket[target].add(value)
+
+    def describe(self):
+        return "sketch store: {0} buckets stored, {1} fetched".format(
+            self.stored, self.fetched)
+
+
+def check_buckets(opts, names, session=None, now=None):
+    """Approximate percentiles of `opts` merged from the sketch store"""
+
+    store = SketchStore(opts.sketch_dir, opts.sketch_bucket)
+    sketches = store.sketches(opts, session, now)
+    verbose(opts, store.describe())
+    if sketches is None:
+        return None
+
+    merged = DDSketch(opts.sketch_accuracy)
+    for _, sketch in sketches:
+        merged.merge(sketch)
+    if not merged.count:
+        raise EmptyQueryResult("Graphite query returned no results")
+    return Aggregates(
+        (name, merged.quantile(SKETCHES[name])) for name in names)
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""Datapoint budget for huge render queries
+
+A long window on a wide wildcard can return tens of millions of datapoints.
+``--max-datapoints`` caps how many the check will process. Points are
+counted while they are read. Past the budget the check either fails
+(UNKNOWN) or, with ``--over-budget approximate``, keeps a uniform sample of
+at most the budget for percentiles while every other aggregate stays exact.
+
+The budget is not sent to Graphite as ``maxDataPoints``: to align its
+buckets, graphite-web drops up to a bucket's worth of leading points when it
+consolidates, which changes sums and can change minimums and maximums even
+under ``consolidateBy``.
+"""
+
+import resource
+
+
+class DatapointBudgetExceeded(Exception):
+    pass
+
+
+def peak_rss_kb():
+    """Peak resident set size of this process in KiB (Linux units)"""
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class Budget(object):
+    """Count datapoints as they are consumed and enforce `limit`"""
+
+    def __init__(self, limit, approximate=False):
+        self.limit = limit
+        self.approximate = approximate
+        self.points = 0
+
+    @property
+    def exceeded(self):
+        return self.points > self.limit
+
+    def count(self, values):
+        for value in values:
+            self.points += 1
+            if self.points > self.limit and not self.approximate:
+                raise DatapointBudgetExceeded(
+                    "query returned more than {0} datapoints".format(
+                        self.limit))
+            yield value
+
+    def describe(self):
+        return "processed {0} datapoints (budget {1}{2}), peak RSS " \
+            "{3} KiB".format(self.points, self.limit,
+                             ", exceeded" if self.exceeded else "",
+                             peak_rss_kb())
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""Shared on-disk cache of render responses
+
+Several checks often query the same target over the same window within
+seconds of each other, differing only in algorithm or thresholds. With
+``--cache-dir`` the first of them fetches from Graphite and the others read
+the stored response until it is older than ``--cache-ttl`` seconds.
+
+Entries are keyed on the normalized render URL plus the credentials used.
+Writes go to a temporary file that is renamed into place, so readers never
+see partial entries, and a per-entry lock file serialises fetches so that
+concurrent check processes wait for one fetch instead of all hitting
+graphite-web.
+"""
+
+import os
+import json
+import time
+import errno
+import urllib
+import hashlib
+import tempfile
+import urlparse
+import contextlib
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from nagios_graphite.main import graphite_url
+from nagios_graphite.series import jsonable
+
+DEFAULT_TTL = 30
+
+
+def normalize_url(url):
+    """Sort the query parameters of `url` so equivalent URLs compare equal"""
+
+    parts = urlparse.urlsplit(url)
+    query = urllib.urlencode(sorted(urlparse.parse_qsl(parts.query, True)))
+    return urlparse.urlunsplit(parts._replace(query=query))
+
+
+def cache_key(opts):
+    identity = json.dumps([normalize_url(graphite_url(opts)),
+                           opts.username, opts.password])
+    return hashlib.sha1(identity.encode("utf-8")).hexdigest()
+
+
+@contextlib.contextmanager
+def locked(path):
+    """Hold an exclusive lock on `path` (a no-op without fcntl)"""
+
+    with open(path, "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def atomic_write(path, data):
+    """Write `data` to `path` so readers see either nothing or all of it"""
+
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(data)
+        os.rename(tmp, path)
+    except Exception:
+        os.unlink(tmp)
+        raise
+
+
+class RenderCache(object):
+    """Directory of render responses shared between check processes"""
+
+    def __init__(self, directory, ttl=DEFAULT_TTL):
+        self.directory = directory
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.last_hit = None
+        self.last_elapsed = None
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def read(self, path):
+        """Return the data stored at `path` if it is fresh, else None"""
+
+        try:
+            if time.time() - os.stat(path).st_mtime > self.ttl:
+                return None
+            with open(path) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def fetch(self, opts, fetchfn):
+        """Return the render data for `opts`, calling `fetchfn` on a miss"""
+
+        start = time.time()
+        path = self.path(cache_key(opts))
+        data = self.read(path)
+        if data is None:
+            with locked(path + ".lock"):
+                # Another process may have fetched while we waited
+                data = self.read(path)
+                if data is None:
+                    data = fetchfn()
+                    # Don't pin failed or empty results for a whole TTL
+                    if data:
+                        atomic_write(path, json.dumps(data, default=jsonable))
+                    self._record(False, start)
+                    return data
+        self._record(True, start)
+        return data
+
+    def _record(self, hit, start):
+        self.last_hit = hit
+        self.last_elapsed = time.time() - start
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def describe(self):
+        return "render cache {0} in {1:.1f} ms ({2} hits, {3} misses)".format(
+            "hit" if self.last_hit else "miss", self.last_elapsed * 1e3,
+            self.hits, self.misses)
+
+
+_caches = {}
+
+
+def render_cache(directory, ttl=DEFAULT_TTL):
+    """RenderCache for `directory`, shared within the process"""
+
+    key = (directory, ttl)
+    if key not in _caches:
+        _caches[key] = RenderCache(directory, ttl)
+    return _caches[key]
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""Thin client for the nagios_graphite check daemon
+
+`nagios_graphite_client` takes exactly the same arguments as
+`nagios_graphite`, forwards them to a running ``nagios_graphite --daemon``
+over a Unix socket and reproduces the stdout, stderr and exit code the check
+would have produced. It only imports the standard library so it starts fast.
+If the daemon cannot be reached, the check runs in-process instead.
+
+The socket path is taken from ``$NAGIOS_GRAPHITE_SOCKET``, else it is
+``nagios_graphite.sock`` in ``$XDG_RUNTIME_DIR`` or ``~/.nagios_graphite``,
+directories only their owner can write to. Checks run with the rights of the
+daemon, so the daemon makes the socket accessible to its own user only.
+
+Relative paths and the ``NAGIOS_GRAPHITE_*`` variables would be resolved in
+the daemon's environment, so the client sends its working directory and
+those variables along, and the check runs in-process if they differ from the
+daemon's.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import socket
+
+SOCKET_NAME = "nagios_graphite.sock"
+
+
+def default_socket():
+    directory = os.environ.get("XDG_RUNTIME_DIR") or os.path.join(
+        os.path.expanduser("~"), ".nagios_graphite")
+    return os.path.join(directory, SOCKET_NAME)
+
+
+def socket_path():
+    return os.environ.get("NAGIOS_GRAPHITE_SOCKET") or default_socket()
+
+
+def environment():
+    """What a check depends on besides its arguments"""
+
+    return {
+        "cwd": os.getcwd(),
+        "env": dict((k, v) for k, v in os.environ.items()
+                    if k.startswith("NAGIOS_GRAPHITE_") and
+                    k != "NAGIOS_GRAPHITE_SOCKET"),
+    }
+
+
+def recv_all(sock):
+    chunks = []
+    while True:
+        chunk = sock.recv(65536)
+        if not chunk:
+            return b"".join(chunks)
+        chunks.append(chunk)
+
+
+def request(path, args):
+    """Send `args` to the daemon at `path`, returns its reply as a dict"""
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        message = dict(environment(), args=args)
+        sock.sendall(json.dumps(message).encode("utf-8") + b"\n")
+        sock.shutdown(socket.SHUT_WR)
+        return json.loads(recv_all(sock).decode("utf-8"))
+    finally:
+        sock.close()
+
+
+def main(args):
+    try:
+        reply = request(socket_path(), args)
+    except (socket.error, ValueError):
+        reply = {"in_process": True}
+    if reply.get("in_process"):
+        from nagios_graphite.main import main as run_in_process
+        return run_in_process(args)
+
+    sys.stdout.write(reply["stdout"])
+    sys.stderr.write(reply["stderr"])
+    sys.exit(reply["exit_code"])
+
+
+def entry_point():
+    return main(sys.argv)
+
+
+if __name__ == '__main__':
+    entry_point()
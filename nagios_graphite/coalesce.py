@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""Coalesce the render requests of many checks into few HTTP requests
+
+Graphite's /render endpoint accepts several ``target`` parameters. Checks
+that share a hostname, time window, credentials and timeout can therefore be
+fetched together. Each target is wrapped in ``alias(target, "<key>")`` so
+the returned series can be routed back to the check that asked for them.
+
+If a coalesced request fails (for example because one target is invalid and
+graphite-web answers 500), its checks are retried one request each so a
+single bad target cannot fail its neighbours. With a fetch engine the
+retries are jobs of their own, each with its own deadline.
+"""
+
+import urllib
+import functools
+
+from nagios_graphite.main import format_from, graphite_auth
+from nagios_graphite.engine import Job, host_of
+
+DEFAULT_MAX_TARGETS = 20
+DEFAULT_MAX_URL_LENGTH = 4096
+
+
+def group_key(opts):
+    """Checks with equal keys can share a render request"""
+
+    return (opts.hostname, format_from(opts.from_), format_from(opts.until),
+            opts.username, opts.password, opts.http_timeout)
+
+
+def alias_key(index):
+    return "nagios_graphite_{0}".format(index)
+
+
+class RenderGroup(object):
+    """Checks (by index) fetched with a single render request"""
+
+    def __init__(self, opts):
+        self.opts = opts
+        self.members = []
+
+    def targets(self, members=None):
+        members = self.members if members is None else members
+        if len(members) == 1:
+            return [members[0][1].target]
+        return ['alias({0},"{1}")'.format(opts.target, alias_key(index))
+                for index, opts in members]
+
+    def url(self, members=None):
+        qs = [("target", target) for target in self.targets(members)]
+        qs.extend([
+            ("from", format_from(self.opts.from_)),
+            ("until", format_from(self.opts.until)),
+            ("format", "json"),
+        ])
+        return "{0}?{1}".format(self.opts.hostname, urllib.urlencode(qs))
+
+    def split(self):
+        """A single-check RenderGroup for every member"""
+
+        singles = []
+        for index, opts in self.members:
+            single = RenderGroup(opts)
+            single.members.append((index, opts))
+            singles.append(single)
+        return singles
+
+    def fits(self, index, opts, max_targets, max_url_length):
+        members = self.members + [(index, opts)]
+        return (len(members) <= max_targets and
+                len(self.url(members)) <= max_url_length)
+
+
+def coalesce(opts_list, max_targets=DEFAULT_MAX_TARGETS,
+             max_url_length=DEFAULT_MAX_URL_LENGTH):
+    """Group `opts_list` into RenderGroups within the given limits"""
+
+    open_groups = {}
+    groups = []
+    for index, opts in enumerate(opts_list):
+        key = group_key(opts)
+        group = open_groups.get(key)
+        if group is None or not group.fits(
+                index, opts, max_targets, max_url_length):
+            group = open_groups[key] = RenderGroup(opts)
+            groups.append(group)
+        group.members.append((index, opts))
+    return groups
+
+
+def _get(session, opts, url):
+    resp = session.get(url, auth=graphite_auth(opts),
+                       timeout=opts.http_timeout)
+    return resp.json() if resp.ok else None
+
+
+def fetch_group(group, session):
+    """Fetch a RenderGroup, returns a dict of check index to series list
+
+    Returns None if the request of a group of several checks failed.
+    """
+
+    data = _get(session, group.opts, group.url())
+    if len(group.members) == 1:
+        [(index, _)] = group.members
+        return {index: data or []}
+
+    if data is None:
+        return None
+
+    routed = dict((index, []) for index, _ in group.members)
+    by_alias = dict((alias_key(index), index) for index in routed)
+    for series in data:
+        index = by_alias.get(series.get("target"))
+        if index is not None:
+            routed[index].append(series)
+    return routed
+
+
+def _fetch_or_error(group, session):
+    try:
+        return fetch_group(group, session)
+    except Exception as e:
+        return e
+
+
+def fetch_groups(groups, session, engine=None):
+    """fetch_group every group, concurrently through `engine` if given"""
+
+    if engine is None:
+        return [_fetch_or_error(group, session) for group in groups]
+    return engine.run(
+        Job(functools.partial(fetch_group, group, session),
+            host_of(group.opts.hostname), group.opts.http_timeout)
+        for group in groups)
+
+
+def prefetch(opts_list, session, max_targets=DEFAULT_MAX_TARGETS,
+             max_url_length=DEFAULT_MAX_URL_LENGTH, engine=None):
+    """Fetch the render data of every check in `opts_list`
+
+    Groups are fetched concurrently through `engine` (a FetchEngine) when
+    one is given. Returns a list with the series of each check, in the
+    order given; a check whose group failed gets the exception instead.
+    """
+
+    groups = coalesce(opts_list, max_targets, max_url_length)
+    fetched = fetch_groups(groups, session, engine)
+
+    # Retry the checks of failed coalesced requests one by one
+    singles = [single for group, value in zip(groups, fetched)
+               if value is None for single in group.split()]
+    if singles:
+        groups += singles
+        fetched += fetch_groups(singles, session, engine)
+
+    results = {}
+    for group, value in zip(groups, fetched):
+        if value is None:
+            continue
+        if isinstance(value, Exception):
+            value = dict((index, value) for index, _ in group.members)
+        results.update(value)
+    return [results[index] for index in range(len(opts_list))]
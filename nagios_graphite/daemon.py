@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""Long-running check daemon listening on a Unix socket
+
+``nagios_graphite --daemon`` keeps the interpreter, its imports and a pooled
+HTTP session warm. Each connection carries the argv of one check (see
+`nagios_graphite.client`); the daemon runs it exactly as `main()` would and
+replies with the captured stdout, stderr and exit code.
+
+Checks run with the daemon's rights, so the socket is created readable and
+writable by its user only, and its directory is created private if missing.
+A check sent from another working directory or with other
+``NAGIOS_GRAPHITE_*`` variables is answered with ``in_process`` so the
+client runs it itself.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import optparse
+import threading
+import SocketServer
+from StringIO import StringIO
+
+from nagios_graphite.main import run
+from nagios_graphite.batch import batch_session
+from nagios_graphite.client import SOCKET_NAME, socket_path, environment
+
+
+class ThreadLocalStream(object):
+    """File-like object writing to a per-thread buffer when one is set"""
+
+    def __init__(self, default):
+        self.default = default
+        self.local = threading.local()
+
+    def target(self):
+        return getattr(self.local, "buffer", None) or self.default
+
+    def write(self, s):
+        self.target().write(s)
+
+    def flush(self):
+        self.target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self.target(), name)
+
+
+def exit_code(e):
+    """Exit status the interpreter would use for SystemExit `e`"""
+
+    if e.code is None:
+        return 0
+    if isinstance(e.code, int):
+        return e.code
+    print(e.code, file=sys.stderr)
+    return 1
+
+
+def install_capture():
+    """Route sys.stdout and sys.stderr through thread-local buffers"""
+
+    if not isinstance(sys.stdout, ThreadLocalStream):
+        sys.stdout = ThreadLocalStream(sys.stdout)
+    if not isinstance(sys.stderr, ThreadLocalStream):
+        sys.stderr = ThreadLocalStream(sys.stderr)
+
+
+def execute(args, session=None):
+    """Run a check, returning what it printed and its exit code"""
+
+    install_capture()
+    out, err = StringIO(), StringIO()
+    sys.stdout.local.buffer, sys.stderr.local.buffer = out, err
+    try:
+        try:
+            run(args, session).exit()
+            code = 0
+        except SystemExit as e:
+            code = exit_code(e)
+    finally:
+        sys.stdout.local.buffer = sys.stderr.local.buffer = None
+    return {"stdout": out.getvalue(), "stderr": err.getvalue(),
+            "exit_code": code}
+
+
+class CheckHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        try:
+            message = json.loads(self.rfile.readline())
+            args = message["args"]
+        except (ValueError, KeyError, TypeError):
+            return
+        if (message.get("cwd"), message.get("env")) != (
+                self.server.cwd, self.server.env):
+            reply = {"in_process": True}
+        else:
+            reply = execute(args, self.server.session)
+        self.wfile.write(json.dumps(reply))
+
+
+class CheckServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, session):
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+        if os.path.exists(path):
+            os.unlink(path)
+        SocketServer.UnixStreamServer.__init__(self, path, CheckHandler)
+        self.session = session
+        env = environment()
+        self.cwd, self.env = env["cwd"], env["env"]
+
+    def server_bind(self):
+        # Created with mode 0600 from the start, the umask only applies
+        # while binding
+        umask = os.umask(0o177)
+        try:
+            SocketServer.UnixStreamServer.server_bind(self)
+        finally:
+            os.umask(umask)
+
+    def server_close(self):
+        SocketServer.UnixStreamServer.server_close(self)
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+
+def option_parser():
+    parser = optparse.OptionParser(
+        usage="%prog --daemon [options]",
+        description="Serve nagios_graphite checks on a Unix socket")
+    parser.add_option("--daemon", action="store_true")
+    parser.add_option(
+        "--socket", default=socket_path(),
+        help="Unix socket path (default: $NAGIOS_GRAPHITE_SOCKET, else "
+             "{0} in $XDG_RUNTIME_DIR or ~/.nagios_graphite)".format(
+                 SOCKET_NAME))
+    parser.add_option(
+        "--pool-size", type=int, default=10,
+        help="HTTP connections kept per Graphite host (default: 10)")
+    return parser
+
+
+def main(args):
+    opts, _ = option_parser().parse_args(args[1:])
+    server = CheckServer(opts.socket, batch_session(opts.pool_size))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""Concurrent fetch engine for multi-check runs
+
+Render requests of a batch run are independent, so they are issued from a
+pool of worker threads instead of one at a time. Concurrency is capped
+globally (`max_workers`) and per Graphite host (`max_per_host`) so a batch
+cannot overwhelm a single graphite-web. Every job has a deadline of its own
+timeout measured from when it starts; a job that misses it fails with
+DeadlineExceeded and its worker is replaced, so one slow Graphite node
+cannot stall the remaining checks. `run()` is a synchronous facade: it
+blocks until every job has finished, failed or been cancelled.
+
+Only I/O runs concurrently; aggregation still happens in the caller.
+"""
+
+import time
+import threading
+import collections
+
+DEFAULT_WORKERS = 8
+DEFAULT_PER_HOST = 4
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Cancelled(Exception):
+    pass
+
+
+class Job(object):
+    """A call of `fn` against `host` that must finish within `timeout`"""
+
+    def __init__(self, fn, host=None, timeout=None):
+        self.fn = fn
+        self.host = host
+        self.timeout = timeout
+        self.started = None
+        self.finished = False
+        self.result = None
+        self.error = None
+
+    @property
+    def deadline(self):
+        if self.started is None or self.timeout is None:
+            return None
+        return self.started + self.timeout
+
+    @property
+    def value(self):
+        """The result of the job, or the exception it failed with"""
+
+        return self.error if self.error is not None else self.result
+
+
+class FetchEngine(object):
+    def __init__(self, max_workers=DEFAULT_WORKERS,
+                 max_per_host=DEFAULT_PER_HOST):
+        self.max_workers = max_workers
+        self.max_per_host = max_per_host
+        self._cond = threading.Condition()
+        self._pending = []
+        self._running = []
+        self._active = collections.Counter()
+        self._cancelled = False
+
+    def _next_job(self):
+        with self._cond:
+            while self._pending and not self._cancelled:
+                for i, job in enumerate(self._pending):
+                    if self._active[job.host] < self.max_per_host:
+                        del self._pending[i]
+                        self._active[job.host] += 1
+                        self._running.append(job)
+                        job.started = time.time()
+                        self._cond.notify_all()
+                        return job
+                self._cond.wait()
+            return None
+
+    def _finish(self, job, result=None, error=None):
+        """Record the outcome of `job`, returns False if it already ended"""
+
+        with self._cond:
+            if job.finished:
+                # The job expired; its host slot is only free now that the
+                # request has returned
+                self._active[job.host] -= 1
+                self._cond.notify_all()
+                return False
+            job.finished = True
+            job.result, job.error = result, error
+            self._running.remove(job)
+            self._active[job.host] -= 1
+            self._cond.notify_all()
+            return True
+
+    def _worker(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            try:
+                finished = self._finish(job, result=job.fn())
+            except Exception as e:
+                finished = self._finish(job, error=e)
+            if not finished:
+                # The job missed its deadline and a replacement worker was
+                # started, so this one retires.
+                return
+
+    def _start_worker(self):
+        thread = threading.Thread(target=self._worker)
+        thread.daemon = True
+        thread.start()
+
+    def _expire(self, now):
+        for job in list(self._running):
+            if job.deadline is not None and job.deadline <= now:
+                job.finished = True
+                job.error = DeadlineExceeded(
+                    "request to {0} took longer than {1}s".format(
+                        job.host, job.timeout))
+                self._running.remove(job)
+                # The request is still running, so the host keeps its slot
+                # until _finish
+                self._start_worker()
+
+    def cancel(self):
+        """Fail every job that has not started yet with Cancelled"""
+
+        with self._cond:
+            self._cancelled = True
+            for job in self._pending:
+                job.finished = True
+                job.error = Cancelled("fetch was cancelled")
+            del self._pending[:]
+            self._cond.notify_all()
+
+    def run(self, jobs):
+        """Run `jobs` concurrently, returns their values in order"""
+
+        jobs = list(jobs)
+        with self._cond:
+            self._cancelled = False
+            self._pending.extend(jobs)
+        for _ in range(min(self.max_workers, len(jobs))):
+            self._start_worker()
+
+        with self._cond:
+            while not all(job.finished for job in jobs):
+                now = time.time()
+                self._expire(now)
+                deadlines = [job.deadline for job in self._running
+                             if job.deadline is not None]
+                timeout = max(min(deadlines) - now, 0) if deadlines else None
+                if not all(job.finished for job in jobs):
+                    self._cond.wait(timeout)
+        return [job.value for job in jobs]
+
+
+def host_of(url):
+    return url.split("/")[2] if "://" in url else url
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""Render response formats
+
+JSON is the default render format, but decoding large float arrays from
+JSON is expensive. graphite-web can also answer with:
+
+- ``raw``: one ``target,start,end,step|v1,v2,...`` line per series
+- ``msgpack``: binary series info (graphite-web 1.1+, needs `msgpack`)
+- ``pickle``: binary series info, only used with ``--trusted-backend``
+  because unpickling data from an untrusted server is unsafe
+
+Each format has a decoder producing a list of series. JSON gives the usual
+series dicts; the other formats carry start and step, so they are decoded
+straight into `CompactSeries` without building ``[value, timestamp]`` pairs.
+When the server rejects a format (an error status, an image instead of data,
+or a body that does not decode) the request is repeated with
+``format=json``.
+"""
+
+import json
+import cPickle
+from array import array
+from cStringIO import StringIO
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from nagios_graphite.main import RENDER_FORMATS as FORMATS
+from nagios_graphite.series import NAN, CompactSeries
+
+
+class UnsafeFormat(ValueError):
+    pass
+
+
+def _raw_value(token):
+    return NAN if token == "None" else float(token)
+
+
+def decode_json(content):
+    return json.loads(content)
+
+
+def decode_raw(content):
+    series = []
+    for line in content.splitlines():
+        if not line:
+            continue
+        header, _, values = line.rpartition("|")
+        target, start, end, step = header.rsplit(",", 3)
+        series.append(CompactSeries(
+            target, int(start), int(step),
+            array("d", (_raw_value(v) for v in values.split(",") if v))))
+    return series
+
+
+def decode_msgpack(content):
+    if msgpack is None:
+        raise ValueError("msgpack is not installed")
+    return [CompactSeries.from_info(info)
+            for info in msgpack.unpackb(content, raw=False)]
+
+
+def decode_pickle(content):
+    unpickler = cPickle.Unpickler(StringIO(content))
+    # Graphite only pickles builtin containers and numbers; refuse anything
+    # that would import a class or call a function.
+    unpickler.find_global = None
+    return [CompactSeries.from_info(info) for info in unpickler.load()]
+
+
+DECODERS = {
+    "json": decode_json,
+    "raw": decode_raw,
+    "msgpack": decode_msgpack,
+    "pickle": decode_pickle,
+}
+
+
+def check_format(name, trusted=False):
+    if name not in FORMATS:
+        raise ValueError("invalid render format {0!r}, options: {1}".format(
+            name, ", ".join(FORMATS)))
+    if name == "pickle" and not trusted:
+        raise UnsafeFormat(
+            "the pickle render format requires --trusted-backend")
+    if name == "msgpack" and msgpack is None:
+        raise ValueError("the msgpack render format needs msgpack installed")
+
+
+def accepted(resp):
+    """False if the server answered with something other than data"""
+
+    content_type = resp.headers.get("content-type") or ""
+    return resp.ok and not content_type.startswith(("image/", "text/html"))
+
+
+def decode(name, resp):
+    """Decode `resp` as render format `name`, None if it was rejected"""
+
+    if not accepted(resp):
+        return None
+    try:
+        return DECODERS[name](resp.content)
+    except (ValueError, KeyError, TypeError, IndexError,
+            cPickle.UnpicklingError):
+        return None
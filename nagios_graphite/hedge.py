@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""Hedged render requests across equivalent Graphite endpoints
+
+``-H`` takes a comma separated list of graphite-web replicas serving the
+same data. A request goes to the first endpoint; if no response arrived
+after the hedge delay, the same request is sent to the next endpoint, and
+so on. The first successful response is used. An error response or a
+connection failure moves on to the next endpoint right away.
+
+The delay is ``--hedge-delay`` milliseconds, or else the 95th percentile of
+the recent latencies of the first endpoint once `MIN_SAMPLES` are known,
+so only the slowest 5% of requests are duplicated. Latencies are kept per
+process (a daemon or batch run learns as it goes) and, with
+``--hedge-stats``, in a file shared by check processes.
+
+A blocking HTTP request cannot be interrupted, so requests that lose the
+race are left to finish in daemon threads and their responses are closed
+unread.
+"""
+
+import json
+import Queue
+import threading
+import collections
+
+from nagios_graphite.cache import atomic_write, locked
+from nagios_graphite.selection import percentile_rank
+from nagios_graphite.timings import clock
+
+DEFAULT_DELAY_MS = 200
+
+# Latencies needed before the learned p95 replaces the default delay
+MIN_SAMPLES = 20
+
+# Latencies kept per endpoint
+HISTORY = 200
+
+_HEDGE = object()
+
+
+class EndpointStats(object):
+    """Recent latencies and outcomes of requests to one endpoint"""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.latencies = collections.deque(maxlen=HISTORY)
+        self.new = []
+        self.requests = 0
+        self.wins = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def record(self, latency):
+        with self._lock:
+            self.latencies.append(latency)
+            self.new.append(latency)
+
+    def percentile(self, n):
+        latencies = sorted(self.latencies)
+        if not latencies:
+            return None
+        return latencies[percentile_rank(len(latencies), n)]
+
+    def describe(self):
+        def ms(n):
+            latency = self.percentile(n)
+            return "-" if latency is None else "{0:.1f} ms".format(
+                latency * 1e3)
+
+        return ("{0}: {1} requests, {2} won, {3} failed, p50 {4}, "
+                "p95 {5}".format(self.endpoint, self.requests, self.wins,
+                                 self.failures, ms(0.5), ms(0.95)))
+
+
+_stats = {}
+
+
+def endpoint_stats(endpoint):
+    """EndpointStats for `endpoint`, shared within the process"""
+
+    if endpoint not in _stats:
+        _stats[endpoint] = EndpointStats(endpoint)
+    return _stats[endpoint]
+
+
+def load_stats(path, stats):
+    """Seed `stats` that have no latencies yet from the file at `path`"""
+
+    try:
+        with open(path) as f:
+            stored = json.load(f)
+    except (IOError, OSError, ValueError):
+        return
+    for s in stats:
+        if not s.latencies:
+            s.latencies.extend(stored.get(s.endpoint, []))
+
+
+def save_stats(path, stats):
+    """Append the latencies recorded since loading to the file at `path`"""
+
+    with locked(path + ".lock"):
+        try:
+            with open(path) as f:
+                stored = json.load(f)
+        except (IOError, OSError, ValueError):
+            stored = {}
+        for s in stats:
+            with s._lock:
+                new, s.new = s.new, []
+            stored[s.endpoint] = (stored.get(s.endpoint, []) + new)[-HISTORY:]
+        atomic_write(path, json.dumps(stored))
+
+
+class HedgedSession(object):
+    """Session proxy that hedges GETs across `endpoints`
+
+    URLs are expected to start with the first endpoint, which is replaced
+    by the others for the hedged requests.
+    """
+
+    def __init__(self, session, endpoints, delay_ms=None):
+        self._session = session
+        self.endpoints = endpoints
+        self.delay_ms = delay_ms
+        self.stats = [endpoint_stats(e) for e in endpoints]
+
+    def __getattr__(self, name):
+        return getattr(self._session, name)
+
+    @property
+    def delay(self):
+        """Seconds to wait for an endpoint before trying the next"""
+
+        if self.delay_ms is not None:
+            return self.delay_ms / 1e3
+        primary = self.stats[0]
+        if len(primary.latencies) >= MIN_SAMPLES:
+            return primary.percentile(0.95)
+        return DEFAULT_DELAY_MS / 1e3
+
+    def get(self, url, **kwargs):
+        primary = self.endpoints[0]
+        if not url.startswith(primary):
+            return self._session.get(url, **kwargs)
+        path = url[len(primary):]
+
+        results = Queue.Queue()
+        lock = threading.Lock()
+        state = {"won": False}
+        attempts = collections.deque(
+            (s, e + path) for s, e in zip(self.stats, self.endpoints))
+
+        def attempt(stats, url):
+            start = clock()
+            try:
+                resp = self._session.get(url, **kwargs)
+            except Exception as e:
+                stats.failures += 1
+                results.put((stats, None, e))
+                return
+            stats.record(clock() - start)
+            if not resp.ok:
+                stats.failures += 1
+            with lock:
+                if not state["won"]:
+                    results.put((stats, resp, None))
+                    return
+            resp.close()
+
+        def launch():
+            stats, url = attempts.popleft()
+            stats.requests += 1
+            thread = threading.Thread(target=attempt, args=(stats, url))
+            thread.daemon = True
+            thread.start()
+            if attempts:
+                timer = threading.Timer(self.delay, results.put, [_HEDGE])
+                timer.daemon = True
+                timer.start()
+                timers.append(timer)
+
+        timers = []
+        outstanding = 0
+        failed = None
+        launch()
+        outstanding += 1
+        try:
+            while outstanding:
+                result = results.get()
+                if result is _HEDGE:
+                    if attempts:
+                        launch()
+                        outstanding += 1
+                    continue
+                outstanding -= 1
+                stats, resp, error = result
+                if resp is not None and resp.ok:
+                    stats.wins += 1
+                    return resp
+                if failed is not None and failed[0] is not None:
+                    failed[0].close()
+                failed = (resp, error)
+                if attempts:
+                    launch()
+                    outstanding += 1
+        finally:
+            with lock:
+                state["won"] = True
+            for timer in timers:
+                timer.cancel()
+            self._close_queued(results)
+
+        # Every endpoint failed: behave like the last one
+        resp, error = failed
+        if resp is None:
+            raise error
+        return resp
+
+    @staticmethod
+    def _close_queued(results):
+        while True:
+            try:
+                result = results.get_nowait()
+            except Queue.Empty:
+                return
+            if result is not _HEDGE and result[1] is not None:
+                result[1].close()
+
+    def describe(self):
+        return "\n".join(s.describe() for s in self.stats)
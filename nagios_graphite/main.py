@@ -1,33 +1,39 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-"""Program entry point"""
+"""Program entry point
+
+Only modules needed to parse the command line are imported at start-up;
+`requests` and the optional backends are imported when a check fetches
+data, so `--help` and argument errors return quickly.
+"""
 
 from __future__ import print_function
 
+import os
 import sys
+import random
 import urllib
+import itertools
 import functools
+import collections
 
-import requests
 from pynagios import Plugin, Response, make_option, UNKNOWN
 
+from nagios_graphite.selection import select, select_many, percentile_rank
+from nagios_graphite.series import CompactSeries
+from nagios_graphite.sketch import DDSketch, DEFAULT_ACCURACY
+
 
 class EmptyQueryResult(Exception):
     pass
 
 
-def percentile(n):
-    """Create function that calculates percentile for list"""
-
-    return lambda xs: sorted(xs)[int(len(xs)*n)]
-
-
 def remove_null(aggfn):
     """Decorator for removing null values for `aggfn`"""
 
     @functools.wraps(aggfn)
     def wrapper(xs):
-        return aggfn([x for x in xs if x is not None])
+        return aggfn(x for x in xs if x is not None)
     return wrapper
 
 
@@ -36,9 +42,12 @@ def raise_on_empty(aggfn):
 
     @functools.wraps(aggfn)
     def wrapper(xs):
-        if not xs:
+        it = iter(xs)
+        try:
+            first = next(it)
+        except StopIteration:
             raise EmptyQueryResult("Graphite query returned no results")
-        return aggfn(xs)
+        return aggfn(itertools.chain([first], it))
     return wrapper
 
 
@@ -49,90 +58,567 @@ def values_only(aggfn):
 def nullcnt(xs):
     """Counts null values in Graphite query result"""
 
-    return len([x for x in xs if x is None])
+    return FUNCTIONS["nullcnt"](xs)
 
 
 def nullpct(xs):
     """Calculates percentage of null values in Graphite query result"""
 
-    return float(nullcnt(xs)) / float(len(xs))
+    return FUNCTIONS["nullpct"](xs)
+
 
+PERCENTILES = {
+    "median": 0.5,
+    "95th":   0.95,
+    "99th":   0.99,
+    "999th":  0.999,
+}
 
-FUNCTIONS = {
-    "sum":    values_only(sum),
-    "min":    values_only(min),
-    "max":    values_only(max),
-    "avg":    values_only(lambda xs: sum(xs) / len(xs)),
-    "median": values_only(percentile(0.5)),
-    "95th":   values_only(percentile(0.95)),
-    "99th":   values_only(percentile(0.99)),
-    "999th":  values_only(percentile(0.999)),
-    "nullcnt": raise_on_empty(nullcnt),
-    "nullpct": raise_on_empty(nullpct),
+# Percentiles estimated with a sketch (see nagios_graphite.sketch) instead
+# of keeping every value
+SKETCHES = {
+    "median~": 0.5,
+    "95th~":   0.95,
+    "99th~":   0.99,
+    "999th~":  0.999,
 }
 
 
+class Summary(object):
+    """Single-pass accumulator for every statistic in FUNCTIONS
+
+    With `sample_size`, at most that many values are kept for percentiles
+    (a uniform reservoir sample) and `sampled` tells whether any were left
+    out. With `accuracy`, values are also counted into a DDSketch of that
+    relative accuracy for approximate percentiles.
+    """
+
+    def __init__(self, keep_values=False, sample_size=None, accuracy=None):
+        self.count = 0
+        self.nulls = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+        self.values = [] if keep_values else None
+        self.sample_size = sample_size
+        self.sampled = False
+        self.sketch = DDSketch(accuracy) if accuracy is not None else None
+        self._ranks = {}
+
+    def add(self, x):
+        self.count += 1
+        if x is None:
+            self.nulls += 1
+            return
+        self.total += x
+        if self.min is None or x < self.min:
+            self.min = x
+        if self.max is None or x > self.max:
+            self.max = x
+        if self.sketch is not None:
+            self.sketch.add(x)
+        if self.values is not None:
+            self._keep(x)
+            self._ranks = {}
+
+    def _keep(self, x):
+        if self.sample_size is None or len(self.values) < self.sample_size:
+            self.values.append(x)
+            return
+        self.sampled = True
+        i = random.randrange(self.size)
+        if i < self.sample_size:
+            self.values[i] = x
+
+    def update(self, xs):
+        if self.sample_size is not None:
+            for x in xs:
+                self.add(x)
+            return self
+
+        # add() inlined, with the state in locals
+        count, nulls, total = self.count, self.nulls, self.total
+        lo, hi = self.min, self.max
+        keep = self.values.append if self.values is not None else None
+        sketch = self.sketch.add if self.sketch is not None else None
+        for x in xs:
+            count += 1
+            if x is None:
+                nulls += 1
+                continue
+            total += x
+            if lo is None or x < lo:
+                lo = x
+            if hi is None or x > hi:
+                hi = x
+            if sketch is not None:
+                sketch(x)
+            if keep is not None:
+                keep(x)
+        self.count, self.nulls, self.total = count, nulls, total
+        self.min, self.max = lo, hi
+        self._ranks = {}
+        return self
+
+    @property
+    def size(self):
+        """Number of non-null values seen"""
+
+        return self.count - self.nulls
+
+    def select_percentiles(self, ns):
+        """Select the ranks for every percentile in `ns` in one pass"""
+
+        if self.values is None:
+            raise ValueError("Summary was created without keep_values")
+        size = len(self.values)
+        ranks = [percentile_rank(size, n) for n in ns]
+        self._ranks.update(
+            select_many(self.values, [k for k in ranks if k < size]))
+
+    def percentile(self, n):
+        if self.values is None:
+            raise ValueError("Summary was created without keep_values")
+        k = percentile_rank(len(self.values), n)
+        if k not in self._ranks:
+            self._ranks[k] = select(self.values, k)
+        return self._ranks[k]
+
+    def approximate_percentile(self, n):
+        if self.sketch is None:
+            raise ValueError("Summary was created without accuracy")
+        return self.sketch.quantile(n)
+
+
+def summary_values_only(statfn):
+    """Raise EmptyQueryResult unless `summary` saw a non-null value"""
+
+    @functools.wraps(statfn)
+    def wrapper(summary):
+        if not summary.size:
+            raise EmptyQueryResult("Graphite query returned no results")
+        return statfn(summary)
+    return wrapper
+
+
+def summary_raise_on_empty(statfn):
+    """Raise EmptyQueryResult unless `summary` saw any value at all"""
+
+    @functools.wraps(statfn)
+    def wrapper(summary):
+        if not summary.count:
+            raise EmptyQueryResult("Graphite query returned no results")
+        return statfn(summary)
+    return wrapper
+
+
+def summary_percentile(n):
+    return summary_values_only(lambda s: s.percentile(n))
+
+
+def summary_approximate_percentile(n):
+    return summary_values_only(lambda s: s.approximate_percentile(n))
+
+
+SUMMARY_FUNCTIONS = {
+    "sum":    summary_values_only(lambda s: s.total),
+    "min":    summary_values_only(lambda s: s.min),
+    "max":    summary_values_only(lambda s: s.max),
+    "avg":    summary_values_only(lambda s: s.total / s.size),
+    "median": summary_percentile(PERCENTILES["median"]),
+    "95th":   summary_percentile(PERCENTILES["95th"]),
+    "99th":   summary_percentile(PERCENTILES["99th"]),
+    "999th":  summary_percentile(PERCENTILES["999th"]),
+    "median~": summary_approximate_percentile(SKETCHES["median~"]),
+    "95th~":  summary_approximate_percentile(SKETCHES["95th~"]),
+    "99th~":  summary_approximate_percentile(SKETCHES["99th~"]),
+    "999th~": summary_approximate_percentile(SKETCHES["999th~"]),
+    "nullcnt": summary_raise_on_empty(lambda s: s.nulls),
+    "nullpct": summary_raise_on_empty(
+        lambda s: float(s.nulls) / float(s.count)),
+}
+
+
+def summary_function(name):
+    """Function computing the `name` aggregate of some values on its own"""
+
+    def aggfn(xs):
+        return aggregate(xs, [name])[name]
+    aggfn.__name__ = "aggregate_" + name
+    return aggfn
+
+
+FUNCTIONS = dict((name, summary_function(name)) for name in SUMMARY_FUNCTIONS)
+
 F_OPTS = ", ".join(FUNCTIONS.keys())
 
 
+def parse_functions(spec):
+    """Parse a comma separated list of FUNCTIONS names (or "all")
+
+    "all" lists the default "avg" first, so it stays the aggregate
+    thresholds apply to, then the rest by name.
+    """
+
+    names = [name.strip() for name in spec.split(",") if name.strip()]
+    if names == ["all"]:
+        return ["avg"] + sorted(name for name in FUNCTIONS if name != "avg")
+
+    unknown = [name for name in names if name not in FUNCTIONS]
+    if unknown or not names:
+        raise ValueError("invalid algorithm {0!r}, options: {1}, all".format(
+            spec, F_OPTS))
+    return names
+
+
+class Aggregates(collections.OrderedDict):
+    """Aggregate name to value, `approximate` if percentiles were sampled"""
+
+    approximate = False
+
+
+def aggregate(values, names, sample_size=None, accuracy=DEFAULT_ACCURACY):
+    """Compute every aggregate in `names` over `values` in a single pass"""
+
+    ns = [PERCENTILES[name] for name in names if name in PERCENTILES]
+    sketched = any(name in SKETCHES for name in names)
+    summary = Summary(bool(ns), sample_size,
+                      accuracy if sketched else None).update(values)
+    if ns:
+        summary.select_percentiles(ns)
+    result = Aggregates(
+        (name, SUMMARY_FUNCTIONS[name](summary)) for name in names)
+    result.approximate = summary.sampled
+    return result
+
+
+def iter_values(series):
+    """Lazily yield every datapoint value across all Graphite series"""
+
+    for e in series:
+        if isinstance(e, CompactSeries):
+            for v in e.values:
+                yield None if v != v else v
+            continue
+        for point in e["datapoints"]:
+            yield point[0]
+
+
 def combine(series, aggfn):
     """Combine Graphite series data using aggfn"""
 
-    pairs = reduce(lambda a, b: a + b, [e["datapoints"] for e in series], [])
-    points = [e[0] for e in pairs]
-    return aggfn(points)
+    return aggfn(iter_values(series))
+
+
+def verbose(opts, message):
+    """Print diagnostics to stderr when -v is given"""
+
+    if opts.verbosity:
+        print(message, file=sys.stderr)
 
 
 def format_from(from_):
-    if not from_.startswith("-"):
+    # Bare integers are absolute epoch timestamps
+    if not from_.startswith("-") and not from_.isdigit():
         return "-" + from_
     else:
         return from_
 
 
-def graphite_querystring(opts):
+def graphite_querystring(opts, format_="json"):
     qs = {
         "target": opts.target,
         "from": format_from(opts.from_),
         "until": format_from(opts.until),
-        "format": "json",
+        "format": format_,
     }
 
     return urllib.urlencode(qs)
 
 
-def graphite_url(opts):
-    qs = graphite_querystring(opts)
+def split_hostnames(hostname):
+    """The endpoints of a comma separated --hostname"""
+
+    if hostname is None:
+        return []
+    return [h.strip() for h in hostname.split(",") if h.strip()]
+
+
+def graphite_url(opts, format_="json"):
+    qs = graphite_querystring(opts, format_)
     return "{0}?{1}".format(opts.hostname, qs)
 
 
-def graphite_session(opts):
-    session = requests.Session()
+def graphite_auth(opts):
     if opts.username:
-        session.auth = (opts.username, opts.password)
+        return (opts.username, opts.password)
+    return None
+
+
+TRANSPORTS = ("requests", "urllib")
+
+RENDER_FORMATS = ("json", "raw", "msgpack", "pickle")
+
+OVER_BUDGET = ("unknown", "approximate")
+
+
+def graphite_session(opts):
+    if opts.transport == "urllib":
+        from nagios_graphite.transport import UrllibSession
+        session = UrllibSession()
+    else:
+        import requests
+        session = requests.Session()
+    session.auth = graphite_auth(opts)
     return session
 
 
+def graphite_fetch_format(opts, session):
+    """Fetch in `opts.render_format`, None if the server rejected it"""
+
+    from nagios_graphite import formats
+
+    formats.check_format(opts.render_format, opts.trusted_backend)
+    url = graphite_url(opts, opts.render_format)
+    resp = session.get(
+        url, auth=graphite_auth(opts), timeout=opts.http_timeout)
+
+    data = formats.decode(opts.render_format, resp)
+    if data is None:
+        verbose(opts, "{0} render format rejected, falling back to "
+                      "json".format(opts.render_format))
+    return data
+
+
 def graphite_fetch(opts, session=None):
     if session is None:
         session = graphite_session(opts)
 
+    if opts.render_format != "json":
+        data = graphite_fetch_format(opts, session)
+        if data is not None:
+            return data
+
     url = graphite_url(opts)
-    resp = session.get(url, timeout=opts.http_timeout)
+    resp = session.get(
+        url, auth=graphite_auth(opts), timeout=opts.http_timeout)
 
     return resp.json() if resp.ok else []
 
 
-def check_graphite(opts, session=None):
-    aggfn = FUNCTIONS[opts.func]
-    raw_data = graphite_fetch(opts)
+def graphite_stream(opts, session=None):
+    """Start a streaming render request, returns a RenderStream or None"""
+
+    from nagios_graphite.stream import RenderStream
+
+    if session is None:
+        session = graphite_session(opts)
 
-    if raw_data:
-        return combine(raw_data, aggfn)
+    url = graphite_url(opts)
+    resp = session.get(
+        url, auth=graphite_auth(opts), timeout=opts.http_timeout, stream=True)
+    if not resp.ok:
+        resp.close()
+        return None
+    return RenderStream.from_response(resp)
+
+
+def cached_fetch(opts, session=None):
+    """graphite_fetch through the shared on-disk render cache"""
+
+    from nagios_graphite.cache import render_cache
+
+    cache = render_cache(opts.cache_dir, opts.cache_ttl)
+    data = cache.fetch(opts, lambda: graphite_fetch(opts, session))
+    verbose(opts, cache.describe())
+    return data
+
+
+def delta_fetch(opts, session=None):
+    """graphite_fetch that only downloads points new since the last run"""
+
+    from nagios_graphite.window import SlidingWindow
+
+    window = SlidingWindow(
+        opts.delta_dir, opts.delta_overlap, opts.delta_refresh)
+    return window.fetch(opts, session)
+
+
+def fetch_series(opts, session=None):
+    """Fetch the render data of `opts`, through the delta store or cache"""
+
+    if opts.delta_dir:
+        return delta_fetch(opts, session)
+    elif opts.cache_dir:
+        return cached_fetch(opts, session)
+    return graphite_fetch(opts, session)
+
+
+BACKENDS = ("auto", "python", "numpy")
+
+
+def resolve_backend(name):
+    """Resolve an aggregation backend name to "python" or "numpy"
+
+    "auto" selects NumPy whenever it can be imported. "python" imports
+    neither the backend nor NumPy.
+    """
+
+    if name not in BACKENDS:
+        raise ValueError("invalid backend {0!r}, options: {1}".format(
+            name, ", ".join(BACKENDS)))
+    if name == "python":
+        return name
+
+    from nagios_graphite import vectorized
+
+    if name == "numpy" and not vectorized.available():
+        raise ValueError("numpy backend requested but numpy is not installed")
+    if name == "auto":
+        return "numpy" if vectorized.available() else "python"
+    return name
+
+
+def aggregate_series(series, names, backend="python",
+                     accuracy=DEFAULT_ACCURACY):
+    """Compute the aggregates in `names` over Graphite series data"""
+
+    if resolve_backend(backend) == "numpy":
+        from nagios_graphite import vectorized
+        values = vectorized.Values.from_series(series)
+        # Whole numbers past 2**53 are not exact in float64
+        if not values.integral:
+            return vectorized.aggregate(values, names, accuracy)
+    return aggregate(iter_values(series), names, accuracy=accuracy)
+
+
+def aggregate_budgeted(values, names, opts):
+    """aggregate() that enforces the --max-datapoints budget
+
+    Whatever the backend, values go through the single-pass Summary, so
+    memory is bounded by its state (and by the sample when approximate).
+    """
+
+    from nagios_graphite.budget import Budget
+
+    budget = Budget(opts.max_datapoints, opts.over_budget == "approximate")
+    sample_size = budget.limit if budget.approximate else None
+    try:
+        return aggregate(budget.count(values), names, sample_size,
+                         opts.sketch_accuracy)
+    finally:
+        verbose(opts, budget.describe())
+
+
+def describe_sketches(opts, names):
+    """Report the error bound of the approximate percentiles in `names`"""
+
+    sketched = [name for name in names if name in SKETCHES]
+    if sketched:
+        verbose(opts, "{0} estimated within {1:g}% of the exact "
+                      "percentile".format(", ".join(sketched),
+                                          opts.sketch_accuracy * 100))
+
+
+def check_graphite_stream(opts, names, session=None, timings=None):
+    """Aggregate a render response while it is being downloaded
+
+    Values go through the single-pass Summary whatever the backend, loading
+    them into an array would hold the whole response in memory.
+    """
+
+    stream = graphite_stream(opts, session)
+    if stream is None:
+        return None
+
+    try:
+        if opts.max_datapoints:
+            return aggregate_budgeted(stream.values(), names, opts)
+        return aggregate(stream.values(), names,
+                         accuracy=opts.sketch_accuracy)
+    except EmptyQueryResult:
+        if stream.series:
+            raise
+        return None
+    finally:
+        stream.close()
+        if timings is not None:
+            timings.count(stream.series, stream.points)
+
+
+def fetch_or_answer(opts, names, session=None, timings=None):
+    """Fetch the series of `opts`, unless the check can be answered directly
+
+    Returns (True, aggregates) when pushdown, the sketch store or a
+    streamed download answered `names`, else (False, the fetched series).
+    """
+
+    if opts.pushdown:
+        from nagios_graphite import pushdown
+        if pushdown.can_push_down(names):
+            return True, pushdown.check_pushdown(
+                opts, names, session or graphite_session(opts))
+        verbose(opts, "pushdown not possible for {0}, aggregating "
+                      "locally".format(", ".join(names)))
+
+    if opts.sketch_dir:
+        from nagios_graphite import buckets
+        if buckets.can_use(opts, names):
+            return True, buckets.check_buckets(opts, names, session)
+        verbose(opts, "--sketch-dir only answers ~ percentiles over a "
+                      "relative window, fetching every point")
+
+    if (opts.stream or opts.max_datapoints) and not (
+            opts.delta_dir or opts.cache_dir):
+        # A budget is enforced while downloading, not after buffering
+        return True, check_graphite_stream(opts, names, session, timings)
+    return False, fetch_series(opts, session)
+
+
+def check_graphite_all(opts, session=None, raw_data=None, timings=None):
+    """Compute every aggregate requested by `opts.func` from one fetch
+
+    Returns an OrderedDict of aggregate name to value, with the primary
+    aggregate (the one thresholds apply to) first, or None if Graphite
+    returned no series. Series fetched ahead of time by the caller can be
+    passed as `raw_data`. Phases are recorded into `timings` (a
+    timings.Timings) when given.
+    """
+
+    names = parse_functions(opts.func)
+    describe_sketches(opts, names)
+    if timings is not None:
+        if raw_data is None:
+            session = timings.wrap(session or graphite_session(opts))
+        timings.start()
+
+    if raw_data is None:
+        answered, result = fetch_or_answer(opts, names, session, timings)
+        if answered:
+            return result
+        raw_data = result
+
+    if raw_data and timings is not None:
+        timings.start_aggregation(raw_data)
+
+    if raw_data and opts.max_datapoints:
+        return aggregate_budgeted(iter_values(raw_data), names, opts)
+    elif raw_data:
+        return aggregate_series(raw_data, names, opts.backend,
+                                opts.sketch_accuracy)
     else:
         return None
 
 
+def check_graphite(opts, session=None):
+    """Primary aggregate of `opts`, None if Graphite returned no series"""
+
+    result = check_graphite_all(opts, session)
+    if result is None:
+        return None
+    return next(result.itervalues())
+
+
 class GraphiteNagios(Plugin):
     username = make_option(
         "--username", "-U",
@@ -158,8 +644,145 @@ class GraphiteNagios(Plugin):
     func = make_option(
         "--algorithm", "-A",
         help=("Algorithm for combining metrics, options: "
-              "{0}, (default: avg)".format(F_OPTS)),
-        default="avg", choices=FUNCTIONS.keys())
+              "{0}, (default: avg). Several algorithms may be given "
+              "separated by commas, or \"all\"; thresholds apply to the "
+              "first one, which is avg for \"all\"".format(F_OPTS)),
+        default="avg")
+
+    backend = make_option(
+        "--backend",
+        help=("Aggregation backend, options: {0} (default: "
+              "$NAGIOS_GRAPHITE_BACKEND, else auto which uses numpy "
+              "when installed); --stream and --max-datapoints always "
+              "aggregate in a single pass".format(", ".join(BACKENDS))),
+        default=os.environ.get("NAGIOS_GRAPHITE_BACKEND", "auto"),
+        choices=BACKENDS)
+
+    stream = make_option(
+        "--stream",
+        help=("Parse the render response incrementally while it downloads "
+              "instead of buffering it"),
+        action="store_true", default=False)
+
+    transport = make_option(
+        "--transport",
+        help=("HTTP client, options: {0} (default: "
+              "$NAGIOS_GRAPHITE_TRANSPORT, else requests). urllib uses only "
+              "the standard library and starts faster".format(
+                  ", ".join(TRANSPORTS))),
+        default=os.environ.get("NAGIOS_GRAPHITE_TRANSPORT", "requests"),
+        choices=TRANSPORTS)
+
+    cache_dir = make_option(
+        "--cache-dir",
+        help=("Share render responses between checks through this "
+              "directory (default: no caching)"))
+    cache_ttl = make_option(
+        "--cache-ttl",
+        help="Seconds a cached render response stays fresh (default: 30)",
+        default=30,
+        type=int)
+
+    delta_dir = make_option(
+        "--delta-dir",
+        help=("Keep the fetched window in this directory and only fetch "
+              "new points on later runs; targets with Graphite functions "
+              "are always fetched in full (default: fetch everything)"))
+    delta_overlap = make_option(
+        "--delta-overlap",
+        help=("Seconds before the last stored point to fetch again, for "
+              "late-arriving points (default: 120)"),
+        default=120,
+        type=int)
+    delta_refresh = make_option(
+        "--delta-refresh",
+        help=("Seconds after which the whole window is fetched again, for "
+              "backfilled points (default: 3600)"),
+        default=3600,
+        type=int)
+
+    render_format = make_option(
+        "--render-format",
+        help=("Graphite render format, options: {0} (default: json). "
+              "Falls back to json when the server rejects it; ignored "
+              "with --stream".format(", ".join(RENDER_FORMATS))),
+        default="json",
+        choices=RENDER_FORMATS)
+    trusted_backend = make_option(
+        "--trusted-backend",
+        help="Trust the Graphite server enough to unpickle its responses",
+        action="store_true", default=False)
+
+    pushdown = make_option(
+        "--pushdown",
+        help=("Let Graphite aggregate sum, min, max and avg so only a "
+              "single point per aggregate is downloaded"),
+        action="store_true", default=False)
+
+    max_datapoints = make_option(
+        "--max-datapoints",
+        help=("Process at most this many datapoints, counted while they "
+              "are downloaded (default: no limit)"),
+        type=int)
+    over_budget = make_option(
+        "--over-budget",
+        help=("What to do past --max-datapoints, options: {0} "
+              "(default: unknown). approximate samples values for "
+              "percentiles".format(", ".join(OVER_BUDGET))),
+        default="unknown",
+        choices=OVER_BUDGET)
+
+    sketch_accuracy = make_option(
+        "--sketch-accuracy",
+        help=("Relative error bound of the approximate percentiles "
+              "({0}) (default: {1})".format(
+                  ", ".join(sorted(SKETCHES)), DEFAULT_ACCURACY)),
+        default=DEFAULT_ACCURACY,
+        type=float)
+
+    sketch_dir = make_option(
+        "--sketch-dir",
+        help=("Keep percentile sketches of every complete time bucket in "
+              "this directory and only fetch the buckets not stored yet; "
+              "~ percentiles over a relative window only (default: fetch "
+              "everything)"))
+    sketch_bucket = make_option(
+        "--sketch-bucket",
+        help="Seconds covered by each stored sketch (default: 3600)",
+        default=3600,
+        type=int)
+
+    timings = make_option(
+        "--timings",
+        help=("Add the time spent fetching, parsing and aggregating and "
+              "the bytes, series and points read as perf data"),
+        action="store_true", default=False)
+
+    per_series = make_option(
+        "--per-series",
+        help=("Apply the algorithm and thresholds to every series "
+              "separately; the status is that of the worst series"),
+        action="store_true", default=False)
+    top = make_option(
+        "--top",
+        help="Series named in the message with --per-series (default: 5)",
+        default=5,
+        type=int)
+
+    profile_out = make_option(
+        "--profile-out",
+        help=("Write cProfile stats of the check to this file; {pid} and "
+              "{time} are replaced by the process id and start time"))
+    memprofile_out = make_option(
+        "--memprofile-out",
+        help=("Write the top memory allocations of the check to this file; "
+              "{pid} and {time} are replaced as for --profile-out"))
+    profile_sample = make_option(
+        "--profile-sample",
+        help=("Only profile one in this many invocations on average "
+              "(default: 1)"),
+        default=1,
+        type=int)
 
     http_timeout = make_option(
         "--http-timeout", "-o",
@@ -167,31 +790,118 @@ class GraphiteNagios(Plugin):
         default=10,
         type=int)
 
+    hedge_delay = make_option(
+        "--hedge-delay",
+        help=("Milliseconds to wait for a --hostname endpoint before "
+              "sending the request to the next one as well (default: the "
+              "95th percentile of its past latencies, else 200)"),
+        type=int)
+    hedge_stats = make_option(
+        "--hedge-stats",
+        help=("Keep the endpoint latencies the hedge delay is learned from "
+              "in this file (default: only within the process)"))
+
+    # Set by callers that run many checks: a shared requests.Session and
+    # render data fetched ahead of time
+    session = None
+    raw_data = None
+
+    def __init__(self, args=sys.argv):
+        super(GraphiteNagios, self).__init__(args)
+        # -H may list equivalent endpoints, URLs are built for the first
+        self.options.hostnames = split_hostnames(self.options.hostname)
+        if self.options.hostnames:
+            self.options.hostname = self.options.hostnames[0]
+
     def check(self):
-        value = check_graphite(self.options)
-        if value is None:
-            return Response(UNKNOWN, "No results returned!")
+        if len(self.options.hostnames) < 2 or self.raw_data is not None:
+            return self.check_with(self.session)
 
-        message = "{0} ({1} is {2})".format(
-            self.options.name, self.options.func, value)
-        response = self.response_for_value(value, message)
+        from nagios_graphite import hedge
+
+        opts = self.options
+        session = hedge.HedgedSession(
+            self.session or graphite_session(opts), opts.hostnames,
+            opts.hedge_delay)
+        if opts.hedge_stats:
+            hedge.load_stats(opts.hedge_stats, session.stats)
         try:
-            response.set_perf_data(self.options.func, value)
-        except ValueError as e:
-            raise ValueError("failed to set {} as perf data: {}".format(
-                value, str(e)))
+            return self.check_with(session)
+        finally:
+            verbose(opts, session.describe())
+            if opts.hedge_stats:
+                hedge.save_stats(opts.hedge_stats, session.stats)
+
+    def check_with(self, session):
+        if self.options.per_series:
+            from nagios_graphite import perseries
+            return perseries.check(self, session)
+
+        timings = None
+        if self.options.timings:
+            from nagios_graphite.timings import Timings
+            timings = Timings()
+
+        values = check_graphite_all(
+            self.options, session, self.raw_data, timings)
+        if values is None:
+            return Response(UNKNOWN, "No results returned!")
+        if timings is not None:
+            timings.finish()
+        return self.response_for_values(values, timings)
+
+    def response_for_values(self, values, timings=None):
+        """Response for the aggregates `values`
+
+        The first aggregate is checked against the thresholds. Every
+        aggregate, and `timings` when given, goes into the perf data.
+        """
+
+        value = next(values.itervalues())
+        message = "{0} ({1})".format(self.options.name, ", ".join(
+            "{0} is {1}".format(k, v) for k, v in values.iteritems()))
+        if getattr(values, "approximate", False):
+            message += " (approximate)"
+        response = self.response_for_value(value, message)
+        for func, value in values.iteritems():
+            try:
+                response.set_perf_data(func, value)
+            except ValueError as e:
+                raise ValueError("failed to set {} as perf data: {}".format(
+                    value, str(e)))
+        if timings is not None:
+            for label, value in timings.perf_data():
+                response.set_perf_data(label, value)
         return response
 
 
-def main(args):
+def client_error(e):
+    message = "{0}: {1}".format(e.__class__.__name__, str(e))
+    return Response(UNKNOWN, "Client error: " + message)
+
+
+def run(args, session=None):
+    """Run the check described by `args` and return its Response"""
+
     try:
-        return GraphiteNagios(args).check().exit()
+        plugin = GraphiteNagios(args)
+        plugin.session = session
+        if plugin.options.profile_out or plugin.options.memprofile_out:
+            from nagios_graphite import profiling
+            return profiling.profiled(plugin.check, plugin.options)
+        return plugin.check()
     except Exception as e:
-        message = "{0}: {1}".format(e.__class__.__name__, str(e))
-        Response(UNKNOWN, "Client error: " + message).exit()
+        return client_error(e)
+
+
+def main(args):
+    return run(args).exit()
 
 
 def entry_point():
+    if "--daemon" in sys.argv[1:]:
+        from nagios_graphite import daemon
+        return daemon.main(sys.argv)
     return main(sys.argv)
 
 if __name__ == '__main__':
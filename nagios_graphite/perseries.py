@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""Evaluate thresholds for every series of a query separately
+
+With ``--per-series`` the algorithm is applied to each series on its own
+instead of to all datapoints combined, so ``servers.*.disk.used`` alerts on
+the worst server rather than on the fleet average. Series are aggregated one
+at a time (while streaming with ``--stream``) and only the ``--top`` worst
+are kept, in a heap, so memory does not grow with the number of series.
+
+Series are ranked by status (CRITICAL, WARNING, OK) and then by how far the
+value is past the warning range (or the critical range if there is no
+warning range, or by the value itself without thresholds).
+"""
+
+import heapq
+import itertools
+
+from pynagios import Response, OK, WARNING, CRITICAL, UNKNOWN
+
+from nagios_graphite.main import (
+    EmptyQueryResult, aggregate, parse_functions, iter_values,
+    graphite_stream, fetch_series, describe_sketches, verbose)
+
+DEFAULT_TOP = 5
+
+
+def badness(value, threshold):
+    """How far `value` is into the alerting side of a Nagios range"""
+
+    if threshold is None:
+        return value
+    if threshold.inclusive:
+        return min(value - threshold.start, threshold.end - value)
+    return max(threshold.start - value, value - threshold.end)
+
+
+class Offender(object):
+    def __init__(self, name, value, status):
+        self.name = name
+        self.value = value
+        self.status = status
+
+    def describe(self, func):
+        return "{0} ({1} is {2})".format(self.name, func, self.value)
+
+
+class WorstSeries(object):
+    """Keep the `top` worst series seen and count every status"""
+
+    def __init__(self, plugin, top=DEFAULT_TOP):
+        self.plugin = plugin
+        self.top = top
+        self.threshold = plugin.options.warning or plugin.options.critical
+        self.counts = dict((status, 0) for status in (OK, WARNING, CRITICAL))
+        self.empty = 0
+        self._heap = []
+        self._seq = itertools.count()
+
+    def add(self, name, value):
+        response = self.plugin.response_for_value(value)
+        self.counts[response.status] += 1
+        rank = (response.status.exit_code, badness(value, self.threshold))
+        entry = (rank, next(self._seq),
+                 Offender(name, value, response.status))
+        if len(self._heap) < self.top:
+            heapq.heappush(self._heap, entry)
+        elif entry > self._heap[0]:
+            heapq.heapreplace(self._heap, entry)
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+    def worst(self):
+        """The kept series, worst first"""
+
+        return [e[2] for e in sorted(self._heap, reverse=True)]
+
+
+def series_values(opts, session=None, raw_data=None):
+    """Yield (values, meta) for every series of the query"""
+
+    if raw_data is None and opts.stream and not (
+            opts.delta_dir or opts.cache_dir):
+        stream = graphite_stream(opts, session)
+        if stream is None:
+            return
+        try:
+            for values, meta in stream.per_series():
+                yield values, meta
+        finally:
+            stream.close()
+        return
+
+    if raw_data is None:
+        raw_data = fetch_series(opts, session)
+    for series in raw_data:
+        yield iter_values([series]), series
+
+
+def evaluate(plugin, func, series):
+    """Aggregate each of the (values, meta) `series` into a WorstSeries"""
+
+    accuracy = plugin.options.sketch_accuracy
+    worst = WorstSeries(plugin, plugin.options.top)
+    for values, meta in series:
+        try:
+            value = aggregate(values, [func], accuracy=accuracy)[func]
+        except EmptyQueryResult:
+            worst.empty += 1
+            continue
+        for _ in values:
+            pass
+        worst.add(meta.get("target", "<unnamed>"), value)
+    return worst
+
+
+def check(plugin, session=None):
+    """Per-series replacement for GraphiteNagios.check"""
+
+    opts = plugin.options
+    names = parse_functions(opts.func)
+    if len(names) != 1:
+        raise ValueError("--per-series takes a single algorithm")
+    func = names[0]
+    describe_sketches(opts, names)
+
+    worst = evaluate(plugin, func, series_values(
+        opts, session or plugin.session, plugin.raw_data))
+    if worst.empty:
+        verbose(opts, "{0} series without values skipped".format(worst.empty))
+    offenders = worst.worst()
+    if not offenders:
+        return Response(UNKNOWN, "No results returned!")
+
+    status = offenders[0].status
+    problems = [o for o in offenders if o.status != OK]
+    if problems:
+        counts = ", ".join(
+            "{0} {1}".format(worst.counts[s], s.name)
+            for s in (CRITICAL, WARNING) if worst.counts[s])
+        message = "{0}: {1} of {2} series: {3}".format(
+            opts.name, counts, worst.total,
+            ", ".join(o.describe(func) for o in problems))
+    else:
+        message = "{0}: {1} series OK, worst {2}".format(
+            opts.name, worst.total, offenders[0].describe(func))
+
+    response = Response(status, message)
+    response.set_perf_data(func, offenders[0].value)
+    response.set_perf_data("series", worst.total)
+    response.set_perf_data("warning", worst.counts[WARNING])
+    response.set_perf_data("critical", worst.counts[CRITICAL])
+    return response
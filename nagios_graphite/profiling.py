@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""Profile real checks with --profile-out and --memprofile-out
+
+``--profile-out PATH`` runs the check under cProfile and writes pstats data
+to PATH (``python -m pstats PATH`` to browse it). ``--memprofile-out PATH``
+writes the top allocation sites by line from tracemalloc. tracemalloc needs
+Python 3.4+ (or the pytracemalloc backport); without it the peak RSS and the
+live objects created by the check, by type, are written instead.
+
+``{pid}`` and ``{time}`` in either path are replaced by the process id and
+the start time, so many checks can write to the same directory. With
+``--profile-sample N`` only one in N invocations is profiled. Neither the
+output nor the exit code of the check change, and failing to write a profile
+is only reported on stderr.
+"""
+
+from __future__ import print_function
+
+import gc
+import os
+import sys
+import time
+import random
+import resource
+import collections
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+TOP_ALLOCATIONS = 25
+TRACEBACK_FRAMES = 10
+
+
+def output_path(template, pid, started):
+    return template.replace("{pid}", str(pid)).replace(
+        "{time}", str(int(started)))
+
+
+def sampled(every):
+    """True for one in `every` invocations on average"""
+
+    return every <= 1 or random.randrange(every) == 0
+
+
+def live_types():
+    return collections.Counter(type(o).__name__ for o in gc.get_objects())
+
+
+class MemoryProfile(object):
+    def __init__(self):
+        self.snapshot = None
+        self.peak = None
+        self.before = None
+        self.after = None
+
+    def start(self):
+        if tracemalloc is not None:
+            tracemalloc.start(TRACEBACK_FRAMES)
+        else:
+            self.before = live_types()
+
+    def stop(self):
+        if tracemalloc is not None:
+            self.snapshot = tracemalloc.take_snapshot()
+            self.peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        else:
+            self.after = live_types()
+            self.peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    def write(self, path):
+        with open(path, "w") as f:
+            if self.snapshot is not None:
+                print("peak traced memory: {0} bytes".format(self.peak),
+                      file=f)
+                print("top {0} allocations by line:".format(TOP_ALLOCATIONS),
+                      file=f)
+                for stat in self.snapshot.statistics("lineno")[
+                        :TOP_ALLOCATIONS]:
+                    print(stat, file=f)
+                return
+
+            print("tracemalloc is not available, showing object counts",
+                  file=f)
+            print("peak RSS: {0} KiB".format(self.peak), file=f)
+            print("live objects created by the check, by type:", file=f)
+            growth = self.after - self.before
+            for name, count in growth.most_common(TOP_ALLOCATIONS):
+                print("{0:>10} {1}".format(count, name), file=f)
+
+
+def profiled(fn, opts):
+    """Call `fn` under the profilers requested by `opts`, returns its result"""
+
+    started = time.time()
+    if not sampled(opts.profile_sample):
+        return fn()
+
+    profile = memory = None
+    if opts.profile_out:
+        import cProfile
+        profile = cProfile.Profile()
+    if opts.memprofile_out:
+        memory = MemoryProfile()
+        memory.start()
+
+    try:
+        if profile is not None:
+            return profile.runcall(fn)
+        return fn()
+    finally:
+        if memory is not None:
+            memory.stop()
+        pid = os.getpid()
+        try:
+            if profile is not None:
+                profile.dump_stats(
+                    output_path(opts.profile_out, pid, started))
+            if memory is not None:
+                memory.write(output_path(opts.memprofile_out, pid, started))
+        except (IOError, OSError) as e:
+            print("failed to write profile: {0}".format(e), file=sys.stderr)
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""Push aggregation down to graphite-web
+
+For sum, min, max and avg there is no need to download every datapoint of
+every series: Graphite can combine the series (``sumSeries``, ``minSeries``,
+``maxSeries``) and consolidate the result over the whole window
+(``consolidateBy`` with ``maxDataPoints=1``), returning a single point. avg
+is the sum of all non-null points divided by their count, and the count is
+``sumSeries(isNonNull(target))`` consolidated the same way.
+
+When the matched series have different steps, the ``*Series`` functions
+first normalize them to a common step using each series' own consolidation
+function, which defaults to average. Every input is therefore wrapped in
+``consolidateBy`` with the partial's own function, so coarsening a series
+sums (or takes the min/max of) its points instead of averaging them and
+the partials stay exact.
+
+Percentiles and null statistics cannot be computed from combined series,
+so any request involving them falls back to local aggregation. If the
+server ignores ``maxDataPoints`` the returned points are folded locally
+with the same function, which gives the same answer.
+"""
+
+import urllib
+import collections
+
+from nagios_graphite.main import (
+    FUNCTIONS, EmptyQueryResult, format_from, graphite_auth, iter_values,
+    verbose)
+
+PUSHDOWN_FUNCTIONS = ("sum", "min", "max", "avg")
+
+# partial aggregate -> (Graphite expression, function to fold its points)
+PARTIALS = {
+    "sum":   ('consolidateBy(sumSeries(consolidateBy({0},"sum")),"sum")',
+              FUNCTIONS["sum"]),
+    "min":   ('consolidateBy(minSeries(consolidateBy({0},"min")),"min")',
+              FUNCTIONS["min"]),
+    "max":   ('consolidateBy(maxSeries(consolidateBy({0},"max")),"max")',
+              FUNCTIONS["max"]),
+    "count": ('consolidateBy(sumSeries('
+              'consolidateBy(isNonNull({0}),"sum")),"sum")',
+              FUNCTIONS["sum"]),
+}
+
+NEEDS = {
+    "sum": ["sum"],
+    "min": ["min"],
+    "max": ["max"],
+    "avg": ["sum", "count"],
+}
+
+
+def can_push_down(names):
+    return all(name in PUSHDOWN_FUNCTIONS for name in names)
+
+
+def rewrite(target, names):
+    """Aliased Graphite targets computing the partials `names` need
+
+    Returns an OrderedDict of partial name to target expression.
+    """
+
+    partials = collections.OrderedDict()
+    for name in names:
+        for partial in NEEDS[name]:
+            expr = PARTIALS[partial][0].format(target)
+            partials[partial] = 'alias({0},"{1}")'.format(expr, partial)
+    return partials
+
+
+def pushdown_url(opts, targets):
+    qs = [("target", target) for target in targets]
+    qs.extend([
+        ("from", format_from(opts.from_)),
+        ("until", format_from(opts.until)),
+        ("maxDataPoints", "1"),
+        ("format", "json"),
+    ])
+    return "{0}?{1}".format(opts.hostname, urllib.urlencode(qs))
+
+
+def finish(name, partials):
+    if name == "avg":
+        count = partials["count"]
+        if not count:
+            raise EmptyQueryResult("Graphite query returned no results")
+        return partials["sum"] / count
+    return partials[name]
+
+
+def check_pushdown(opts, names, session):
+    """Aggregate `names` on the Graphite side
+
+    Returns an OrderedDict like `check_graphite_all`, or None if Graphite
+    returned no series.
+    """
+
+    targets = rewrite(opts.target, names)
+    for target in targets.values():
+        verbose(opts, "pushdown target: {0}".format(target))
+
+    resp = session.get(pushdown_url(opts, targets.values()),
+                       auth=graphite_auth(opts), timeout=opts.http_timeout)
+    data = resp.json() if resp.ok else []
+    if not data:
+        return None
+
+    by_alias = collections.defaultdict(list)
+    for series in data:
+        by_alias[series["target"]].append(series)
+    partials = dict(
+        (partial, PARTIALS[partial][1](iter_values(by_alias[partial])))
+        for partial in targets)
+    return collections.OrderedDict(
+        (name, finish(name, partials)) for name in names)
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""Linear-time order statistics
+
+Percentiles only need the value at a handful of ranks, so sorting the
+whole result set is wasted work. These functions find the k-th smallest
+values by repeatedly partitioning the data (quickselect), only descending
+into the partitions that still contain a requested rank. Like introselect,
+a segment that keeps partitioning badly is sorted instead, which bounds the
+worst case at O(n log n).
+"""
+
+import math
+
+# Segments at or below this size are simply sorted
+SMALL_SEGMENT = 16
+
+
+def _median_of_three(xs, lo, hi):
+    mid = (lo + hi) // 2
+    a, b, c = xs[lo], xs[mid], xs[hi]
+    if a < b:
+        if b < c:
+            return b
+        return c if a < c else a
+    if a < c:
+        return a
+    return c if b < c else b
+
+
+def _partition(xs, lo, hi, pivot):
+    """Three-way partition `xs[lo:hi+1]` in place around `pivot`
+
+    Returns ``(lt, gt)`` such that ``xs[lo:lt] < pivot``,
+    ``xs[lt:gt+1] == pivot`` and ``xs[gt+1:hi+1] > pivot``.
+    """
+
+    lt, i, gt = lo, lo, hi
+    while i <= gt:
+        x = xs[i]
+        if x < pivot:
+            xs[lt], xs[i] = x, xs[lt]
+            lt += 1
+            i += 1
+        elif x > pivot:
+            xs[gt], xs[i] = x, xs[gt]
+            gt -= 1
+        else:
+            i += 1
+    return lt, gt
+
+
+def _sort_segment(xs, lo, hi):
+    xs[lo:hi + 1] = sorted(xs[lo:hi + 1])
+
+
+def select_many(xs, ks):
+    """Find the values at ranks `ks` of `xs` in a single partitioning pass
+
+    `xs` is reordered in place. Returns a dict of rank to value; the value
+    at rank k is ``sorted(xs)[k]``.
+    """
+
+    size = len(xs)
+    ranks = sorted(set(ks))
+    for k in ranks:
+        if not 0 <= k < size:
+            raise IndexError("rank {0} out of range for {1} values".format(
+                k, size))
+    if not ranks:
+        return {}
+
+    depth_limit = 2 * int(math.log(size, 2) + 1)
+    stack = [(0, size - 1, ranks, 0)]
+    while stack:
+        lo, hi, wanted, depth = stack.pop()
+        if hi - lo < SMALL_SEGMENT or depth > depth_limit:
+            _sort_segment(xs, lo, hi)
+            continue
+
+        lt, gt = _partition(xs, lo, hi, _median_of_three(xs, lo, hi))
+        left = [k for k in wanted if k < lt]
+        right = [k for k in wanted if k > gt]
+        if left:
+            stack.append((lo, lt - 1, left, depth + 1))
+        if right:
+            stack.append((gt + 1, hi, right, depth + 1))
+
+    return dict((k, xs[k]) for k in ranks)
+
+
+def select(xs, k):
+    """Return ``sorted(xs)[k]``, reordering `xs` in place"""
+
+    return select_many(xs, [k])[k]
+
+
+def percentile_rank(size, n):
+    """Rank of the `n`th percentile (0 <= n < 1) in `size` sorted values"""
+
+    return int(size*n)
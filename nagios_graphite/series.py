@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""Compact in-memory representation of a Graphite series
+
+A series decoded from JSON is a dict holding a list of ``[value,
+timestamp]`` lists, well over 100 bytes per datapoint. Graphite's points are
+evenly spaced, so `CompactSeries` stores only ``start`` and ``step`` and
+keeps the values in an ``array('d')`` (8 bytes per point) with NaN for null.
+
+The raw, msgpack and pickle decoders build CompactSeries directly from
+graphite-web's series info. JSON responses keep their dicts: integer values
+would otherwise turn into floats and change the output of a check.
+
+Iterating a CompactSeries yields its values with None for null, so it can be
+passed to any of the FUNCTIONS. ``series["target"]`` and
+``series["datapoints"]`` work as for a dict, the latter building the pairs
+on demand.
+"""
+
+from array import array
+
+NAN = float("nan")
+
+
+class CompactSeries(object):
+    __slots__ = ("target", "start", "step", "values")
+
+    def __init__(self, target, start, step, values=()):
+        self.target = target
+        self.start = start
+        self.step = step
+        if not isinstance(values, array):
+            values = array("d", (NAN if v is None else v for v in values))
+        self.values = values
+
+    @classmethod
+    def from_info(cls, info):
+        """Build from graphite-web series info (pickle/msgpack format)"""
+
+        return cls(info["name"], info["start"], info["step"], info["values"])
+
+    @classmethod
+    def from_dict(cls, series):
+        """Build from a JSON series dict, its points must be evenly spaced"""
+
+        points = series["datapoints"]
+        start = points[0][1] if points else 0
+        step = points[1][1] - points[0][1] if len(points) > 1 else 1
+        for i, point in enumerate(points):
+            if point[1] != start + i * step:
+                raise ValueError("datapoints of {0!r} are not evenly "
+                                 "spaced".format(series["target"]))
+        return cls(series["target"], start, step, (p[0] for p in points))
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        for v in self.values:
+            yield None if v != v else v
+
+    def timestamps(self):
+        return xrange(self.start, self.start + len(self) * self.step,
+                      self.step)
+
+    @property
+    def datapoints(self):
+        return [[v, ts] for v, ts in zip(self, self.timestamps())]
+
+    def __getitem__(self, key):
+        if key == "target":
+            return self.target
+        if key == "datapoints":
+            return self.datapoints
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def as_dict(self):
+        return {"target": self.target, "datapoints": self.datapoints}
+
+    def __repr__(self):
+        return "CompactSeries({0!r}, {1}, {2}, <{3} points>)".format(
+            self.target, self.start, self.step, len(self))
+
+
+def point_count(series):
+    if isinstance(series, CompactSeries):
+        return len(series)
+    return len(series["datapoints"])
+
+
+def as_dicts(series):
+    """Render data with every CompactSeries converted to a dict"""
+
+    return [e.as_dict() if isinstance(e, CompactSeries) else e
+            for e in series]
+
+
+def jsonable(obj):
+    """`default` hook for json.dumps of render data"""
+
+    if isinstance(obj, CompactSeries):
+        return obj.as_dict()
+    raise TypeError("{0!r} is not JSON serializable".format(obj))
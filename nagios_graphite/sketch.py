@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""Mergeable quantile sketch with a relative error bound (DDSketch)
+
+Exact percentiles keep every value in memory. A `DDSketch` instead counts
+values in logarithmic bins: bin ``k`` holds the values in ``(gamma**(k-1),
+gamma**k]`` with ``gamma = (1 + a) / (1 - a)``, and a quantile is answered
+with the bin's midpoint, which is within the relative accuracy ``a`` of the
+exact value at the same rank. Memory grows with the logarithm of the range
+of values rather than with their number (about 1400 bins cover 1e-3 to 1e9
+at 1%), and two sketches with the same accuracy merge by adding their bins,
+so partial results can be combined without losing accuracy.
+
+See Masson et al., "DDSketch: A Fast and Fully-Mergeable Quantile Sketch
+with Relative-Error Guarantees", VLDB 2019.
+"""
+
+import math
+
+from nagios_graphite.selection import percentile_rank
+
+DEFAULT_ACCURACY = 0.01
+
+
+class DDSketch(object):
+    def __init__(self, relative_accuracy=DEFAULT_ACCURACY):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError("relative accuracy must be between 0 and 1, "
+                             "not {0!r}".format(relative_accuracy))
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        # Bins of positive values and of the magnitude of negative values
+        self.positive = {}
+        self.negative = {}
+        self.zeros = 0
+        self.count = 0
+        self.min = None
+        self.max = None
+
+    def key(self, x):
+        """Bin of the positive value `x`"""
+
+        return int(math.ceil(math.log(x) / self.log_gamma))
+
+    def value(self, key):
+        """Estimate for the values of bin `key`"""
+
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def add(self, x):
+        if x > 0:
+            k = self.key(x)
+            self.positive[k] = self.positive.get(k, 0) + 1
+        elif x < 0:
+            k = self.key(-x)
+            self.negative[k] = self.negative.get(k, 0) + 1
+        else:
+            self.zeros += 1
+        self.count += 1
+        if self.min is None or x < self.min:
+            self.min = x
+        if self.max is None or x > self.max:
+            self.max = x
+
+    def update(self, xs):
+        """Add every non-null value of `xs`"""
+
+        # add() inlined, with the lookups in locals
+        positive, negative = self.positive, self.negative
+        log, ceil, log_gamma = math.log, math.ceil, self.log_gamma
+        count, zeros, lo, hi = self.count, self.zeros, self.min, self.max
+        for x in xs:
+            if x is None:
+                continue
+            if x > 0:
+                k = int(ceil(log(x) / log_gamma))
+                positive[k] = positive.get(k, 0) + 1
+            elif x < 0:
+                k = int(ceil(log(-x) / log_gamma))
+                negative[k] = negative.get(k, 0) + 1
+            else:
+                zeros += 1
+            count += 1
+            if lo is None or x < lo:
+                lo = x
+            if hi is None or x > hi:
+                hi = x
+        self.count, self.zeros, self.min, self.max = count, zeros, lo, hi
+        return self
+
+    def merge(self, other):
+        """Add the counts of `other`, a sketch with the same accuracy"""
+
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("cannot merge sketches of accuracy {0} and "
+                             "{1}".format(self.relative_accuracy,
+                                          other.relative_accuracy))
+        if not other.count:
+            return self
+        for mine, theirs in [(self.positive, other.positive),
+                             (self.negative, other.negative)]:
+            for k, n in theirs.iteritems():
+                mine[k] = mine.get(k, 0) + n
+        self.zeros += other.zeros
+        self.count += other.count
+        if self.min is None or other.min < self.min:
+            self.min = other.min
+        if self.max is None or other.max > self.max:
+            self.max = other.max
+        return self
+
+    def _bins(self):
+        """(estimate, count) of every bin, smallest values first"""
+
+        for k in sorted(self.negative, reverse=True):
+            yield -self.value(k), self.negative[k]
+        if self.zeros:
+            yield 0.0, self.zeros
+        for k in sorted(self.positive):
+            yield self.value(k), self.positive[k]
+
+    def quantile(self, n):
+        """Estimate the `n`th percentile (0 <= n < 1), as `percentile` does"""
+
+        if not self.count:
+            raise ValueError("quantile of an empty sketch")
+        rank = percentile_rank(self.count, n)
+        seen = 0
+        for estimate, count in self._bins():
+            seen += count
+            if seen > rank:
+                # The exact value lies within [min, max], so clamping only
+                # brings the estimate closer
+                return float(min(max(estimate, self.min), self.max))
+        return float(self.max)
+
+    @property
+    def bins(self):
+        return len(self.positive) + len(self.negative) + bool(self.zeros)
+
+    def to_dict(self):
+        """JSON-serializable state, see `from_dict`"""
+
+        return {
+            "accuracy": self.relative_accuracy,
+            "positive": sorted(self.positive.items()),
+            "negative": sorted(self.negative.items()),
+            "zeros": self.zeros,
+            "count": self.count,
+            "min": self.min,
+            "max": self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, state):
+        sketch = cls(state["accuracy"])
+        sketch.positive = dict((int(k), n) for k, n in state["positive"])
+        sketch.negative = dict((int(k), n) for k, n in state["negative"])
+        sketch.zeros = state["zeros"]
+        sketch.count = state["count"]
+        sketch.min = state["min"]
+        sketch.max = state["max"]
+        return sketch
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""Incremental parsing of Graphite render responses
+
+Graphite's JSON render format is a list of series objects::
+
+    [{"target": "foo", "datapoints": [[1.0, 1420070400], ...]}, ...]
+
+`iter_events` parses that document from an iterable of byte chunks (such as
+``response.iter_content()``) and yields one event at a time, so values can be
+aggregated while the body is still downloading and no ``[value, timestamp]``
+pairs are ever materialised:
+
+- ``(SERIES_START, None)`` when a series object begins
+- ``(VALUE, value, timestamp)`` for every datapoint, value is None for null
+- ``(SERIES_END, meta)`` when a series object ends, `meta` holds every other
+  key of the object (``target``, ``tags``, ...)
+"""
+
+import re
+import json
+import codecs
+
+SERIES_START = "start"
+VALUE = "value"
+SERIES_END = "end"
+
+CHUNK_SIZE = 64 * 1024
+
+_WS = re.compile(r"\s*")
+_NUMBER = r"(null|-?(?:\d+)(?:\.\d+)?(?:[eE][-+]?\d+)?|NaN|-?Infinity)"
+_PAIR = re.compile(
+    r"\s*,?\s*\[\s*" + _NUMBER + r"\s*,\s*" + _NUMBER + r"\s*\]")
+_DECODER = json.JSONDecoder()
+
+
+def parse_number(token):
+    """Convert a JSON number token the way `json.loads` would"""
+
+    if token == "null":
+        return None
+    if token in ("NaN", "Infinity", "-Infinity"):
+        return float(token)
+    if "." in token or "e" in token or "E" in token:
+        return float(token)
+    return int(token)
+
+
+class _Scanner(object):
+    """Buffered cursor over a stream of text chunks"""
+
+    def __init__(self, chunks):
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        self._chunks = (decoder.decode(chunk) for chunk in chunks)
+        self.buf = u""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """Read another chunk into the buffer, dropping consumed text"""
+
+        for chunk in self._chunks:
+            if chunk:
+                self.buf = self.buf[self.pos:] + chunk
+                self.pos = 0
+                return
+        if self.eof:
+            raise ValueError("Unexpected end of Graphite response")
+        self.eof = True
+
+    def peek(self):
+        """Skip whitespace and return the next character"""
+
+        while True:
+            self.pos = _WS.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            self.fill()
+
+    def expect(self, chars):
+        c = self.peek()
+        if c not in chars:
+            raise ValueError("Unexpected {0!r} at offset {1} of Graphite "
+                             "response".format(c, self.pos))
+        self.pos += 1
+        return c
+
+    def decode(self):
+        """Decode one complete JSON value"""
+
+        self.peek()
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self.buf, self.pos)
+            except ValueError:
+                if self.eof:
+                    raise
+                self.fill()
+                continue
+            # A number at the very end of the buffer may be truncated
+            if end == len(self.buf) and not self.eof:
+                self.fill()
+                continue
+            self.pos = end
+            return value
+
+    def pairs(self):
+        """Yield (value, timestamp) for every pair in a datapoints list"""
+
+        while True:
+            m = _PAIR.match(self.buf, self.pos)
+            if m is None:
+                buf = self.buf
+                if self.peek() == "]":
+                    self.pos += 1
+                    return
+                if self.buf is not buf:
+                    # peek() read another chunk, the pair may be complete
+                    continue
+                if "]" in self.buf[self.pos:self.pos + 128] or self.eof:
+                    raise ValueError("Malformed datapoint at offset {0} of "
+                                     "Graphite response".format(self.pos))
+                self.fill()
+                continue
+            self.pos = m.end()
+            yield parse_number(m.group(1)), parse_number(m.group(2))
+
+
+def _iter_series(scanner):
+    meta = {}
+    yield SERIES_START, None
+    while True:
+        c = scanner.expect('}",')
+        if c == "}":
+            break
+        if c == ",":
+            continue
+
+        scanner.pos -= 1
+        key = scanner.decode()
+        scanner.expect(":")
+        if key == "datapoints":
+            scanner.expect("[")
+            for value, timestamp in scanner.pairs():
+                yield VALUE, value, timestamp
+        else:
+            meta[key] = scanner.decode()
+    yield SERIES_END, meta
+
+
+def iter_events(chunks):
+    """Incrementally parse a Graphite JSON render response into events"""
+
+    scanner = _Scanner(chunks)
+    scanner.expect("[")
+    while True:
+        c = scanner.expect("{],")
+        if c == "]":
+            return
+        if c == "{":
+            for event in _iter_series(scanner):
+                yield event
+
+
+class RenderStream(object):
+    """Values of a streamed render response, with counters
+
+    `series` and `points` are updated as `values()` is consumed.
+    """
+
+    def __init__(self, events, resp=None):
+        self._events = events
+        self._resp = resp
+        self.series = 0
+        self.points = 0
+
+    @classmethod
+    def from_response(cls, resp, chunk_size=CHUNK_SIZE):
+        return cls(iter_events(resp.iter_content(chunk_size)), resp)
+
+    def close(self):
+        if self._resp is not None:
+            self._resp.close()
+
+    def values(self):
+        for event in self._events:
+            if event[0] == VALUE:
+                self.points += 1
+                yield event[1]
+            elif event[0] == SERIES_START:
+                self.series += 1
+
+    def per_series(self):
+        """Yield a (values, meta) pair for every series
+
+        `meta` is only complete once `values` is exhausted. Values left
+        unread are skipped when the next series is requested.
+        """
+
+        events = iter(self._events)
+        for event in events:
+            if event[0] != SERIES_START:
+                continue
+            self.series += 1
+            meta = {}
+            values = self._series_values(events, meta)
+            yield values, meta
+            for _ in values:
+                pass
+
+    def _series_values(self, events, meta):
+        for event in events:
+            if event[0] == VALUE:
+                self.points += 1
+                yield event[1]
+            elif event[0] == SERIES_END:
+                meta.update(event[1])
+                return
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""Per-phase timings of a check, reported as perf data with --timings
+
+A check is split into three phases:
+
+- ``fetch_ms``: time spent inside the HTTP client, waiting for and reading
+  the render response (DNS, connect, TLS, time to first byte and download)
+- ``parse_ms``: everything between the request and aggregation, mostly
+  decoding the response. With ``--stream`` values are parsed and
+  aggregated as they arrive, so ``parse_ms`` includes aggregation and
+  ``agg_ms`` is not reported.
+- ``agg_ms``: computing the aggregates
+
+along with the ``bytes`` read and the ``series`` and ``points`` aggregated.
+Python 2 has no monotonic clock in the standard library, so `time.time` is
+used there.
+"""
+
+import time
+import collections
+
+from nagios_graphite.series import point_count
+
+clock = getattr(time, "monotonic", time.time)
+
+
+class TimedResponse(object):
+    """Proxy for a response that counts time and bytes spent reading it"""
+
+    def __init__(self, resp, timings):
+        self._resp = resp
+        self._timings = timings
+        self._counted = False
+
+    def __getattr__(self, name):
+        return getattr(self._resp, name)
+
+    @property
+    def content(self):
+        start = clock()
+        content = self._resp.content
+        self._timings.fetch += clock() - start
+        if not self._counted:
+            self._counted = True
+            self._timings.bytes += len(content)
+        return content
+
+    def json(self):
+        self.content
+        return self._resp.json()
+
+    def iter_content(self, *args, **kwargs):
+        chunks = iter(self._resp.iter_content(*args, **kwargs))
+        while True:
+            start = clock()
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                return
+            finally:
+                self._timings.fetch += clock() - start
+            self._timings.bytes += len(chunk)
+            yield chunk
+
+
+class TimedSession(object):
+    """Session proxy whose responses record into `timings`"""
+
+    def __init__(self, session, timings):
+        self._session = session
+        self._timings = timings
+
+    def __getattr__(self, name):
+        return getattr(self._session, name)
+
+    def get(self, *args, **kwargs):
+        start = clock()
+        try:
+            resp = self._session.get(*args, **kwargs)
+        finally:
+            self._timings.fetch += clock() - start
+        return TimedResponse(resp, self._timings)
+
+
+class Timings(object):
+    """Phase durations of one check"""
+
+    def __init__(self):
+        self.started = None
+        self.aggregating = None
+        self.finished = None
+        self.fetch = 0.0
+        self.bytes = 0
+        self.series = None
+        self.points = None
+
+    def wrap(self, session):
+        return TimedSession(session, self)
+
+    def start(self):
+        self.started = clock()
+
+    def count(self, series, points):
+        self.series, self.points = series, points
+
+    def start_aggregation(self, series=None):
+        """Mark the start of aggregation over Graphite `series` data"""
+
+        self.aggregating = clock()
+        if series is not None:
+            self.count(len(series), sum(point_count(e) for e in series))
+
+    def finish(self):
+        self.finished = clock()
+
+    def perf_data(self):
+        """(label, value) pairs of everything that was measured"""
+
+        finished = self.finished if self.finished is not None else clock()
+        parsed = self.aggregating or finished
+        fields = collections.OrderedDict()
+        fields["fetch_ms"] = self.fetch
+        fields["parse_ms"] = max(parsed - self.started - self.fetch, 0.0)
+        if self.aggregating is not None:
+            fields["agg_ms"] = finished - self.aggregating
+        for label in fields:
+            fields[label] = round(fields[label] * 1000, 3)
+        fields["bytes"] = self.bytes
+        if self.series is not None:
+            fields["series"] = self.series
+            fields["points"] = self.points
+        return fields.items()
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""Standard library HTTP transport
+
+Importing `requests` (and urllib3, chardet, idna, ...) is a noticeable part
+of the start-up time of a check. The render request is a plain GET with at
+most HTTP Basic Auth, so `UrllibSession` implements just enough of the
+``requests.Session`` interface on top of `urllib2` for `graphite_fetch`,
+`graphite_stream` and friends to use it unchanged.
+"""
+
+import json
+import base64
+import urllib2
+
+
+class UrllibResponse(object):
+    """The subset of ``requests.Response`` used by nagios_graphite"""
+
+    def __init__(self, fp, status_code):
+        self._fp = fp
+        self._content = None
+        self.status_code = status_code
+        self.headers = fp.info()
+
+    @property
+    def ok(self):
+        return 200 <= self.status_code < 400
+
+    @property
+    def content(self):
+        if self._content is None:
+            self._content = self._fp.read() if self._fp is not None else b""
+            self.close()
+        return self._content
+
+    def json(self):
+        return json.loads(self.content)
+
+    def iter_content(self, chunk_size=1):
+        if self._content is not None:
+            yield self._content
+            return
+        while self._fp is not None:
+            chunk = self._fp.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+        self.close()
+
+    def close(self):
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+
+
+def basic_auth_header(auth):
+    token = base64.b64encode("{0}:{1}".format(*auth).encode("utf-8"))
+    return "Basic " + token.decode("ascii")
+
+
+class UrllibSession(object):
+    """Minimal ``requests.Session`` stand-in built on urllib2"""
+
+    def __init__(self):
+        self.auth = None
+
+    def get(self, url, auth=None, timeout=None, stream=False):
+        request = urllib2.Request(url)
+        auth = auth or self.auth
+        if auth:
+            request.add_header("Authorization", basic_auth_header(auth))
+        try:
+            fp = urllib2.urlopen(request, timeout=timeout)
+        except urllib2.HTTPError as e:
+            return UrllibResponse(e, e.code)
+        response = UrllibResponse(fp, fp.getcode())
+        if not stream:
+            response.content
+        return response
+
+    def close(self):
+        pass
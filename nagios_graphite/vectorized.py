@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""Vectorized aggregation backend built on NumPy
+
+NumPy is optional and only imported by `available()`, the first time a
+check asks for this backend. When it is importable, Graphite values are
+loaded into a float64 array with NaN standing in for null and every
+FUNCTIONS entry is computed with vectorized operations. Results match the
+pure-Python implementation exactly: sums are accumulated sequentially like
+`sum()`, integer-only inputs produce integer results (including the floor
+division in `avg`), and min, max and the percentiles return the selected
+value as it was loaded.
+
+float64 only holds integers exactly up to 2**53, so `main` aggregates
+inputs made of whole numbers only with the pure-Python implementation.
+"""
+
+import functools
+import collections
+
+from nagios_graphite.main import EmptyQueryResult, PERCENTILES, SKETCHES
+from nagios_graphite.selection import percentile_rank
+from nagios_graphite.series import CompactSeries
+from nagios_graphite.sketch import DDSketch, DEFAULT_ACCURACY
+
+# Set by available()
+np = None
+_missing = False
+
+
+def available():
+    """True if NumPy can be imported, importing it on the first call"""
+
+    global np, _missing
+    if np is None and not _missing:
+        try:
+            import numpy
+        except ImportError:
+            _missing = True
+        else:
+            np = numpy
+    return np is not None
+
+
+def _has_float(values):
+    return any(isinstance(x, float) for x in values)
+
+
+class Values(object):
+    """Graphite values as a float64 array with NaN for null
+
+    `source` maps an index of `array` back to the value it was loaded from,
+    so a selected value can be returned with its original type.
+    """
+
+    def __init__(self, array, integral=False, source=None):
+        self.array = array
+        self.integral = integral
+        self.source = source
+        self._present = None
+        self._present_index = None
+        self._ranks = {}
+        self._sketches = {}
+
+    @classmethod
+    def from_values(cls, values):
+        values = list(values)
+        return cls(np.array(values, dtype=np.float64),
+                   integral=not _has_float(values), source=values.__getitem__)
+
+    @classmethod
+    def from_series(cls, series):
+        """Load the values of Graphite series without a Python-level loop"""
+
+        dicts = [e for e in series if not isinstance(e, CompactSeries)]
+        arrays = [
+            np.frombuffer(e.values, dtype=np.float64)
+            if isinstance(e, CompactSeries) else
+            np.array(e["datapoints"], dtype=np.float64).reshape(-1, 2)[:, 0]
+            for e in series]
+        array = np.concatenate(arrays) if arrays else np.empty(0)
+        # CompactSeries hold floats, so only dicts can be all integers
+        integral = len(dicts) == len(series) and not _has_float(
+            p[0] for e in dicts for p in e["datapoints"])
+        offsets = np.cumsum([0] + [len(a) for a in arrays])
+
+        def source(i):
+            n = np.searchsorted(offsets, i, side="right") - 1
+            e = series[n]
+            if isinstance(e, CompactSeries):
+                return e.values[i - offsets[n]]
+            return e["datapoints"][i - offsets[n]][0]
+
+        return cls(array, integral=integral, source=source)
+
+    @property
+    def count(self):
+        return len(self.array)
+
+    @property
+    def nulls(self):
+        return self.count - len(self.present)
+
+    @property
+    def present(self):
+        """Array of the non-null values"""
+
+        if self._present is None:
+            self._present = self.array[~np.isnan(self.array)]
+        return self._present
+
+    def scalar(self, x):
+        """Convert a NumPy scalar to the type the Python path would return"""
+
+        return int(x) if self.integral else float(x)
+
+    def element(self, k):
+        """The `k`th non-null value, exactly as it was loaded"""
+
+        if self.source is None:
+            return self.scalar(self.present[k])
+        if self._present_index is None:
+            self._present_index = np.flatnonzero(~np.isnan(self.array))
+        return self.source(self._present_index[k])
+
+    def select_percentiles(self, ns):
+        """Select the ranks for every percentile in `ns` in one partition"""
+
+        size = len(self.present)
+        ranks = sorted(set(
+            k for k in (percentile_rank(size, n) for n in ns) if k < size))
+        if ranks:
+            index = np.argpartition(self.present, ranks)
+            self._ranks.update((k, index[k]) for k in ranks)
+
+    def percentile(self, n):
+        k = percentile_rank(len(self.present), n)
+        if k not in self._ranks:
+            self._ranks[k] = np.argpartition(self.present, k)[k]
+        return self.element(self._ranks[k])
+
+    def sketch(self, accuracy=DEFAULT_ACCURACY):
+        """DDSketch of the non-null values, binned without a Python loop"""
+
+        if accuracy not in self._sketches:
+            sketch = DDSketch(accuracy)
+            present = self.present
+            for bins, xs in [(sketch.positive, present[present > 0]),
+                             (sketch.negative, -present[present < 0])]:
+                keys, counts = np.unique(
+                    np.ceil(np.log(xs) / sketch.log_gamma).astype(np.int64),
+                    return_counts=True)
+                bins.update(zip(keys.tolist(), counts.tolist()))
+            sketch.zeros = int(np.count_nonzero(present == 0))
+            sketch.count = len(present)
+            if len(present):
+                sketch.min = self.element(np.argmin(present))
+                sketch.max = self.element(np.argmax(present))
+            self._sketches[accuracy] = sketch
+        return self._sketches[accuracy]
+
+
+def values_only(statfn):
+    """Raise EmptyQueryResult unless `values` has a non-null value"""
+
+    @functools.wraps(statfn)
+    def wrapper(values):
+        if not len(values.present):
+            raise EmptyQueryResult("Graphite query returned no results")
+        return statfn(values)
+    return wrapper
+
+
+def raise_on_empty(statfn):
+    """Raise EmptyQueryResult unless `values` has any value at all"""
+
+    @functools.wraps(statfn)
+    def wrapper(values):
+        if not values.count:
+            raise EmptyQueryResult("Graphite query returned no results")
+        return statfn(values)
+    return wrapper
+
+
+def total(values):
+    # cumsum adds left to right like sum(); np.sum uses pairwise summation,
+    # which would round differently.
+    return np.cumsum(values.present)[-1]
+
+
+def vsum(values):
+    return values.scalar(total(values))
+
+
+def vavg(values):
+    size = len(values.present)
+    if values.integral:
+        return int(total(values)) // size
+    return float(total(values)) / size
+
+
+def nullpct(values):
+    return float(values.nulls) / float(values.count)
+
+
+def percentile(n):
+    return lambda values: values.percentile(n)
+
+
+def approximate_percentile(n, accuracy=DEFAULT_ACCURACY):
+    return lambda values: values.sketch(accuracy).quantile(n)
+
+
+FUNCTIONS = {
+    "sum":    values_only(vsum),
+    "min":    values_only(lambda v: v.element(np.argmin(v.present))),
+    "max":    values_only(lambda v: v.element(np.argmax(v.present))),
+    "avg":    values_only(vavg),
+    "median": values_only(percentile(PERCENTILES["median"])),
+    "95th":   values_only(percentile(PERCENTILES["95th"])),
+    "99th":   values_only(percentile(PERCENTILES["99th"])),
+    "999th":  values_only(percentile(PERCENTILES["999th"])),
+    "median~": values_only(approximate_percentile(SKETCHES["median~"])),
+    "95th~":  values_only(approximate_percentile(SKETCHES["95th~"])),
+    "99th~":  values_only(approximate_percentile(SKETCHES["99th~"])),
+    "999th~": values_only(approximate_percentile(SKETCHES["999th~"])),
+    "nullcnt": raise_on_empty(lambda v: v.nulls),
+    "nullpct": raise_on_empty(nullpct),
+}
+
+
+def function_for(name, accuracy=DEFAULT_ACCURACY):
+    if name in SKETCHES:
+        return values_only(approximate_percentile(SKETCHES[name], accuracy))
+    return FUNCTIONS[name]
+
+
+def aggregate(values, names, accuracy=DEFAULT_ACCURACY):
+    """Compute every aggregate in `names` over a `Values` array"""
+
+    ns = [PERCENTILES[name] for name in names if name in PERCENTILES]
+    if ns:
+        values.select_percentiles(ns)
+    return collections.OrderedDict(
+        (name, function_for(name, accuracy)(values)) for name in names)
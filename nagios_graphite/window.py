@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""Incremental fetching of long windows
+
+A check over ``-F 24hours`` that runs every minute downloads a whole day of
+datapoints each time although only the last minute is new. With
+``--delta-dir`` the series of the previous run are kept on disk and only the
+points since the last fetched timestamp (minus ``--delta-overlap`` seconds,
+to pick up late-arriving points) are requested. They are merged into the
+stored window and points that fell out of the window are evicted.
+
+A full fetch is done instead when there is no stored window, when it is
+older than ``--delta-refresh`` seconds (to pick up backfilled data), when
+the delta comes back at a different resolution, or when the window is not a
+relative offset ending now. Targets that apply Graphite functions are always
+fetched in full: functions such as ``nonNegativeDerivative``,
+``movingAverage`` or ``summarize`` give different values over a short range,
+which would overwrite the stored points.
+"""
+
+import re
+import os
+import copy
+import json
+import time
+import hashlib
+
+from nagios_graphite.main import graphite_fetch, verbose
+from nagios_graphite.cache import atomic_write, locked
+from nagios_graphite.series import as_dicts
+
+DEFAULT_OVERLAP = 120
+DEFAULT_REFRESH = 3600
+
+UNITS = [
+    ("s", 1),
+    ("min", 60),
+    ("h", 3600),
+    ("d", 86400),
+    ("w", 7 * 86400),
+    ("mon", 30 * 86400),
+    ("y", 365 * 86400),
+]
+
+_OFFSET = re.compile(r"^-?(\d+)\s*([a-z]+)$")
+
+
+def parse_offset(offset):
+    """Length in seconds of a Graphite relative offset such as "24hours"
+
+    Returns None for anything that is not a single relative offset.
+    """
+
+    m = _OFFSET.match(offset.strip().lower())
+    if m is None:
+        return None
+    count, unit = int(m.group(1)), m.group(2)
+    # Graphite matches units by prefix, longest first ("mon" before "m")
+    for prefix, seconds in sorted(UNITS, key=lambda u: -len(u[0])):
+        if unit.startswith(prefix):
+            return count * seconds
+    return None
+
+
+def series_step(series):
+    """Seconds between datapoints, or None if it cannot be told"""
+
+    for e in series:
+        points = e["datapoints"]
+        if len(points) > 1:
+            return points[1][1] - points[0][1]
+    return None
+
+
+def plain_target(target):
+    """True if `target` is a path or wildcard, without Graphite functions"""
+
+    return "(" not in target
+
+
+def last_timestamp(series):
+    return max([e["datapoints"][-1][1] for e in series if e["datapoints"]]
+               or [None])
+
+
+def merge(stored, delta):
+    """Overlay `delta` onto `stored`, keeping only series present in delta"""
+
+    previous = dict((e["target"], e) for e in stored)
+    merged = []
+    for e in delta:
+        points = dict((ts, v) for v, ts in
+                      previous.get(e["target"], {}).get("datapoints", []))
+        points.update((ts, v) for v, ts in e["datapoints"])
+        series = dict(e)
+        series["datapoints"] = [[points[ts], ts] for ts in sorted(points)]
+        merged.append(series)
+    return merged
+
+
+def evict(series, oldest):
+    """Drop every datapoint at or before `oldest`"""
+
+    for e in series:
+        e["datapoints"] = [p for p in e["datapoints"] if p[1] > oldest]
+    return series
+
+
+class SlidingWindow(object):
+    """Directory of stored render windows, one file per target"""
+
+    def __init__(self, directory, overlap=DEFAULT_OVERLAP,
+                 refresh=DEFAULT_REFRESH):
+        self.directory = directory
+        self.overlap = overlap
+        self.refresh = refresh
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def path(self, opts):
+        identity = json.dumps([opts.hostname, opts.target, opts.from_,
+                               opts.username, opts.password])
+        name = hashlib.sha1(identity.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, name + ".json")
+
+    def load(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def delta(self, opts, state, session=None):
+        """Fetch the points after `state`, returns None if unusable"""
+
+        delta_opts = copy.copy(opts)
+        delta_opts.from_ = str(int(state["last"] - self.overlap))
+        delta = as_dicts(graphite_fetch(delta_opts, session))
+        step = series_step(delta)
+        if not delta or (step is not None and step != state["step"]):
+            return None
+        verbose(opts, "delta fetch from {0}: {1} points".format(
+            delta_opts.from_, sum(len(e["datapoints"]) for e in delta)))
+        return merge(state["series"], delta)
+
+    def fetch(self, opts, session=None, now=None):
+        """Return the series for `opts`, fetching as little as possible"""
+
+        window = parse_offset(opts.from_)
+        if window is None or opts.until not in ("", "now"):
+            return graphite_fetch(opts, session)
+        if not plain_target(opts.target):
+            verbose(opts, "--delta-dir needs a plain path or wildcard, "
+                          "fetching the whole window")
+            return graphite_fetch(opts, session)
+
+        now = time.time() if now is None else now
+        path = self.path(opts)
+        with locked(path + ".lock"):
+            state = self.load(path)
+            series = None
+            if state is not None and now - state["full"] <= self.refresh:
+                series = self.delta(opts, state, session)
+            if series is None:
+                series = as_dicts(graphite_fetch(opts, session))
+                state = {"full": now}
+                verbose(opts, "full fetch of {0}: {1} points".format(
+                    opts.from_, sum(len(e["datapoints"]) for e in series)))
+                if not series:
+                    return series
+
+            series = evict(series, now - window)
+            state.update(series=series, step=series_step(series),
+                         last=last_timestamp(series) or now)
+            atomic_write(path, json.dumps(state))
+            return series
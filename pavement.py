@@ -14,7 +14,7 @@ from setup import (
     print_failure_message, _lint, _test, _test_all,
     CODE_DIRECTORY, DOCS_DIRECTORY, TESTS_DIRECTORY, PYTEST_FLAGS)
 
-from paver.easy import options, task, needs, consume_args
+from paver.easy import options, task, needs, consume_args, cmdopts
 from paver.setuputils import install_distutils_tasks
 
 options(setup=setup_dict)
@@ -64,6 +64,12 @@ class cwd(object):
 
 ## Task-related functions
 
+BENCHMARKS_DIRECTORY = 'benchmarks'
+BENCHMARK_BASELINE = 'baseline'
+# Allowed slowdown of the median of any case relative to the baseline
+BENCHMARK_THRESHOLD = '10%'
+
+
 def _doc_make(*make_args):
     """Run make in sphinx' docs directory.
 
@@ -84,6 +90,26 @@ def _doc_make(*make_args):
     return retcode
 
 
+def _bench(*pytest_args):
+    """Run the pytest-benchmark suite.
+
+    :return: exit code
+    """
+    try:
+        import pytest_benchmark  # NOQA
+    except ImportError:
+        print_failure_message(
+            'Install the pytest benchmark plugin to use this task, '
+            "i.e., `pip install pytest-benchmark'.")
+        return 1
+    import pytest
+    return pytest.main([
+        '--benchmark-only',
+        '--benchmark-group-by=func',
+        '--benchmark-sort=name',
+        BENCHMARKS_DIRECTORY] + list(pytest_args))
+
+
 ## Tasks
 
 @task
@@ -159,6 +185,26 @@ def coverage():
         TESTS_DIRECTORY])
 
 
+@task
+def bench_baseline():
+    """Run the benchmarks and save the results as the new baseline."""
+    raise SystemExit(_bench('--benchmark-save=' + BENCHMARK_BASELINE))
+
+
+@task
+@cmdopts([
+    ('threshold=', 't',
+     'Allowed slowdown relative to the baseline (default: {0})'.format(
+         BENCHMARK_THRESHOLD)),
+])
+def bench(options):
+    """Run the benchmarks and fail if any case regressed past the baseline."""
+    threshold = options.bench.get('threshold', BENCHMARK_THRESHOLD)
+    raise SystemExit(_bench(
+        '--benchmark-compare',
+        '--benchmark-compare-fail=median:' + threshold))
+
+
 @task  # NOQA
 def doc_watch():
     """Watch for changes in the docs and rebuild HTML docs when changed."""
@@ -269,7 +269,9 @@ setup_dict = dict(
     zip_safe=False,  # don't use eggs
     entry_points={
         'console_scripts': [
-            'nagios_graphite = nagios_graphite.main:entry_point'
+            'nagios_graphite = nagios_graphite.main:entry_point',
+            'nagios_graphite_batch = nagios_graphite.batch:entry_point',
+            'nagios_graphite_client = nagios_graphite.client:entry_point',
         ],
         # if you have a gui, use this
         # 'gui_scripts': [
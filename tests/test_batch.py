@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+import re
+import json
+
+import pytest
+import responses
+parametrize = pytest.mark.parametrize
+
+from nagios_graphite import batch
+
+series = [{"target": "foo", "datapoints": [[1.0, 10], [3.0, 11]]}]
+
+
+def test_parse_checks():
+    lines = [
+        "# comment\n",
+        "\n",
+        "-M 'foo.*' -N foo\n",
+        "  -M bar -A max  \n",
+    ]
+    assert list(batch.parse_checks(lines)) == [
+        (3, ["-M", "foo.*", "-N", "foo"]),
+        (4, ["-M", "bar", "-A", "max"]),
+    ]
+
+
+@responses.activate
+def test_unbalanced_quote_is_unknown(tmpdir, capsys):
+    url_re = re.compile("^{}.*$".format(re.escape("http://example.com")))
+    responses.add(responses.GET, url_re, body=json.dumps(series), status=200,
+                  content_type='application/json')
+    path = tmpdir.join("checks")
+    path.write("# checks\n"
+               "-H http://example.com -M 'foo -N a -P secret\n"
+               "-H http://example.com -M foo -N b\n"
+               "-H http://example.com -M foo -P secret --http-timeout soon\n")
+
+    checks = list(batch.parse_checks(path.readlines()))
+    assert checks[0] == (2, None)
+
+    batch.main(["nagios_graphite_batch", str(path)])
+    out = capsys.readouterr()[0]
+    assert out.splitlines() == [
+        "line 2\t3\tUNKNOWN: Invalid check definition on line 2",
+        out.splitlines()[1],
+        "line 4\t3\tUNKNOWN: Invalid check definition on line 4",
+    ]
+    assert out.splitlines()[1].startswith("b\t0\tOK")
+    assert "secret" not in out
+
+
+def test_batch_session_pool_size():
+    session = batch.batch_session(25)
+    adapter = session.get_adapter("http://example.com")
+    assert adapter._pool_maxsize == 25
+
+
+def test_run_check_invalid_definition():
+    name, response = batch.run_check(["--http-timeout", "soon"])
+    assert name is None
+    assert response.status.name == "UNKNOWN"
+
+
+@responses.activate
+def test_run_checks_shared_session():
+    url_re = re.compile("^{}.*$".format(re.escape("http://example.com")))
+    responses.add(responses.GET, url_re, body=json.dumps(series), status=200,
+                  content_type='application/json')
+
+    checks = [
+        ["-H", "http://example.com", "-M", "foo", "-N", "a", "-c", "1"],
+        ["-H", "http://example.com", "-M", "foo", "-N", "b", "-A", "max",
+         "-U", "user", "-P", "secret"],
+        ["-H", "http://example.com", "-M", "foo", "-N", "c", "-A", "bogus"],
+    ]
+    session = batch.batch_session(2)
+    results = list(batch.run_checks(checks, session))
+
+    assert [name for name, _ in results] == ["a", "b", "c"]
+    assert [r.status.name for _, r in results] == ["CRIT", "OK", "UNKNOWN"]
+    assert len(responses.calls) == 2
+    assert "Authorization" not in responses.calls[0].request.headers
+    assert "Authorization" in responses.calls[1].request.headers
+    assert session.auth is None
+
+
+@parametrize("args, expected", [
+    ("-M foo", True),
+    ("-M foo --cache-dir /tmp/x", False),
+    ("-M foo --pushdown", False),
+    ("-M foo -A max --max-datapoints 100", False),
+    ("-M foo -F 7days -A 99th~ --sketch-dir /tmp/x", False),
+    ("-M foo -H http://a,http://b", False),
+])
+def test_prefetchable(args, expected):
+    plugin = batch.load_check(args.split())
+    assert batch.prefetchable(plugin) == expected
+
+
+def test_format_tsv():
+    name, response = batch.run_check(["--http-timeout", "soon"])
+    [line] = batch.format_tsv([("x", response)])
+    assert line.split("\t")[:2] == ["x", "3"]
+
+
+def test_format_json():
+    name, response = batch.run_check(["--http-timeout", "soon"])
+    [doc] = batch.format_json([("x", response)])
+    [result] = json.loads(doc)
+    assert result["name"] == "x"
+    assert result["exit_code"] == 3
+    assert result["output"].startswith("UNKNOWN")
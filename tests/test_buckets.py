@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+
+import re
+import json
+import shlex
+import urlparse
+
+import pytest
+import responses
+parametrize = pytest.mark.parametrize
+
+from nagios_graphite import main, buckets, window
+from nagios_graphite.sketch import DDSketch
+
+# An hour boundary plus 25 minutes, so the window has a partial head bucket
+NOW = 1420070400 + 1500
+
+
+def options_for(s):
+    argv = shlex.split("nagios_graphite -H http://example.com " + s)
+    return main.GraphiteNagios(argv).options
+
+
+def value(ts):
+    return None if ts % 600 == 0 else float((ts * 7919) % 1000)
+
+
+class FakeGraphite(object):
+    """Serves two series with one point per minute"""
+
+    def __init__(self, now, step=60):
+        self.now = now
+        self.step = step
+        self.requests = []
+
+    def points(self, start, until):
+        start = start - start % self.step + self.step
+        return [[value(ts), ts]
+                for ts in range(start, until - until % self.step + 1,
+                                self.step)]
+
+    def __call__(self, request):
+        qs = urlparse.parse_qs(urlparse.urlparse(request.url).query)
+        start, until = qs["from"][0], qs.get("until", ["now"])[0]
+        self.requests.append((start, until))
+        if start.startswith("-"):
+            start = self.now - window.parse_offset(start)
+        until = self.now if until in ("", "-", "now") else int(until)
+        points = self.points(int(start), until)
+        return (200, {}, json.dumps([
+            {"target": "a", "datapoints": points},
+            {"target": "b", "datapoints": [[v and v / 2, ts]
+                                           for v, ts in points]}]))
+
+    def window_values(self, start, now):
+        points = self.points(start - 1, now)
+        return [v for v, _ in points] + [v and v / 2 for v, _ in points]
+
+
+def add_fake(fake):
+    url_re = re.compile("^{}.*$".format(re.escape("http://example.com")))
+    responses.add_callback(responses.GET, url_re, callback=fake,
+                           content_type='application/json')
+
+
+@parametrize("start, end, expected", [
+    (0, 10800, [0, 3600, 7200]),
+    (1, 10800, [3600, 7200]),
+    (0, 10799, [0, 3600]),
+    (100, 3000, []),
+])
+def test_bucket_starts(start, end, expected):
+    assert buckets.bucket_starts(start, end, 3600) == expected
+
+
+def test_can_use():
+    assert buckets.can_use(options_for("-M a -F 7days"), ["99th~", "median~"])
+    assert not buckets.can_use(options_for("-M a -F 7days"), ["99th~", "max"])
+    assert not buckets.can_use(options_for("-M a -F 20150101"), ["99th~"])
+    assert not buckets.can_use(options_for("-M a -F 1d -u -1h"), ["99th~"])
+
+
+@responses.activate
+def test_store_fetches_missing_buckets(tmpdir):
+    fake = FakeGraphite(NOW)
+    add_fake(fake)
+    store = buckets.SketchStore(str(tmpdir))
+    opts = options_for("-M a -F 6hours")
+
+    store.sketches(opts, now=NOW)
+    assert len(fake.requests) == 1
+    assert (store.stored, store.fetched) == (0, 5)
+
+    fake.now, fake.requests = NOW + 300, []
+    sketches = store.sketches(opts, now=NOW + 300)
+    start = NOW + 300 - 6 * 3600
+    # The head before the first whole bucket and the tail after the last
+    assert fake.requests == [
+        (str(start - 1), str(1420070400 - 5 * 3600)),
+        (str(1420070400 - 1), str(NOW + 301))]
+    assert (store.stored, store.fetched) == (5, 0)
+    assert sorted(set(target for target, _ in sketches)) == ["a", "b"]
+
+    merged = DDSketch()
+    for _, sketch in sketches:
+        merged.merge(sketch)
+    expected = DDSketch().update(fake.window_values(start, NOW + 300))
+    assert merged.to_dict() == expected.to_dict()
+
+
+@responses.activate
+def test_store_evicts_old_buckets(tmpdir):
+    fake = FakeGraphite(NOW)
+    add_fake(fake)
+    store = buckets.SketchStore(str(tmpdir))
+    opts = options_for("-M a -F 6hours")
+
+    store.sketches(opts, now=NOW)
+    fake.now = NOW + 3 * 3600
+    store.sketches(opts, now=fake.now)
+    assert (store.stored, store.fetched) == (2, 3)
+    stored = store.load(store.path(opts))
+    assert sorted(stored) == [1420070400 + i * 3600 for i in range(-2, 3)]
+
+
+@responses.activate
+def test_store_keeps_windows_apart(tmpdir):
+    add_fake(FakeGraphite(NOW))
+    store = buckets.SketchStore(str(tmpdir))
+    week, day = options_for("-M a -F 7days"), options_for("-M a -F 1day")
+
+    store.sketches(week, now=NOW)
+    store.sketches(day, now=NOW)
+    store.sketches(week, now=NOW)
+    assert (store.stored, store.fetched) == (7 * 24 - 1, 0)
+    assert store.path(week) != store.path(day)
+
+
+@responses.activate
+def test_store_skips_failed_fetch(tmpdir):
+    url_re = re.compile("^{}.*$".format(re.escape("http://example.com")))
+    responses.add(responses.GET, url_re, status=500)
+    store = buckets.SketchStore(str(tmpdir))
+    opts = options_for("-M a -F 6hours")
+
+    assert store.sketches(opts, now=NOW) is None
+    assert store.load(store.path(opts)) == {}
+
+
+@responses.activate
+def test_check_buckets_matches_sketch_percentile(tmpdir):
+    fake = FakeGraphite(NOW)
+    add_fake(fake)
+    opts = options_for(
+        "-M a -F 6hours -A 99th~,median~ --sketch-dir " + str(tmpdir))
+
+    for now in [NOW, NOW + 60, NOW + 3600]:
+        fake.now = now
+        result = buckets.check_buckets(opts, ["99th~", "median~"], now=now)
+        values = fake.window_values(now - 6 * 3600, now)
+        assert result["99th~"] == main.FUNCTIONS["99th~"](values)
+        assert result["median~"] == main.FUNCTIONS["median~"](values)
+
+
+@responses.activate
+def test_check_with_sketch_dir(tmpdir, capsys):
+    add_fake(FakeGraphite(NOW))
+    response = main.run(shlex.split(
+        "nagios_graphite -H http://example.com -M a -F 6hours -A 99th~ -v "
+        "--sketch-dir " + str(tmpdir)))
+    assert response.status.name == "OK"
+    assert "sketch store: 0 buckets stored" in capsys.readouterr()[1]
+
+    response = main.run(shlex.split(
+        "nagios_graphite -H http://example.com -M a -F 6hours -A max -v "
+        "--sketch-dir " + str(tmpdir)))
+    assert response.status.name == "OK"
+    assert "only answers ~ percentiles" in capsys.readouterr()[1]
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+import re
+import json
+import shlex
+import urlparse
+
+import pytest
+import responses
+parametrize = pytest.mark.parametrize
+
+from nagios_graphite import main, budget
+
+url_re = re.compile("^{}.*$".format(re.escape("http://example.com")))
+
+raw = [
+    {"target": "a", "datapoints": [[float(i), i] for i in range(100)]},
+    {"target": "b", "datapoints": [[None, i] for i in range(50)]},
+]
+
+
+def options_for(s):
+    argv = shlex.split("nagios_graphite -H http://example.com -M 'x.*' " + s)
+    return main.GraphiteNagios(argv).options
+
+
+@parametrize("func", ["avg", "sum", "max"])
+def test_querystring_does_not_send_max_datapoints(func):
+    opts = options_for("-A {0} --max-datapoints 500".format(func))
+    qs = urlparse.parse_qs(main.graphite_querystring(opts))
+    assert qs["target"] == ["x.*"]
+    assert "maxDataPoints" not in qs
+
+
+def test_budget_count_raises_past_limit():
+    b = budget.Budget(3)
+    with pytest.raises(budget.DatapointBudgetExceeded):
+        list(b.count(range(10)))
+    assert b.points == 4
+
+
+def test_budget_count_approximate():
+    b = budget.Budget(3, approximate=True)
+    assert list(b.count(range(10))) == range(10)
+    assert b.exceeded
+    assert "processed 10 datapoints (budget 3, exceeded)" in b.describe()
+
+
+def test_summary_sample_is_bounded():
+    summary = main.Summary(True, sample_size=100).update(range(10000))
+    assert len(summary.values) == 100
+    assert summary.sampled
+    assert (summary.total, summary.min, summary.max) == (49995000, 0, 9999)
+    assert set(summary.values) <= set(range(10000))
+
+
+def test_summary_sample_not_needed():
+    summary = main.Summary(True, sample_size=100).update(range(50))
+    assert summary.values == range(50)
+    assert not summary.sampled
+
+
+@responses.activate
+def test_budget_exceeded_is_unknown():
+    responses.add(responses.GET, url_re, body=json.dumps(raw))
+    response = main.run(shlex.split(
+        "nagios_graphite -H http://example.com -M 'x.*' -A avg "
+        "--max-datapoints 120"))
+    assert response.status.exit_code == 3
+    assert "DatapointBudgetExceeded" in response.message
+
+
+@responses.activate
+def test_within_budget():
+    responses.add(responses.GET, url_re, body=json.dumps(raw))
+    response = main.run(shlex.split(
+        "nagios_graphite -H http://example.com -M 'x.*' -A avg,nullcnt "
+        "--max-datapoints 150"))
+    assert response.status.exit_code == 0
+    assert response.message == "metric (avg is 49.5, nullcnt is 50)"
+
+
+@responses.activate
+def test_over_budget_approximate():
+    responses.add(responses.GET, url_re, body=json.dumps(raw))
+    response = main.run(shlex.split(
+        "nagios_graphite -H http://example.com -M 'x.*' -A max,median "
+        "--max-datapoints 20 --over-budget approximate"))
+    assert response.status.exit_code == 0
+    assert response.message.startswith("metric (max is 99.0, median is")
+    assert response.message.endswith("(approximate)")
+
+
+@responses.activate
+def test_budget_applies_to_prefetched_data():
+    opts = options_for("-A sum --max-datapoints 10")
+    with pytest.raises(budget.DatapointBudgetExceeded):
+        main.check_graphite_all(opts, raw_data=raw)
+    assert not responses.calls
+
+
+@responses.activate
+def test_budget_verbose(capsys):
+    responses.add(responses.GET, url_re, body=json.dumps(raw))
+    opts = options_for("-A sum --max-datapoints 1000 -v")
+    assert main.check_graphite_all(opts)["sum"] == 4950.0
+    _, err = capsys.readouterr()
+    assert "processed 150 datapoints (budget 1000), peak RSS" in err
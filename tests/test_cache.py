@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import json
+import time
+import shlex
+import threading
+
+import pytest
+import responses
+
+from nagios_graphite import cache, main
+
+series = [{"target": "foo", "datapoints": [[1.0, 10], [3.0, 11]]}]
+
+
+def options_for(s):
+    argv = shlex.split("nagios_graphite -H http://example.com " + s)
+    return main.GraphiteNagios(argv).options
+
+
+def add_render(body=json.dumps(series), status=200):
+    url_re = re.compile("^{}.*$".format(re.escape("http://example.com")))
+    responses.add(responses.GET, url_re, body=body, status=status,
+                  content_type='application/json')
+
+
+def test_normalize_url():
+    assert cache.normalize_url("http://a/render?b=2&a=1") == \
+        cache.normalize_url("http://a/render?a=1&b=2")
+
+
+def test_cache_key():
+    key = cache.cache_key(options_for("-M foo -A max"))
+    assert key == cache.cache_key(options_for("-M foo -A 99th -w 3"))
+    assert key != cache.cache_key(options_for("-M bar"))
+    assert key != cache.cache_key(options_for("-M foo -F 5minutes"))
+    assert key != cache.cache_key(options_for("-M foo -U user -P pass"))
+
+
+def test_atomic_write(tmpdir):
+    path = str(tmpdir.join("entry.json"))
+    cache.atomic_write(path, "[]")
+    assert open(path).read() == "[]"
+    assert os.listdir(str(tmpdir)) == ["entry.json"]
+
+
+def test_render_cache_hit_and_miss(tmpdir):
+    c = cache.RenderCache(str(tmpdir.join("cache")), ttl=60)
+    opts = options_for("-M foo")
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        return series
+
+    assert c.fetch(opts, fetch) == series
+    assert c.fetch(opts, fetch) == series
+    assert len(calls) == 1
+    assert (c.hits, c.misses) == (1, 1)
+    assert "hit" in c.describe()
+
+
+def test_render_cache_expiry(tmpdir):
+    c = cache.RenderCache(str(tmpdir), ttl=10)
+    opts = options_for("-M foo")
+    c.fetch(opts, lambda: series)
+
+    path = c.path(cache.cache_key(opts))
+    old = time.time() - 60
+    os.utime(path, (old, old))
+    assert c.read(path) is None
+    assert c.fetch(opts, lambda: [{"target": "new", "datapoints": []}])[0][
+        "target"] == "new"
+    assert c.misses == 2
+
+
+def test_render_cache_skips_empty(tmpdir):
+    c = cache.RenderCache(str(tmpdir), ttl=60)
+    opts = options_for("-M foo")
+    assert c.fetch(opts, lambda: []) == []
+    assert c.fetch(opts, lambda: series) == series
+    assert c.misses == 2
+
+
+@pytest.mark.skipif(cache.fcntl is None, reason="needs fcntl")
+def test_render_cache_concurrent_fetch_once(tmpdir):
+    opts = options_for("-M foo")
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        time.sleep(0.1)
+        return series
+
+    def worker():
+        # a cache per thread, like separate check processes
+        assert cache.RenderCache(str(tmpdir), ttl=60).fetch(
+            opts, fetch) == series
+
+    threads = [threading.Thread(target=worker) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1
+
+
+@responses.activate
+def test_check_graphite_cached(tmpdir, capsys):
+    add_render()
+    args = "-M foo -v --cache-dir {0} -A ".format(tmpdir)
+    assert main.check_graphite_all(options_for(args + "max"))["max"] == 3.0
+    assert main.check_graphite_all(options_for(args + "min"))["min"] == 1.0
+    assert len(responses.calls) == 1
+
+    err = capsys.readouterr()[1]
+    assert "render cache miss" in err
+    assert "render cache hit" in err
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+
+import re
+import json
+import shlex
+import urlparse
+
+import responses
+
+from nagios_graphite import coalesce, batch, engine
+from nagios_graphite.main import GraphiteNagios
+
+
+def options_for(s):
+    argv = shlex.split("nagios_graphite -H http://example.com " + s)
+    return GraphiteNagios(argv).options
+
+
+def query(url):
+    return urlparse.parse_qs(urlparse.urlparse(url).query)
+
+
+def test_coalesce_groups_compatible_checks():
+    opts = [
+        options_for("-M a"),
+        options_for("-M b -F 5minutes"),
+        options_for("-M c"),
+        options_for("-M d -U user -P pass"),
+        options_for("-M e -F -5minutes"),
+    ]
+    groups = coalesce.coalesce(opts)
+    assert [[i for i, _ in g.members] for g in groups] == [[0, 2], [1, 4], [3]]
+
+
+def test_coalesce_max_targets():
+    opts = [options_for("-M t{0}".format(i)) for i in range(5)]
+    groups = coalesce.coalesce(opts, max_targets=2)
+    assert [len(g.members) for g in groups] == [2, 2, 1]
+
+
+def test_coalesce_max_url_length():
+    opts = [options_for("-M " + "x" * 100) for i in range(5)]
+    groups = coalesce.coalesce(opts, max_url_length=400)
+    assert all(len(g.url()) <= 400 for g in groups)
+    assert sum(len(g.members) for g in groups) == 5
+    assert len(groups) > 1
+
+
+def test_render_group_url():
+    group = coalesce.coalesce([options_for("-M a"), options_for("-M b")])[0]
+    qs = query(group.url())
+    assert qs["target"] == [
+        'alias(a,"nagios_graphite_0")', 'alias(b,"nagios_graphite_1")']
+    assert qs["from"] == ["-1minute"]
+    assert qs["format"] == ["json"]
+
+    single = coalesce.coalesce([options_for("-M a")])[0]
+    assert query(single.url())["target"] == ["a"]
+
+
+def render_callback(request):
+    series = []
+    for target in query(request.url)["target"]:
+        m = re.match(r'alias\((.*),"(.*)"\)', target)
+        name, alias = m.groups() if m else (target, target)
+        if name == "broken":
+            return (500, {}, "")
+        value = float(len(name))
+        series.append({"target": alias, "datapoints": [[value, 1]]})
+        series.append({"target": alias, "datapoints": [[value + 1, 1]]})
+    return (200, {}, json.dumps(series))
+
+
+def add_render_callback():
+    url_re = re.compile("^{}.*$".format(re.escape("http://example.com")))
+    responses.add_callback(responses.GET, url_re, callback=render_callback,
+                           content_type='application/json')
+
+
+@responses.activate
+def test_prefetch_routes_series():
+    add_render_callback()
+    opts = [options_for("-M a"), options_for("-M bb"), options_for("-M ccc")]
+
+    data = coalesce.prefetch(opts, batch.batch_session(1))
+    assert len(responses.calls) == 1
+    assert [[s["datapoints"][0][0] for s in d] for d in data] == [
+        [1.0, 2.0], [2.0, 3.0], [3.0, 4.0]]
+
+
+@responses.activate
+def test_prefetch_retries_failed_group_individually():
+    add_render_callback()
+    opts = [options_for("-M a"), options_for("-M broken")]
+
+    data = coalesce.prefetch(opts, batch.batch_session(1))
+    assert len(responses.calls) == 3
+    assert len(data[0]) == 2
+    assert data[1] == []
+
+
+@responses.activate
+def test_run_checks_coalesced():
+    add_render_callback()
+    checks = [
+        ["-H", "http://example.com", "-M", "a", "-N", "a", "-A", "max"],
+        ["-H", "http://example.com", "-M", "bb", "-N", "b", "-A", "max"],
+        ["-H", "http://example.com", "-M", "broken", "-N", "c"],
+        ["--http-timeout", "soon"],
+    ]
+    results = list(batch.run_checks(checks, batch.batch_session(1), True))
+
+    assert [name for name, _ in results] == ["a", "b", "c", "line 4"]
+    assert [r.message for _, r in results[:3]] == [
+        "a (max is 2.0)", "b (max is 3.0)", "No results returned!"]
+    # one coalesced request, then a retry per check after it failed
+    assert len(responses.calls) == 4
+
+
+@responses.activate
+def test_run_checks_per_series_not_coalesced():
+    add_render_callback()
+    checks = [
+        ["-H", "http://example.com", "-M", "a", "-N", "a", "-A", "max"],
+        ["-H", "http://example.com", "-M", "bb", "-N", "b", "-A", "max",
+         "--per-series", "-w", "2.5"],
+    ]
+    results = list(batch.run_checks(checks, batch.batch_session(1), True))
+
+    assert results[1][1].message == "b: 1 WARN of 2 series: bb (max is 3.0)"
+    assert len(responses.calls) == 2
+
+
+class RecordingEngine(engine.FetchEngine):
+    def __init__(self):
+        super(RecordingEngine, self).__init__()
+        self.batches = []
+
+    def run(self, jobs):
+        jobs = list(jobs)
+        self.batches.append([job.timeout for job in jobs])
+        return super(RecordingEngine, self).run(jobs)
+
+
+@responses.activate
+def test_prefetch_retries_are_separate_jobs():
+    add_render_callback()
+    opts = [options_for("-M a"), options_for("-M broken"),
+            options_for("-M ccc")]
+
+    e = RecordingEngine()
+    data = coalesce.prefetch(opts, batch.batch_session(1), engine=e)
+    assert e.batches == [[10], [10, 10, 10]]
+    assert [len(d) for d in data] == [2, 0, 2]
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import json
+import stat
+import threading
+
+import pytest
+import responses
+
+from nagios_graphite import client, daemon, main
+
+series = [{"target": "foo", "datapoints": [[1.0, 10], [3.0, 11]]}]
+check_args = ["nagios_graphite", "-H", "http://example.com", "-M", "foo",
+              "-w", "1", "-c", "5"]
+
+
+def add_render():
+    url_re = re.compile("^{}.*$".format(re.escape("http://example.com")))
+    responses.add(responses.GET, url_re, body=json.dumps(series), status=200,
+                  content_type='application/json')
+
+
+def run_in_process(args, capsys):
+    with pytest.raises(SystemExit) as e:
+        main.main(args)
+    out, err = capsys.readouterr()
+    return {"stdout": out, "stderr": err, "exit_code": e.value.code}
+
+
+@pytest.fixture
+def server(tmpdir):
+    path = str(tmpdir.join("check.sock"))
+    server = daemon.CheckServer(path, None)
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,))
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@responses.activate
+def test_execute_matches_main(capsys):
+    add_render()
+    assert daemon.execute(check_args) == run_in_process(check_args, capsys)
+
+
+def test_execute_option_error():
+    reply = daemon.execute(["nagios_graphite", "--http-timeout", "soon"])
+    assert reply["exit_code"] == 2
+    assert reply["stdout"] == ""
+    assert "invalid integer value" in reply["stderr"]
+
+
+def test_execute_help():
+    reply = daemon.execute(["nagios_graphite", "--help"])
+    assert reply["exit_code"] == 0
+    assert "--algorithm" in reply["stdout"]
+
+
+def test_exit_code():
+    assert daemon.exit_code(SystemExit()) == 0
+    assert daemon.exit_code(SystemExit(3)) == 3
+
+
+@responses.activate
+def test_client_request(server, capsys):
+    add_render()
+    reply = client.request(server.server_address, check_args)
+    assert reply == run_in_process(check_args, capsys)
+    assert reply["exit_code"] == 1
+
+
+@responses.activate
+def test_client_main(server, monkeypatch, capsys):
+    add_render()
+    monkeypatch.setenv("NAGIOS_GRAPHITE_SOCKET", server.server_address)
+    expected = run_in_process(check_args, capsys)
+
+    with pytest.raises(SystemExit) as e:
+        client.main(check_args)
+    out, err = capsys.readouterr()
+    assert (out, err, e.value.code) == (
+        expected["stdout"], expected["stderr"], expected["exit_code"])
+
+
+@responses.activate
+def test_client_falls_back_in_process(tmpdir, monkeypatch, capsys):
+    add_render()
+    monkeypatch.setenv("NAGIOS_GRAPHITE_SOCKET", str(tmpdir.join("nope")))
+    expected = run_in_process(check_args, capsys)
+
+    with pytest.raises(SystemExit) as e:
+        client.main(check_args)
+    assert capsys.readouterr()[0] == expected["stdout"]
+    assert e.value.code == expected["exit_code"]
+
+
+def test_socket_is_private(server):
+    mode = os.stat(server.server_address).st_mode
+    assert stat.S_IMODE(mode) == 0o600
+
+
+def test_socket_directory_is_created_private(tmpdir):
+    path = str(tmpdir.join("run", "check.sock"))
+    server = daemon.CheckServer(path, None)
+    try:
+        assert stat.S_IMODE(os.stat(os.path.dirname(path)).st_mode) == 0o700
+    finally:
+        server.server_close()
+
+
+def test_default_socket(monkeypatch):
+    monkeypatch.delenv("NAGIOS_GRAPHITE_SOCKET", raising=False)
+    monkeypatch.setenv("XDG_RUNTIME_DIR", "/run/user/1000")
+    assert client.socket_path() == "/run/user/1000/nagios_graphite.sock"
+
+    monkeypatch.delenv("XDG_RUNTIME_DIR")
+    assert client.socket_path() == os.path.expanduser(
+        "~/.nagios_graphite/nagios_graphite.sock")
+
+
+@responses.activate
+def test_client_other_environment_runs_in_process(server, tmpdir,
+                                                  monkeypatch, capsys):
+    add_render()
+    monkeypatch.setenv("NAGIOS_GRAPHITE_SOCKET", server.server_address)
+    monkeypatch.setenv("NAGIOS_GRAPHITE_BACKEND", "python")
+    assert client.request(server.server_address, check_args) == {
+        "in_process": True}
+
+    monkeypatch.delenv("NAGIOS_GRAPHITE_BACKEND")
+    monkeypatch.chdir(tmpdir)
+    assert client.request(server.server_address, check_args) == {
+        "in_process": True}
+
+    expected = run_in_process(check_args, capsys)
+    with pytest.raises(SystemExit) as e:
+        client.main(check_args)
+    assert capsys.readouterr()[0] == expected["stdout"]
+    assert e.value.code == expected["exit_code"]
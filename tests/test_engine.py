@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+import re
+import json
+import time
+import threading
+
+import responses
+
+from nagios_graphite import batch, engine
+
+
+class Tracker(object):
+    """Records how many calls run at once, overall and per host"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = {}
+        self.peak = {}
+
+    def call(self, host, value, delay=0.05):
+        def fn():
+            with self.lock:
+                self.running[host] = self.running.get(host, 0) + 1
+                total = sum(self.running.values())
+                self.peak[host] = max(self.peak.get(host, 0),
+                                      self.running[host])
+                self.peak[None] = max(self.peak.get(None, 0), total)
+            time.sleep(delay)
+            with self.lock:
+                self.running[host] -= 1
+            return value
+        return engine.Job(fn, host)
+
+
+def test_run_returns_results_in_order():
+    tracker = Tracker()
+    jobs = [tracker.call("h{0}".format(i % 3), i) for i in range(9)]
+    assert engine.FetchEngine(4, 4).run(jobs) == range(9)
+
+
+def test_global_concurrency_cap():
+    tracker = Tracker()
+    jobs = [tracker.call("h{0}".format(i), i) for i in range(12)]
+    engine.FetchEngine(max_workers=3, max_per_host=10).run(jobs)
+    assert tracker.peak[None] == 3
+
+
+def test_per_host_concurrency_cap():
+    tracker = Tracker()
+    jobs = [tracker.call("a", i) for i in range(6)]
+    jobs += [tracker.call("b", i) for i in range(6)]
+    engine.FetchEngine(max_workers=8, max_per_host=2).run(jobs)
+    assert tracker.peak["a"] == 2
+    assert tracker.peak["b"] == 2
+    assert tracker.peak[None] == 4
+
+
+def test_exceptions_are_returned():
+    def fail():
+        raise ValueError("boom")
+    result = engine.FetchEngine().run([engine.Job(fail), engine.Job(int)])
+    assert isinstance(result[0], ValueError)
+    assert result[1] == 0
+
+
+def test_deadline_does_not_stall_other_jobs():
+    tracker = Tracker()
+    slow = tracker.call("slow", "slow", delay=2)
+    slow.timeout = 0.1
+    fast = [tracker.call("fast", i, delay=0.01) for i in range(5)]
+
+    start = time.time()
+    result = engine.FetchEngine(max_workers=2).run([slow] + fast)
+    assert time.time() - start < 1
+    assert isinstance(result[0], engine.DeadlineExceeded)
+    assert result[1:] == range(5)
+
+
+def test_expired_job_keeps_host_slot():
+    tracker = Tracker()
+    hung = tracker.call("slow", "hung", delay=0.5)
+    hung.timeout = 0.1
+    jobs = [hung] + [tracker.call("slow", i, delay=0.01) for i in range(3)]
+
+    result = engine.FetchEngine(max_workers=4, max_per_host=1).run(jobs)
+    assert isinstance(result[0], engine.DeadlineExceeded)
+    assert result[1:] == range(3)
+    assert tracker.peak["slow"] == 1
+
+
+def test_cancel_pending_jobs():
+    e = engine.FetchEngine(max_workers=1)
+    started = threading.Event()
+
+    def first():
+        started.set()
+        time.sleep(0.1)
+        return "done"
+
+    def cancel():
+        started.wait()
+        e.cancel()
+
+    threading.Thread(target=cancel).start()
+    result = e.run([engine.Job(first), engine.Job(int), engine.Job(int)])
+    assert result[0] == "done"
+    assert all(isinstance(r, engine.Cancelled) for r in result[1:])
+
+
+def test_host_of():
+    assert engine.host_of("http://example.com:8080/render") == \
+        "example.com:8080"
+
+
+@responses.activate
+def test_run_checks_concurrently():
+    series = [{"target": "foo", "datapoints": [[2.0, 10]]}]
+    url_re = re.compile("^{}.*$".format(re.escape("http://example.com")))
+    responses.add(responses.GET, url_re, body=json.dumps(series), status=200,
+                  content_type='application/json')
+
+    checks = [["-H", "http://example.com", "-M", "m{0}".format(i),
+               "-N", str(i)] for i in range(6)]
+    results = list(batch.run_checks(
+        checks, batch.batch_session(2), engine=engine.FetchEngine(3, 2)))
+
+    assert [name for name, _ in results] == [str(i) for i in range(6)]
+    assert all(r.message.endswith("(avg is 2.0)") for _, r in results)
+    assert len(responses.calls) == 6
+
+
+def test_run_checks_fetch_error():
+    checks = [["-H", "http://127.0.0.1:1/render", "-M", "m", "-N", "x"]]
+    [(name, response)] = batch.run_checks(
+        checks, batch.batch_session(1), engine=engine.FetchEngine())
+    assert name == "x"
+    assert response.message.startswith("Client error: ConnectionError")
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import json
+import shlex
+import pickle
+
+import pytest
+import responses
+parametrize = pytest.mark.parametrize
+
+from nagios_graphite import formats, main
+from nagios_graphite.series import CompactSeries, as_dicts
+
+infos = [
+    {"name": "foo,bar", "pathExpression": "foo*", "start": 100, "end": 130,
+     "step": 10, "values": [1.5, None, -2.0]},
+    {"name": "baz", "pathExpression": "baz", "start": 100, "end": 100,
+     "step": 10, "values": []},
+]
+series = [
+    {"target": "foo,bar", "datapoints": [[1.5, 100], [None, 110],
+                                         [-2.0, 120]]},
+    {"target": "baz", "datapoints": []},
+]
+
+
+def encode_raw(infos):
+    return "".join(
+        "{0},{1},{2},{3}|{4}\n".format(
+            i["name"], i["start"], i["end"], i["step"],
+            ",".join(repr(v) if v is not None else "None"
+                     for v in i["values"]))
+        for i in infos)
+
+
+def options_for(s):
+    argv = shlex.split("nagios_graphite -H http://example.com -M foo " + s)
+    return main.GraphiteNagios(argv).options
+
+
+def test_decode_raw():
+    assert as_dicts(formats.decode_raw(encode_raw(infos))) == series
+
+
+def test_decode_pickle():
+    assert as_dicts(formats.decode_pickle(pickle.dumps(infos, 2))) == series
+
+
+def test_decode_pickle_refuses_globals():
+    with pytest.raises(formats.cPickle.UnpicklingError):
+        formats.decode_pickle(pickle.dumps([os.system], 2))
+
+
+@pytest.mark.skipif(formats.msgpack is None, reason="needs msgpack")
+def test_decode_msgpack():
+    content = formats.msgpack.packb(infos, use_bin_type=True)
+    assert as_dicts(formats.decode_msgpack(content)) == series
+
+
+def test_check_format():
+    formats.check_format("raw")
+    formats.check_format("pickle", trusted=True)
+    with pytest.raises(formats.UnsafeFormat):
+        formats.check_format("pickle")
+    with pytest.raises(ValueError):
+        formats.check_format("xml")
+
+
+def test_graphite_querystring_format():
+    opts = options_for("")
+    assert "format=raw" in main.graphite_querystring(opts, "raw")
+
+
+def add_render(fmt, body, status=200, content_type="text/plain"):
+    url_re = re.compile("^{0}.*format={1}.*$".format(
+        re.escape("http://example.com"), fmt))
+    responses.add(responses.GET, url_re, body=body, status=status,
+                  content_type=content_type)
+
+
+@responses.activate
+def test_graphite_fetch_raw():
+    add_render("raw", encode_raw(infos))
+    data = main.graphite_fetch(options_for("--render-format raw"))
+    assert all(isinstance(e, CompactSeries) for e in data)
+    assert as_dicts(data) == series
+    assert len(responses.calls) == 1
+
+
+@responses.activate
+def test_graphite_fetch_pickle_requires_trust():
+    with pytest.raises(formats.UnsafeFormat):
+        main.graphite_fetch(options_for("--render-format pickle"))
+
+    add_render("pickle", pickle.dumps(infos, 2))
+    opts = options_for("--render-format pickle --trusted-backend")
+    assert as_dicts(main.graphite_fetch(opts)) == series
+
+
+@parametrize("status,body,content_type", [
+    (400, "unsupported format", "text/plain"),
+    (200, "\x89PNG...", "image/png"),
+    (200, "not|a,raw,body", "text/plain"),
+])
+@responses.activate
+def test_graphite_fetch_falls_back_to_json(status, body, content_type):
+    add_render("raw", body, status, content_type)
+    add_render("json", json.dumps(series), content_type="application/json")
+
+    assert main.graphite_fetch(options_for("--render-format raw")) == series
+    assert len(responses.calls) == 2
+
+
+@responses.activate
+def test_check_raw_matches_json():
+    add_render("raw", encode_raw(infos))
+    add_render("json", json.dumps(series), content_type="application/json")
+    for name in sorted(main.FUNCTIONS):
+        expected = main.check_graphite_all(options_for("-A " + name))
+        actual = main.check_graphite_all(
+            options_for("-A {0} --render-format raw".format(name)))
+        assert actual == expected
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+import json
+import time
+import shlex
+import threading
+import SocketServer
+import BaseHTTPServer
+
+import pytest
+
+from nagios_graphite import main, hedge
+
+series = [{"target": "foo", "datapoints": [[1.0, 10], [3.0, 11]]}]
+
+
+class RenderHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        time.sleep(self.server.delay)
+        status = self.server.status
+        body = json.dumps(series) if status == 200 else "error"
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Replica(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, delay=0, status=200):
+        BaseHTTPServer.HTTPServer.__init__(
+            self, ("127.0.0.1", 0), RenderHandler)
+        self.delay = delay
+        self.status = status
+        self.requests = []
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{0}/render".format(self.server_address[1])
+
+
+@pytest.fixture
+def replicas():
+    started = []
+
+    def start(delay=0, status=200):
+        server = Replica(delay, status)
+        thread = threading.Thread(target=server.serve_forever, args=(0.05,))
+        thread.daemon = True
+        thread.start()
+        started.append(server)
+        return server
+
+    yield start
+    for server in started:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def fresh_stats(monkeypatch):
+    monkeypatch.setattr(hedge, "_stats", {})
+
+
+def run(servers, s=""):
+    hostnames = ",".join(server.url for server in servers)
+    start = time.time()
+    response = main.run(shlex.split(
+        "nagios_graphite --transport urllib -M foo -A max -H {0} {1}".format(
+            hostnames, s)))
+    return response, time.time() - start
+
+
+def test_split_hostnames():
+    opts = main.GraphiteNagios(shlex.split(
+        "nagios_graphite -M foo -H 'http://a/render, http://b/render,'"
+    )).options
+    assert opts.hostnames == ["http://a/render", "http://b/render"]
+    assert opts.hostname == "http://a/render"
+    assert main.split_hostnames(None) == []
+
+
+def test_slow_primary_is_hedged(replicas):
+    slow, fast = replicas(delay=1), replicas()
+    response, elapsed = run([slow, fast], "--hedge-delay 50")
+
+    assert response.status.name == "OK"
+    assert response.perf_data["max"].value == 3.0
+    assert elapsed < 0.8
+    assert len(slow.requests) == len(fast.requests) == 1
+    assert fast.requests[0] == slow.requests[0]
+    stats = [hedge.endpoint_stats(s.url) for s in (slow, fast)]
+    assert [(s.requests, s.wins) for s in stats] == [(1, 0), (1, 1)]
+
+
+def test_fast_primary_is_not_hedged(replicas):
+    fast, other = replicas(), replicas()
+    response, _ = run([fast, other], "--hedge-delay 500")
+
+    assert response.status.name == "OK"
+    assert len(fast.requests) == 1
+    assert other.requests == []
+
+
+def test_error_tries_next_endpoint_at_once(replicas):
+    broken, fast = replicas(status=500), replicas()
+    response, elapsed = run([broken, fast], "--hedge-delay 5000")
+
+    assert response.status.name == "OK"
+    assert elapsed < 2
+    assert hedge.endpoint_stats(broken.url).failures == 1
+
+
+def test_every_endpoint_failing(replicas):
+    servers = [replicas(status=500), replicas(status=500)]
+    response, _ = run(servers, "--hedge-delay 5000")
+
+    assert response.status.name == "UNKNOWN"
+    assert all(len(s.requests) == 1 for s in servers)
+
+
+def test_learned_delay():
+    session = hedge.HedgedSession(None, ["http://a", "http://b"])
+    assert session.delay == hedge.DEFAULT_DELAY_MS / 1e3
+    for i in range(100):
+        session.stats[0].record((i + 1) / 1000.0)
+    assert session.delay == 0.096
+    assert hedge.HedgedSession(None, ["http://a"], 10).delay == 0.01
+
+
+def test_stats_file(replicas, tmpdir, capsys):
+    path = str(tmpdir.join("latency.json"))
+    primary, other = replicas(), replicas()
+    for _ in range(3):
+        run([primary, other], "-v --hedge-stats " + path)
+
+    with open(path) as f:
+        stored = json.load(f)
+    assert len(stored[primary.url]) == 3
+    assert stored[other.url] == []
+
+    hedge._stats.clear()
+    session = hedge.HedgedSession(None, [primary.url, other.url])
+    hedge.load_stats(path, session.stats)
+    assert len(session.stats[0].latencies) == 3
+
+    err = capsys.readouterr()[1]
+    assert "{0}: 3 requests, 3 won, 0 failed".format(primary.url) in err
+    assert "{0}: 0 requests, 0 won, 0 failed, p50 -".format(other.url) in err
+
+
+def test_single_hostname_is_not_hedged(replicas, monkeypatch):
+    server = replicas()
+    monkeypatch.setattr(hedge, "HedgedSession", None)
+    response, _ = run([server])
+    assert response.status.name == "OK"
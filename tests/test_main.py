@@ -6,10 +6,12 @@
 #
 
 import re
+import sys
 import json
 import shlex
 import random
 import urllib
+import subprocess
 
 import pytest
 import responses
@@ -18,6 +20,7 @@ parametrize = pytest.mark.parametrize
 # from nagios_graphite import metadata
 from nagios_graphite import main
 from nagios_graphite.main import FUNCTIONS, combine, GraphiteNagios
+from nagios_graphite.selection import select, percentile_rank
 
 
 def test_remove_null_without_null():
@@ -106,6 +109,16 @@ def test_raising_aggregators():
             fn([])
 
 
+def test_aggregators_accept_iterators():
+    for name, fn in FUNCTIONS.iteritems():
+        assert fn(iter(xs)) == fn(xs)
+
+
+def test_mean():
+    assert FUNCTIONS["avg"]([1, 2, 3, 4]) == 2
+    assert FUNCTIONS["avg"](iter([1.0, 2.0])) == 1.5
+
+
 graphite_without_none = [
     {"target": "foo", "datapoints": [[1, 10], [2, 11], [3, 12]]},
     {"target": "bar", "datapoints": [[4, 10], [5, 11], [6, 12]]},
@@ -121,13 +134,21 @@ def test_combine_empty():
 
 
 def test_combine_without_none():
-    id_ = lambda xs: xs
-    assert combine(graphite_without_none, id_) == [1, 2, 3, 4, 5, 6]
+    assert combine(graphite_without_none, list) == [1, 2, 3, 4, 5, 6]
 
 
 def test_combine_with_none():
-    id_ = lambda xs: xs
-    assert combine(graphite_with_none, id_) == [1, 2, 3, None, 5, None]
+    assert combine(graphite_with_none, list) == [1, 2, 3, None, 5, None]
+
+
+def test_combine_is_lazy():
+    assert combine(graphite_with_none, iter).next() == 1
+
+
+def test_iter_values():
+    assert list(main.iter_values([])) == []
+    assert list(main.iter_values(graphite_with_none)) == [
+        1, 2, 3, None, 5, None]
 
 
 def options_for(s):
@@ -225,3 +246,147 @@ def test_check_graphite_failure():
             responses.GET, url_re, status=500)
 
         assert main.check_graphite(opts) is None
+
+
+def test_summary():
+    summary = main.Summary().update([1, None, 3, 2])
+    assert summary.count == 4
+    assert summary.nulls == 1
+    assert summary.size == 3
+    assert summary.total == 6
+    assert (summary.min, summary.max) == (1, 3)
+
+
+def test_summary_percentile_requires_values():
+    with pytest.raises(ValueError):
+        main.Summary().update(xs).percentile(0.5)
+
+
+def test_summary_functions_match_functions():
+    assert set(main.SUMMARY_FUNCTIONS) == set(FUNCTIONS)
+    data = list(xs) + [None] * 10
+    random.shuffle(data)
+    for name, fn in main.SUMMARY_FUNCTIONS.iteritems():
+        summary = main.Summary(
+            keep_values=True, accuracy=main.DEFAULT_ACCURACY).update(data)
+        assert fn(summary) == FUNCTIONS[name](data)
+
+
+def test_summary_functions_raise_on_empty():
+    for name, fn in main.SUMMARY_FUNCTIONS.iteritems():
+        with pytest.raises(main.EmptyQueryResult):
+            fn(main.Summary(keep_values=True))
+
+
+def test_parse_functions():
+    assert main.parse_functions("avg") == ["avg"]
+    assert main.parse_functions("avg, max,99th") == ["avg", "max", "99th"]
+    names = main.parse_functions("all")
+    assert names[0] == "avg"
+    assert sorted(names) == sorted(FUNCTIONS)
+
+    for spec in ["", "foo", "avg,foo"]:
+        with pytest.raises(ValueError):
+            main.parse_functions(spec)
+
+
+def test_aggregate():
+    result = main.aggregate(iter([1, None, 3]), ["nullpct", "max", "median"])
+    assert list(result.items()) == [
+        ("nullpct", 1.0 / 3), ("max", 3), ("median", 3)]
+
+
+@responses.activate
+def test_check_multiple_aggregates():
+    url_re = re.compile("^{}.*$".format(re.escape("http://example.com")))
+    responses.add(
+        responses.GET, url_re,
+        body=json.dumps(graphite_with_none), status=200,
+        content_type='application/json')
+
+    plugin = GraphiteNagios(shlex.split(
+        "nagios_graphite -M 'cpu.load.average' -H http://example.com "
+        "-A max,nullcnt -w 4 -c 10"))
+    response = plugin.check()
+
+    assert response.status.name == "WARN"
+    assert response.message == "metric (max is 5, nullcnt is 2)"
+    assert sorted(response.perf_data) == ["max", "nullcnt"]
+
+
+# Straightforward versions of FUNCTIONS to check the single-pass Summary
+# against
+
+def mean(xs):
+    ys = list(xs)
+    return sum(ys) / len(ys)
+
+
+def percentile(n):
+    def percentile_fn(xs):
+        ys = list(xs)
+        return select(ys, percentile_rank(len(ys), n))
+    return percentile_fn
+
+
+def reference_nullpct(xs):
+    return float(len([x for x in xs if x is None])) / float(len(xs))
+
+
+REFERENCE_FUNCTIONS = {
+    "sum":    main.values_only(sum),
+    "min":    main.values_only(min),
+    "max":    main.values_only(max),
+    "avg":    main.values_only(mean),
+    "median": main.values_only(percentile(0.5)),
+    "95th":   main.values_only(percentile(0.95)),
+    "99th":   main.values_only(percentile(0.99)),
+    "999th":  main.values_only(percentile(0.999)),
+    "nullcnt": main.raise_on_empty(
+        lambda xs: len([x for x in xs if x is None])),
+    "nullpct": main.raise_on_empty(lambda xs: reference_nullpct(list(xs))),
+}
+
+
+@parametrize("values", [
+    [1, 2, 3],
+    [None, 2, None, 1, 1.0, 3],
+    [-0.0, None],
+    [None, None, 5],
+    [0.1] * 10 + [None, 1e16, -1e16],
+    [None if i % 7 == 0 else random.uniform(-1, 1) for i in range(500)],
+])
+@parametrize("name", sorted(REFERENCE_FUNCTIONS))
+def test_functions_match_reference(name, values):
+    result = FUNCTIONS[name](iter(values))
+    expected = REFERENCE_FUNCTIONS[name](list(values))
+    assert result == expected
+    assert repr(result) == repr(expected)
+
+
+@parametrize("values", [[], [None]])
+def test_functions_empty_from_counts(values):
+    for name, fn in FUNCTIONS.iteritems():
+        if name in ("nullcnt", "nullpct") and values:
+            continue
+        with pytest.raises(main.EmptyQueryResult):
+            fn(values)
+
+
+def test_summary_update_matches_add():
+    values = [None if i % 5 == 0 else (i * 37) % 101 for i in range(300)]
+    updated = main.Summary(True).update(values)
+    added = main.Summary(True)
+    for x in values:
+        added.add(x)
+    for attr in ("count", "nulls", "total", "min", "max", "values"):
+        assert getattr(updated, attr) == getattr(added, attr)
+
+
+def test_python_backend_does_not_import_numpy():
+    code = ("import sys\n"
+            "from nagios_graphite import main\n"
+            "main.aggregate_series([{'datapoints': [[1.0, 0]]}], ['avg'], "
+            "main.resolve_backend('python'))\n"
+            "sys.exit('numpy' in sys.modules)")
+    assert subprocess.call([sys.executable, "-c", code]) == 0
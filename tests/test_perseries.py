@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+import re
+import json
+import shlex
+
+import pytest
+import responses
+from pynagios import Range
+parametrize = pytest.mark.parametrize
+
+from nagios_graphite import main, perseries
+
+url_re = re.compile("^{}.*$".format(re.escape("http://example.com")))
+
+raw = [
+    {"target": "host{0}".format(i),
+     "datapoints": [[float(i), 10], [None, 20], [float(i) / 2, 30]]}
+    for i in range(10)
+] + [{"target": "empty", "datapoints": [[None, 10]]}]
+
+
+def run(s):
+    return main.run(shlex.split(
+        "nagios_graphite -H http://example.com -M 'host.*' --per-series " + s))
+
+
+@parametrize("value, threshold, expected", [
+    (5, None, 5),
+    (5, "10", -5),
+    (12, "10", 2),
+    (-3, "10", 3),
+    (15, "10:", -5),
+    (15, "@10:20", 5),
+    (25, "@10:20", -5),
+])
+def test_badness(value, threshold, expected):
+    r = Range(threshold) if threshold is not None else None
+    assert perseries.badness(value, r) == expected
+
+
+@parametrize("stream", ["", "--stream"])
+@responses.activate
+def test_per_series_critical(stream):
+    responses.add(responses.GET, url_re, body=json.dumps(raw))
+    response = run("-A max -w 6 -c 7.5 --top 3 " + stream)
+
+    assert response.status.name == "CRIT"
+    assert response.message == (
+        "metric: 2 CRIT, 1 WARN of 10 series: host9 (max is 9.0), "
+        "host8 (max is 8.0), host7 (max is 7.0)")
+    assert response.perf_data["max"].value == 9.0
+    assert response.perf_data["critical"].value == 2
+    assert response.perf_data["warning"].value == 1
+
+
+@responses.activate
+def test_per_series_top_limits_offenders():
+    responses.add(responses.GET, url_re, body=json.dumps(raw))
+    response = run("-A max -w 3 --top 2")
+
+    assert response.status.name == "WARN"
+    assert response.message == (
+        "metric: 6 WARN of 10 series: host9 (max is 9.0), host8 (max is 8.0)")
+
+
+@responses.activate
+def test_per_series_ok():
+    responses.add(responses.GET, url_re, body=json.dumps(raw))
+    response = run("-A avg -w ~:100")
+
+    assert response.status.name == "OK"
+    assert response.message == (
+        "metric: 10 series OK, worst host9 (avg is 6.75)")
+
+
+@responses.activate
+def test_per_series_lower_bound_ranks_low_values_worst():
+    responses.add(responses.GET, url_re, body=json.dumps(raw))
+    response = run("-A min -w 2: --top 1")
+
+    assert response.status.name == "WARN"
+    assert response.message == (
+        "metric: 4 WARN of 10 series: host0 (min is 0.0)")
+
+
+@responses.activate
+def test_per_series_no_data():
+    responses.add(responses.GET, url_re, body="[]")
+    assert run("-A max").status.name == "UNKNOWN"
+
+
+def test_per_series_single_algorithm():
+    response = run("-A max,min")
+    assert response.status.name == "UNKNOWN"
+    assert "--per-series takes a single algorithm" in response.message
+
+
+def test_worst_series_is_bounded():
+    plugin = main.GraphiteNagios(shlex.split(
+        "nagios_graphite -H http://example.com -M x -w 500"))
+    worst = perseries.WorstSeries(plugin, top=3)
+    for i in range(1000):
+        worst.add("s{0}".format(i), (i * 7919) % 1000)
+        assert len(worst._heap) <= 3
+    assert [o.value for o in worst.worst()] == [999, 998, 997]
+    assert worst.total == 1000
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+import re
+import json
+import shlex
+import pstats
+
+import responses
+
+from nagios_graphite import main, profiling
+
+url_re = re.compile("^{}.*$".format(re.escape("http://example.com")))
+
+raw = [{"target": "a", "datapoints": [[1.0, 10], [None, 20], [4.0, 30]]}]
+
+
+def run(s):
+    return main.run(shlex.split(
+        "nagios_graphite -H http://example.com -M 'x.*' -A max " + s))
+
+
+def test_output_path():
+    assert profiling.output_path("/tmp/p.{pid}.{time}", 42, 1.5) == \
+        "/tmp/p.42.1"
+    assert profiling.output_path("/tmp/p", 42, 1.5) == "/tmp/p"
+
+
+def test_sampled():
+    assert profiling.sampled(1)
+    assert profiling.sampled(0)
+    assert 200 < sum(profiling.sampled(4) for _ in range(2000)) < 800
+
+
+@responses.activate
+def test_profile_out(tmpdir):
+    responses.add(responses.GET, url_re, body=json.dumps(raw))
+    path = tmpdir.join("check.{pid}.prof")
+    response = run("-w 2 --profile-out {0}".format(path))
+
+    assert response.status.name == "WARN"
+    assert response.message == "metric (max is 4.0)"
+    [written] = tmpdir.listdir()
+    stats = pstats.Stats(str(written))
+    assert any(fn == "check" for _, _, fn in stats.stats)
+
+
+@responses.activate
+def test_memprofile_out(tmpdir):
+    responses.add(responses.GET, url_re, body=json.dumps(raw))
+    path = tmpdir.join("check.mem")
+    response = run("--memprofile-out {0}".format(path))
+
+    assert response.status.name == "OK"
+    content = path.read()
+    if profiling.tracemalloc is None:
+        assert "live objects created by the check" in content
+    else:
+        assert "allocations by line" in content
+
+
+@responses.activate
+def test_profile_write_failure_keeps_result(tmpdir, capsys):
+    responses.add(responses.GET, url_re, body=json.dumps(raw))
+    path = tmpdir.join("missing", "check.prof")
+    response = run("--profile-out {0}".format(path))
+
+    assert response.message == "metric (max is 4.0)"
+    _, err = capsys.readouterr()
+    assert "failed to write profile" in err
+
+
+@responses.activate
+def test_profile_not_sampled(tmpdir, monkeypatch):
+    responses.add(responses.GET, url_re, body=json.dumps(raw))
+    monkeypatch.setattr(profiling, "sampled", lambda every: False)
+    response = run("--profile-sample 10 --profile-out {0}".format(
+        tmpdir.join("check.prof")))
+
+    assert response.message == "metric (max is 4.0)"
+    assert not tmpdir.listdir()
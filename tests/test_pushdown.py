@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+import re
+import json
+import shlex
+import urlparse
+
+import pytest
+import responses
+parametrize = pytest.mark.parametrize
+
+from nagios_graphite import main, pushdown
+
+raw = [
+    {"target": "a", "datapoints": [[1.0, 10], [None, 20], [4.0, 30]]},
+    {"target": "b", "datapoints": [[2.0, 10], [8.0, 20], [None, 30]]},
+]
+
+
+def options_for(s):
+    argv = shlex.split(
+        "nagios_graphite -H http://example.com -M 'x.*' --pushdown " + s)
+    return main.GraphiteNagios(argv).options
+
+
+def test_can_push_down():
+    assert pushdown.can_push_down(["sum", "avg", "min", "max"])
+    for name in ["median", "95th", "nullcnt", "nullpct"]:
+        assert not pushdown.can_push_down(["sum", name])
+
+
+def test_rewrite():
+    assert pushdown.rewrite("x.*", ["avg", "sum"]).items() == [
+        ("sum", 'alias(consolidateBy(sumSeries('
+                'consolidateBy(x.*,"sum")),"sum"),"sum")'),
+        ("count", 'alias(consolidateBy(sumSeries('
+                  'consolidateBy(isNonNull(x.*),"sum")),"sum"),"count")'),
+    ]
+
+
+def combine_series(fn, series):
+    """Evaluate a pushed down expression the way graphite-web would"""
+
+    columns = zip(*[[p[0] for p in e["datapoints"]] for e in series])
+    return [fn(c) for c in columns]
+
+
+def normalize(target, series):
+    """Bring `series` to a common step the way the *Series functions do
+
+    Each series is coarsened with the consolidation function the target
+    sets on it, or average if it sets none.
+    """
+
+    step = max(e["step"] for e in series)
+    inner = re.search(r'Series\(consolidateBy\((.*),"(\w+)"\)\)', target)
+    function = inner.group(2) if inner else "average"
+    fn = {"sum": sum, "min": min, "max": max,
+          "average": lambda xs: sum(xs) / len(xs)}[function]
+    normalized = []
+    for e in series:
+        values = [p[0] for p in e["datapoints"]]
+        if "isNonNull" in target:
+            values = [float(v is not None) for v in values]
+        factor = step // e["step"]
+        buckets = [[v for v in values[i:i + factor] if v is not None]
+                   for i in range(0, len(values), factor)]
+        normalized.append([fn(b) if b else None for b in buckets])
+    return normalized
+
+
+mixed = [
+    {"target": "a", "step": 10,
+     "datapoints": [[3.0, 10], [None, 20], [1.0, 30], [5.0, 40]]},
+    {"target": "b", "step": 20, "datapoints": [[2.0, 20], [None, 40]]},
+]
+
+
+@parametrize("name", ["sum", "min", "max", "avg"])
+def test_partials_exact_with_mixed_steps(name):
+    partials = {}
+    for partial, target in pushdown.rewrite("x.*", [name]).items():
+        columns = zip(*normalize(target, mixed))
+        fold = pushdown.PARTIALS[partial][1]
+        values = [[v for v in c if v is not None] for c in columns]
+        partials[partial] = fold([fold(vs) for vs in values if vs])
+    expected = main.aggregate_series(mixed, [name])[name]
+    assert pushdown.finish(name, partials) == expected
+
+
+def fake_graphite(consolidate):
+    def series_fn(name):
+        def fn(column):
+            present = [v for v in column if v is not None]
+            if name == "count":
+                return float(len(present))
+            if not present:
+                return None
+            return {"sum": sum, "min": min, "max": max}[name](present)
+        return fn
+
+    def callback(request):
+        qs = urlparse.parse_qs(urlparse.urlparse(request.url).query)
+        assert qs["maxDataPoints"] == ["1"]
+        result = []
+        for target in qs["target"]:
+            alias = re.search(r',"(\w+)"\)$', target).group(1)
+            fold = pushdown.PARTIALS[alias][1]
+            values = combine_series(series_fn(alias), raw)
+            if consolidate:
+                values = [fold(values)]
+            result.append({"target": alias, "datapoints": [
+                [v, 10 * i] for i, v in enumerate(values)]})
+        return (200, {}, json.dumps(result))
+    return callback
+
+
+@parametrize("consolidate", [True, False])
+@responses.activate
+def test_check_pushdown_matches_local(consolidate):
+    url_re = re.compile("^{}.*$".format(re.escape("http://example.com")))
+    responses.add_callback(responses.GET, url_re,
+                           callback=fake_graphite(consolidate),
+                           content_type='application/json')
+
+    opts = options_for("-A avg,sum,min,max")
+    expected = main.aggregate_series(raw, ["avg", "sum", "min", "max"])
+    assert main.check_graphite_all(opts) == expected
+    assert len(responses.calls) == 1
+
+
+@responses.activate
+def test_check_pushdown_falls_back(capsys):
+    url_re = re.compile("^{}.*$".format(re.escape("http://example.com")))
+    responses.add(responses.GET, url_re, body=json.dumps(raw), status=200,
+                  content_type='application/json')
+
+    opts = options_for("-A sum,median -v")
+    assert main.check_graphite_all(opts) == main.aggregate_series(
+        raw, ["sum", "median"])
+    assert "maxDataPoints" not in responses.calls[0].request.url
+    assert "aggregating locally" in capsys.readouterr()[1]
+
+
+@responses.activate
+def test_check_pushdown_empty():
+    url_re = re.compile("^{}.*$".format(re.escape("http://example.com")))
+    responses.add(responses.GET, url_re, body="[]", status=200,
+                  content_type='application/json')
+    assert main.check_graphite_all(options_for("-A max")) is None
+
+
+def test_finish_avg_without_values():
+    with pytest.raises(main.EmptyQueryResult):
+        pushdown.finish("avg", {"sum": 0, "count": 0})
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+import random
+
+import pytest
+parametrize = pytest.mark.parametrize
+
+from nagios_graphite import selection
+from nagios_graphite.main import FUNCTIONS, PERCENTILES
+
+
+def reference_percentile(xs, n):
+    return sorted(xs)[int(len(xs)*n)]
+
+
+def median_of_three_killer(size):
+    """Classic adversarial input for median-of-three quickselect"""
+
+    k = size // 2
+    xs = [0] * size
+    for i in range(1, k + 1):
+        if i % 2:
+            xs[i - 1] = i
+            xs[i] = k + i
+        xs[k + i - 1] = 2 * i
+    return xs
+
+
+def inputs():
+    rnd = random.Random(1234)
+    yield [rnd.random() for _ in range(1000)]
+    yield [rnd.randint(-50, 50) for _ in range(1000)]
+    yield range(1000)
+    yield range(1000, 0, -1)
+    yield [7] * 1000
+    yield [1, 2] * 500
+    yield range(500) + range(500, 0, -1)
+    yield median_of_three_killer(1000)
+    yield [3.5]
+    yield [2, 1]
+
+
+@parametrize("xs", list(inputs()))
+def test_select_matches_sort(xs):
+    expected = sorted(xs)
+    for k in set([0, len(xs) // 2, len(xs) - 1]):
+        assert selection.select(list(xs), k) == expected[k]
+
+
+@parametrize("xs", list(inputs()))
+def test_select_many_matches_sort(xs):
+    expected = sorted(xs)
+    ks = [selection.percentile_rank(len(xs), n)
+          for n in PERCENTILES.values()]
+    ks = [k for k in ks if k < len(xs)]
+
+    result = selection.select_many(list(xs), ks)
+    assert result == dict((k, expected[k]) for k in ks)
+
+
+def test_select_many_random_ranks():
+    rnd = random.Random(99)
+    for _ in range(50):
+        xs = [rnd.randint(0, 100) for _ in range(rnd.randint(1, 300))]
+        ks = [rnd.randrange(len(xs)) for _ in range(5)]
+        expected = sorted(xs)
+        ys = list(xs)
+        assert selection.select_many(ys, ks) == dict(
+            (k, expected[k]) for k in ks)
+        assert sorted(ys) == expected
+
+
+def test_select_many_no_ranks():
+    assert selection.select_many([], []) == {}
+
+
+def test_select_out_of_range():
+    with pytest.raises(IndexError):
+        selection.select([], 0)
+    with pytest.raises(IndexError):
+        selection.select([1, 2, 3], 3)
+
+
+@parametrize("xs", list(inputs()))
+def test_percentile_functions_match_sort(xs):
+    for name, n in PERCENTILES.iteritems():
+        assert FUNCTIONS[name](xs) == reference_percentile(xs, n)
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+import json
+from array import array
+
+import pytest
+parametrize = pytest.mark.parametrize
+
+from nagios_graphite import main
+from nagios_graphite.series import (
+    CompactSeries, as_dicts, jsonable, point_count)
+
+series = {"target": "foo", "datapoints": [[1.5, 100], [None, 110],
+                                          [-2.0, 120], [4.0, 130]]}
+
+
+def test_from_dict_round_trip():
+    compact = CompactSeries.from_dict(series)
+    assert (compact.target, compact.start, compact.step) == ("foo", 100, 10)
+    assert isinstance(compact.values, array)
+    assert compact.as_dict() == series
+    assert list(compact.timestamps()) == [100, 110, 120, 130]
+
+
+def test_from_dict_requires_even_spacing():
+    uneven = {"target": "foo", "datapoints": [[1, 100], [2, 110], [3, 130]]}
+    with pytest.raises(ValueError):
+        CompactSeries.from_dict(uneven)
+
+
+def test_from_dict_empty():
+    compact = CompactSeries.from_dict({"target": "foo", "datapoints": []})
+    assert len(compact) == 0
+    assert compact.as_dict() == {"target": "foo", "datapoints": []}
+
+
+def test_null_is_nan():
+    compact = CompactSeries("foo", 0, 60, [1.0, None])
+    assert compact.values[1] != compact.values[1]
+    assert list(compact) == [1.0, None]
+
+
+def test_dict_access():
+    compact = CompactSeries.from_dict(series)
+    assert compact["target"] == "foo"
+    assert compact["datapoints"] == series["datapoints"]
+    assert compact.get("tags") is None
+    with pytest.raises(KeyError):
+        compact["tags"]
+
+
+def test_slots():
+    compact = CompactSeries("foo", 0, 60)
+    with pytest.raises(AttributeError):
+        compact.extra = 1
+
+
+@parametrize("name", sorted(main.FUNCTIONS))
+def test_functions_accept_compact_series(name):
+    compact = CompactSeries.from_dict(series)
+    fn = main.FUNCTIONS[name]
+    assert fn(compact) == fn(p[0] for p in series["datapoints"])
+    assert main.combine([compact], fn) == main.combine([series], fn)
+
+
+def test_combine_mixed():
+    compact = CompactSeries("bar", 0, 60, [None, 10.0])
+    assert main.combine([series, compact], main.FUNCTIONS["sum"]) == 13.5
+    assert list(main.iter_values([compact, series]))[:3] == [None, 10.0, 1.5]
+
+
+def test_helpers():
+    compact = CompactSeries.from_dict(series)
+    assert point_count(compact) == point_count(series) == 4
+    assert as_dicts([compact, series]) == [series, series]
+    assert json.loads(json.dumps([compact], default=jsonable)) == [series]
+    with pytest.raises(TypeError):
+        json.dumps(object(), default=jsonable)
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+import re
+import json
+import random
+import shlex
+
+import pytest
+import responses
+parametrize = pytest.mark.parametrize
+
+from nagios_graphite import main
+from nagios_graphite.sketch import DDSketch
+
+rnd = random.Random(7)
+DATASETS = {
+    "uniform": [rnd.uniform(0, 100) for _ in range(5000)],
+    "lognormal": [rnd.lognormvariate(0, 3) for _ in range(5000)],
+    "signed": [rnd.gauss(0, 50) for _ in range(5000)],
+    "ints": [rnd.randint(-10, 1000) for _ in range(5000)],
+    "nulls": [None if rnd.random() < 0.3 else rnd.expovariate(0.01)
+              for _ in range(5000)],
+    "tiny": [3.0, None, -1.5],
+}
+
+
+def within(estimate, exact, accuracy):
+    return abs(estimate - exact) <= accuracy * abs(exact) + 1e-12
+
+
+@parametrize("accuracy", [0.01, 0.05])
+@parametrize("dataset", sorted(DATASETS))
+def test_quantiles_within_relative_error(dataset, accuracy):
+    values = DATASETS[dataset]
+    sketch = DDSketch(accuracy).update(values)
+    for n in [0, 0.01, 0.25, 0.5, 0.95, 0.99, 0.999]:
+        exact = main.Summary(True).update(values).percentile(n)
+        assert within(sketch.quantile(n), exact, accuracy)
+
+
+@parametrize("name, exact", [
+    ("median~", "median"), ("95th~", "95th"),
+    ("99th~", "99th"), ("999th~", "999th")])
+def test_functions_within_relative_error(name, exact):
+    for values in DATASETS.values():
+        assert within(main.FUNCTIONS[name](iter(values)),
+                      main.FUNCTIONS[exact](values), main.DEFAULT_ACCURACY)
+
+
+def test_merge_matches_single_sketch():
+    values = DATASETS["signed"] + [0, 0.0]
+    whole = DDSketch().update(values)
+    merged = DDSketch().update(values[:1000])
+    merged.merge(DDSketch().update(values[1000:])).merge(DDSketch())
+    assert merged.to_dict() == whole.to_dict()
+    assert DDSketch().merge(whole).to_dict() == whole.to_dict()
+
+
+def test_merge_requires_same_accuracy():
+    with pytest.raises(ValueError):
+        DDSketch(0.01).merge(DDSketch(0.02))
+
+
+def test_add_matches_update():
+    values = DATASETS["ints"]
+    sketch = DDSketch()
+    for x in values:
+        sketch.add(x)
+    assert sketch.to_dict() == DDSketch().update(values).to_dict()
+
+
+def test_serialization_round_trip():
+    sketch = DDSketch(0.02).update(DATASETS["signed"] + [0])
+    state = json.loads(json.dumps(sketch.to_dict()))
+    copy = DDSketch.from_dict(state)
+    assert copy.to_dict() == sketch.to_dict()
+    assert copy.quantile(0.99) == sketch.quantile(0.99)
+
+
+def test_memory_is_bounded():
+    sketch = DDSketch().update(rnd.uniform(1, 1000) for _ in range(100000))
+    assert sketch.count == 100000
+    # log(1000) / log(1.01 / 0.99) is about 346 bins
+    assert sketch.bins <= 350
+
+
+def test_invalid():
+    with pytest.raises(ValueError):
+        DDSketch().quantile(0.5)
+    for accuracy in [0, 1, -0.1]:
+        with pytest.raises(ValueError):
+            DDSketch(accuracy)
+
+
+def test_summary_keeps_no_values():
+    summary = main.Summary(accuracy=0.05).update(iter(DATASETS["nulls"]))
+    assert summary.values is None
+    assert summary.sketch.count == summary.size
+    result = main.aggregate(iter(DATASETS["nulls"]), ["99th~"], accuracy=0.05)
+    assert result["99th~"] == summary.approximate_percentile(0.99)
+
+
+@responses.activate
+def test_check_reports_error_bound(capsys):
+    url_re = re.compile("^{}.*$".format(re.escape("http://example.com")))
+    responses.add(responses.GET, url_re, body=json.dumps([
+        {"target": "x", "datapoints": [[v, i] for i, v in
+                                       enumerate(DATASETS["uniform"])]}]))
+    response = main.run(shlex.split(
+        "nagios_graphite -H http://example.com -M x -A 99th~,99th -v "
+        "--sketch-accuracy 0.02"))
+
+    assert response.status.name == "OK"
+    estimate = response.perf_data["99th~"].value
+    assert within(estimate, response.perf_data["99th"].value, 0.02)
+    assert "99th~ estimated within 2% of the exact percentile" in (
+        capsys.readouterr()[1])
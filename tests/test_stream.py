@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+import re
+import json
+import shlex
+
+import pytest
+import responses
+parametrize = pytest.mark.parametrize
+
+from nagios_graphite import main, stream, vectorized
+
+series = [
+    {"target": "foo", "datapoints": [[1.5, 10], [None, 11], [-3e2, 12]]},
+    {"datapoints": [], "target": u"b\xe4r", "tags": {"name": "bar"}},
+    {"target": "baz", "datapoints": [[7, 10], [0.25, 11]]},
+]
+body = json.dumps(series)
+
+
+def chunked(s, size):
+    s = s.encode("utf-8") if isinstance(s, unicode) else s
+    return [s[i:i + size] for i in range(0, len(s), size)]
+
+
+def events_to_series(events):
+    result, points = [], None
+    for event in events:
+        if event[0] == stream.SERIES_START:
+            points = []
+        elif event[0] == stream.VALUE:
+            points.append([event[1], event[2]])
+        else:
+            meta = dict(event[1])
+            meta["datapoints"] = points
+            result.append(meta)
+    return result
+
+
+@parametrize("size", [1, 2, 3, 7, 64, 4096])
+def test_iter_events_matches_json(size):
+    events = stream.iter_events(chunked(body, size))
+    assert events_to_series(events) == series
+
+
+def test_iter_events_any_split():
+    # One boundary anywhere, including right after "[" or a complete pair
+    encoded = body.encode("utf-8")
+    for i in range(1, len(encoded)):
+        events = stream.iter_events([encoded[:i], encoded[i:]])
+        assert events_to_series(events) == series, i
+
+
+def test_iter_events_large_body():
+    rows = [{"target": "host{0}".format(i),
+             "datapoints": [[None if j % 5 == 0 else j * 1.5, j]
+                            for j in range(2000)]} for i in range(20)]
+    data = json.dumps(rows)
+    events = stream.iter_events(chunked(data, stream.CHUNK_SIZE))
+    assert events_to_series(events) == rows
+
+
+def test_iter_events_whitespace():
+    doc = json.dumps(series, indent=4)
+    assert events_to_series(stream.iter_events(chunked(doc, 5))) == series
+
+
+def test_iter_events_empty():
+    assert list(stream.iter_events(["[", "]"])) == []
+
+
+@parametrize("doc", [
+    "", "[", '[{"target": "foo"', '[{"datapoints": [[1, 2]', "{}",
+    '[{"datapoints": [[1, 2, 3]]}]', '[{"datapoints": [["a", 1]]}]',
+])
+def test_iter_events_malformed(doc):
+    with pytest.raises(ValueError):
+        list(stream.iter_events(chunked(doc, 3)))
+
+
+def test_parse_number():
+    assert stream.parse_number("null") is None
+    assert type(stream.parse_number("12")) is int
+    assert stream.parse_number("1.5e2") == 150.0
+
+
+def test_render_stream_counts():
+    rs = stream.RenderStream(stream.iter_events(chunked(body, 16)))
+    assert list(rs.values()) == [1.5, None, -300.0, 7, 0.25]
+    assert (rs.series, rs.points) == (3, 5)
+
+
+def options_for(s):
+    argv = shlex.split("nagios_graphite --stream " + s)
+    return main.GraphiteNagios(argv).options
+
+
+@responses.activate
+def test_check_graphite_stream():
+    opts = options_for("-M foo -H http://example.com -A all --backend python")
+    url_re = re.compile("^{}.*$".format(re.escape(opts.hostname)))
+    responses.add(responses.GET, url_re, body=body, status=200,
+                  content_type='application/json')
+
+    expected = main.aggregate_series(series, main.parse_functions("all"))
+    assert main.check_graphite_all(opts) == expected
+
+
+@responses.activate
+@parametrize("extra", ["", "--max-datapoints 1000"])
+def test_check_graphite_stream_is_single_pass(extra, monkeypatch):
+    def from_values(values):
+        raise AssertionError("streamed values loaded into an array")
+
+    monkeypatch.setattr(vectorized.Values, "from_values", from_values)
+    monkeypatch.setattr(main, "resolve_backend", lambda name: "numpy")
+    opts = options_for("-M foo -H http://example.com -A avg,99th " + extra)
+    url_re = re.compile("^{}.*$".format(re.escape(opts.hostname)))
+    responses.add(responses.GET, url_re, body=body, status=200,
+                  content_type='application/json')
+
+    expected = main.aggregate(main.iter_values(series), ["avg", "99th"])
+    assert main.check_graphite_all(opts) == expected
+
+
+@responses.activate
+def test_check_graphite_stream_empty():
+    opts = options_for("-M foo -H http://example.com")
+    url_re = re.compile("^{}.*$".format(re.escape(opts.hostname)))
+    responses.add(responses.GET, url_re, body="[]", status=200)
+    assert main.check_graphite_all(opts) is None
+
+
+@responses.activate
+def test_check_graphite_stream_failure():
+    opts = options_for("-M foo -H http://example.com")
+    url_re = re.compile("^{}.*$".format(re.escape(opts.hostname)))
+    responses.add(responses.GET, url_re, status=500)
+    assert main.check_graphite_all(opts) is None
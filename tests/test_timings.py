@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+import re
+import json
+import shlex
+
+import responses
+
+from nagios_graphite import main, timings
+
+url_re = re.compile("^{}.*$".format(re.escape("http://example.com")))
+
+raw = [
+    {"target": "a", "datapoints": [[1.0, 10], [None, 20], [4.0, 30]]},
+    {"target": "b", "datapoints": [[2.0, 10], [8.0, 20]]},
+]
+body = json.dumps(raw)
+
+
+def plugin_for(s):
+    return main.GraphiteNagios(shlex.split(
+        "nagios_graphite -H http://example.com -M 'x.*' " + s))
+
+
+def perf_values(response):
+    return dict((label, perf.value)
+                for label, perf in response.perf_data.items())
+
+
+@responses.activate
+def test_timings_perf_data():
+    responses.add(responses.GET, url_re, body=body)
+    response = plugin_for("-A max --timings").check()
+
+    perf = perf_values(response)
+    assert sorted(perf) == [
+        "agg_ms", "bytes", "fetch_ms", "max", "parse_ms", "points", "series"]
+    assert perf["max"] == 8.0
+    assert (perf["bytes"], perf["series"], perf["points"]) == (
+        len(body), 2, 5)
+    assert all(perf[k] >= 0 for k in ["fetch_ms", "parse_ms", "agg_ms"])
+
+
+@responses.activate
+def test_timings_stream():
+    responses.add(responses.GET, url_re, body=body)
+    response = plugin_for("-A max --timings --stream").check()
+
+    perf = perf_values(response)
+    assert "agg_ms" not in perf
+    assert (perf["bytes"], perf["series"], perf["points"]) == (
+        len(body), 2, 5)
+
+
+@responses.activate
+def test_no_timings_by_default():
+    responses.add(responses.GET, url_re, body=body)
+    response = plugin_for("-A max").check()
+    assert sorted(response.perf_data) == ["max"]
+
+
+def test_timings_prefetched():
+    plugin = plugin_for("-A sum --timings")
+    plugin.raw_data = raw
+    perf = perf_values(plugin.check())
+    assert (perf["bytes"], perf["fetch_ms"], perf["points"]) == (0, 0, 5)
+
+
+class SlowResponse(object):
+    ok = True
+
+    def iter_content(self, chunk_size=1):
+        for chunk in ["ab", "cde"]:
+            yield chunk
+
+
+def test_timed_response_counts_chunks():
+    t = timings.Timings()
+    resp = timings.TimedResponse(SlowResponse(), t)
+    assert list(resp.iter_content(2)) == ["ab", "cde"]
+    assert t.bytes == 5
+    assert resp.ok
+
+
+def test_perf_data_order():
+    t = timings.Timings()
+    t.start()
+    t.start_aggregation(raw)
+    t.finish()
+    assert [label for label, _ in t.perf_data()] == [
+        "fetch_ms", "parse_ms", "agg_ms", "bytes", "series", "points"]
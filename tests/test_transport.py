@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import json
+import shlex
+import base64
+import threading
+import subprocess
+import BaseHTTPServer
+
+import pytest
+
+from nagios_graphite import main, transport
+
+series = [{"target": "foo", "datapoints": [[1.0, 10], [None, 11]]}]
+
+
+class RenderHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests.append(self)
+        status = 500 if "broken" in self.path else 200
+        body = json.dumps(series) if status == 200 else "error"
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = BaseHTTPServer.HTTPServer(("127.0.0.1", 0), RenderHandler)
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,))
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def options_for(server, s):
+    hostname = "http://127.0.0.1:{0}/render".format(server.server_address[1])
+    argv = shlex.split("nagios_graphite --transport urllib -H {0} {1}".format(
+        hostname, s))
+    return main.GraphiteNagios(argv).options
+
+
+def test_graphite_session_urllib(server):
+    opts = options_for(server, "-M foo -U user -P pass")
+    session = main.graphite_session(opts)
+    assert isinstance(session, transport.UrllibSession)
+    assert session.auth == ("user", "pass")
+
+
+def test_graphite_fetch_urllib(server):
+    opts = options_for(server, "-M foo -U user -P pass")
+    assert main.graphite_fetch(opts) == series
+
+    [request] = server.requests
+    assert request.headers["Authorization"] == "Basic " + base64.b64encode(
+        "user:pass")
+    assert "target=foo" in request.path
+
+
+def test_graphite_fetch_urllib_failure(server):
+    opts = options_for(server, "-M broken")
+    assert main.graphite_fetch(opts) == []
+
+
+def test_check_graphite_stream_urllib(server):
+    opts = options_for(server, "-M foo --stream -A nullcnt,max")
+    assert list(main.check_graphite_all(opts).items()) == [
+        ("nullcnt", 1), ("max", 1.0)]
+
+
+def test_response_iter_content_after_read(server):
+    opts = options_for(server, "-M foo")
+    resp = transport.UrllibSession().get(main.graphite_url(opts))
+    assert resp.ok
+    assert "".join(resp.iter_content(4)) == json.dumps(series)
+
+
+def test_main_does_not_import_requests():
+    code = ("import sys, nagios_graphite.main; "
+            "sys.exit('requests' in sys.modules)")
+    assert subprocess.call([sys.executable, "-c", code]) == 0
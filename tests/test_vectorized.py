@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+import random
+
+import pytest
+parametrize = pytest.mark.parametrize
+
+from nagios_graphite import main, vectorized
+
+pytestmark = pytest.mark.skipif(
+    not vectorized.available(), reason="numpy is not installed")
+
+rnd = random.Random(42)
+floats = [rnd.uniform(-100, 100) for _ in range(1000)]
+ints = range(1000)
+rnd.shuffle(ints)
+with_nulls = [None if rnd.random() < 0.2 else x for x in floats]
+
+
+@parametrize("data", [floats, ints, with_nulls, [None, 3, None, 4], [2.5],
+                      [1, 2.5, 3], [None, 3.5, 7, -2, None, 0.5]])
+def test_functions_match_python(data):
+    assert set(vectorized.FUNCTIONS) == set(main.FUNCTIONS)
+    for name, fn in main.FUNCTIONS.iteritems():
+        expected = fn(data)
+        result = vectorized.FUNCTIONS[name](
+            vectorized.Values.from_values(data))
+        assert result == expected
+        assert type(result) is type(expected)
+
+
+def test_functions_raise_on_empty():
+    for name, fn in vectorized.FUNCTIONS.iteritems():
+        with pytest.raises(main.EmptyQueryResult):
+            fn(vectorized.Values.from_values([]))
+
+
+def test_values_only_raise_on_nulls():
+    values = vectorized.Values.from_values([None, None])
+    assert vectorized.FUNCTIONS["nullcnt"](values) == 2
+    with pytest.raises(main.EmptyQueryResult):
+        vectorized.FUNCTIONS["sum"](values)
+
+
+def test_from_series():
+    series = [
+        {"target": "foo", "datapoints": [[1.0, 10], [None, 11]]},
+        {"target": "bar", "datapoints": []},
+        {"target": "baz", "datapoints": [[3.0, 10]]},
+    ]
+    values = vectorized.Values.from_series(series)
+    assert values.count == 3
+    assert values.nulls == 1
+    assert list(values.present) == [1.0, 3.0]
+    assert not values.integral
+
+
+def test_from_series_keeps_types():
+    series = [
+        {"target": "foo", "datapoints": [[1, 10], [None, 11], [2.5, 12]]},
+        {"target": "bar", "datapoints": [[4, 10]]},
+    ]
+    names = ["min", "max", "median", "999th", "sum"]
+    result = main.aggregate_series(series, names, "numpy")
+    assert result == main.aggregate_series(series, names, "python")
+    assert [type(x) for x in result.values()] == [int, int, float, int, float]
+
+
+@parametrize("data", [[2 ** 53 + 1, None, 1], [2 ** 53 + 1, 0.5, 3]])
+def test_large_integers_are_exact(data):
+    series = [{"target": "foo",
+               "datapoints": [[x, i] for i, x in enumerate(data)]}]
+    names = ["max", "median", "sum", "avg"]
+    result = main.aggregate_series(series, names, "numpy")
+    assert result == main.aggregate_series(series, names, "python")
+    assert result["max"] == 2 ** 53 + 1
+
+
+def test_aggregate_matches_python():
+    series = [{"target": "foo",
+               "datapoints": [[x, i] for i, x in enumerate(with_nulls)]}]
+    names = main.parse_functions("all")
+    assert main.aggregate_series(series, names, "numpy") == \
+        main.aggregate_series(series, names, "python")
+
+
+def test_resolve_backend():
+    assert main.resolve_backend("auto") == "numpy"
+    assert main.resolve_backend("python") == "python"
+    with pytest.raises(ValueError):
+        main.resolve_backend("fortran")
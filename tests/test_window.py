@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+
+import re
+import json
+import time
+import shlex
+import urlparse
+
+import pytest
+import responses
+parametrize = pytest.mark.parametrize
+
+from nagios_graphite import main, window
+
+NOW = 1420070400
+
+
+def options_for(s):
+    argv = shlex.split("nagios_graphite -H http://example.com " + s)
+    return main.GraphiteNagios(argv).options
+
+
+@parametrize("offset,seconds", [
+    ("1minute", 60), ("-5min", 300), ("24hours", 86400), ("7days", 604800),
+    ("2weeks", 1209600), ("1mon", 2592000), ("1year", 31536000),
+    ("30s", 30), ("20150101", None), ("now", None), ("1m", None),
+])
+def test_parse_offset(offset, seconds):
+    assert window.parse_offset(offset) == seconds
+
+
+def test_format_from_epoch():
+    assert main.format_from("1420070400") == "1420070400"
+
+
+def test_series_step():
+    assert window.series_step([]) is None
+    assert window.series_step([{"datapoints": [[1, 10]]}]) is None
+    assert window.series_step([{"datapoints": [[1, 10], [2, 70]]}]) == 60
+
+
+def test_merge_and_evict():
+    stored = [
+        {"target": "a", "datapoints": [[1, 0], [2, 60], [None, 120]]},
+        {"target": "gone", "datapoints": [[1, 0]]},
+    ]
+    delta = [
+        {"target": "a", "datapoints": [[3, 120], [4, 180]]},
+        {"target": "new", "datapoints": [[5, 180]]},
+    ]
+    merged = window.evict(window.merge(stored, delta), 0)
+    assert merged == [
+        {"target": "a", "datapoints": [[2, 60], [3, 120], [4, 180]]},
+        {"target": "new", "datapoints": [[5, 180]]},
+    ]
+
+
+class FakeGraphite(object):
+    """Serves a series with one point per minute, value == timestamp"""
+
+    def __init__(self, now, step=60):
+        self.now = now
+        self.step = step
+        self.requests = []
+
+    def __call__(self, request):
+        qs = urlparse.parse_qs(urlparse.urlparse(request.url).query)
+        start = qs["from"][0]
+        self.requests.append(start)
+        if start.startswith("-"):
+            start = self.now - window.parse_offset(start)
+        start = int(start) - int(start) % self.step + self.step
+        points = [[float(ts), ts]
+                  for ts in range(start, self.now + 1, self.step)]
+        return (200, {}, json.dumps([{"target": "a", "datapoints": points}]))
+
+
+def add_fake(fake):
+    url_re = re.compile("^{}.*$".format(re.escape("http://example.com")))
+    responses.add_callback(responses.GET, url_re, callback=fake,
+                           content_type='application/json')
+
+
+@responses.activate
+def test_sliding_window_fetches_delta(tmpdir):
+    fake = FakeGraphite(NOW)
+    add_fake(fake)
+    w = window.SlidingWindow(str(tmpdir), overlap=120)
+    opts = options_for("-M a -F 1hour")
+
+    first = w.fetch(opts, now=NOW)
+    assert len(first[0]["datapoints"]) == 60
+
+    fake.now = NOW + 300
+    second = w.fetch(opts, now=NOW + 300)
+    assert fake.requests == ["-1hour", str(NOW - 120)]
+
+    fake.requests = []
+    full = main.graphite_fetch(opts)
+    assert second == full
+
+
+@responses.activate
+def test_sliding_window_refresh(tmpdir):
+    fake = FakeGraphite(NOW)
+    add_fake(fake)
+    w = window.SlidingWindow(str(tmpdir), refresh=600)
+    opts = options_for("-M a -F 1hour")
+
+    w.fetch(opts, now=NOW)
+    fake.now = NOW + 900
+    w.fetch(opts, now=NOW + 900)
+    assert fake.requests == ["-1hour", "-1hour"]
+
+
+@responses.activate
+def test_sliding_window_resolution_change(tmpdir):
+    fake = FakeGraphite(NOW)
+    add_fake(fake)
+    w = window.SlidingWindow(str(tmpdir))
+    opts = options_for("-M a -F 1hour")
+
+    w.fetch(opts, now=NOW)
+    fake.step, fake.now = 10, NOW + 60
+    series = w.fetch(opts, now=NOW + 60)
+    assert fake.requests == ["-1hour", str(NOW - 120), "-1hour"]
+    assert window.series_step(series) == 10
+
+
+@responses.activate
+def test_sliding_window_function_target(tmpdir):
+    fake = FakeGraphite(NOW)
+    add_fake(fake)
+    w = window.SlidingWindow(str(tmpdir))
+    opts = options_for("-M 'nonNegativeDerivative(a)' -F 1hour")
+
+    w.fetch(opts, now=NOW)
+    fake.now = NOW + 60
+    w.fetch(opts, now=NOW + 60)
+    assert fake.requests == ["-1hour", "-1hour"]
+    assert tmpdir.listdir() == []
+    assert window.plain_target("servers.*.cpu")
+
+
+@responses.activate
+def test_sliding_window_absolute_until(tmpdir):
+    fake = FakeGraphite(NOW)
+    add_fake(fake)
+    w = window.SlidingWindow(str(tmpdir))
+    opts = options_for("-M a -F 1hour -u 5min")
+
+    w.fetch(opts, now=NOW)
+    w.fetch(opts, now=NOW)
+    assert fake.requests == ["-1hour", "-1hour"]
+    assert tmpdir.listdir() == []
+
+
+@responses.activate
+def test_check_graphite_delta(tmpdir):
+    now = int(time.time()) // 60 * 60
+    add_fake(FakeGraphite(now))
+    opts = options_for("-M a -F 10min -A max --delta-dir {0}".format(tmpdir))
+    assert main.check_graphite_all(opts)["max"] == float(now)